@@ -6,10 +6,11 @@ app.py
 This is the main program for the Flask chatbot server
 """
 
+import os
 import sys
 import logging
 import uuid
-import time
+import functools
 
 import werkzeug
 werkzeug.cached_property = werkzeug.utils.cached_property # has to follow directly after import werkzeug
@@ -17,32 +18,68 @@ from flask import Flask, session, render_template, make_response #, request
 from flask_restx import Resource, Api #, fields
 
 from example.demochatbot import DemoChatBot
+from botstory.nlp import warm_up
+from botstory.sessionstore import create_session_store, SessionReaper
+from botstory.instrumentation import create_sink, add_sink, PrometheusSink
 
 logging.basicConfig(level=logging.CRITICAL)
+logger = logging.getLogger(__name__)
 
-SESSION_TIMEOUT = 7200 # Remove a user session after 2h of inactivity
-chatbots = {}
-lastactivity = {}
+# Remove a user session after 2h of inactivity by default
+SESSION_TIMEOUT = int(os.environ.get('BOTSTORY_SESSION_TIMEOUT', 7200))
+
+# Where session states are kept: 'memory', 'sqlite:///<path>' or
+# 'redis://<host>:<port>/<db>', see botstory.sessionstore
+SESSION_STORE = os.environ.get('BOTSTORY_SESSION_STORE', 'memory')
+
+# Stage timing metrics: '' (disabled), 'log' or 'prometheus' (served on
+# /metrics), see botstory.instrumentation
+METRICS = os.environ.get('BOTSTORY_METRICS', '')
 
 # Flask web interface
 def create_app():
+    # Load NLP resources once per worker before the first request
+    warm_up()
+
+    sessions = create_session_store(SESSION_STORE, SESSION_TIMEOUT)
+
+    # Expired sessions are removed in the background, not per request
+    reaper = SessionReaper(sessions, SESSION_TIMEOUT,
+                           min(60, max(1, SESSION_TIMEOUT // 10)))
+    reaper.start()
+
+    metrics = create_sink(METRICS)
+    if metrics is not None:
+        add_sink(metrics)
+
     app = Flask(__name__,
             static_url_path='/static',
             static_folder='www_static',
             template_folder='templates')
     app.secret_key = 'e6shg,.?)yysffSE/%fyaydgsgtu575b'
 
+    @functools.lru_cache(maxsize = None)
+    def template_data():
+        # Only depends on the bot definition, computed on first request
+        return DemoChatBot().get_template_data()
+
     @app.route("/")
     def index():
         # Load additional data for HTML template from bot storylines
-        chatbot = DemoChatBot()
-        data = chatbot.get_template_data()
+        data = template_data()
 
         # Show bot UI
         headers = {'Content-Type': 'text/html'}
         return make_response(render_template('home.html', \
                             **data), 200, headers)
 
+    if isinstance(metrics, PrometheusSink):
+        @app.route("/metrics")
+        def metrics_endpoint():
+            # Stage timing histograms for Prometheus scraping
+            return make_response(metrics.render(), 200,
+                                 { 'Content-Type': PrometheusSink.CONTENT_TYPE })
+
 
     api = Api(app = app,
             version = "1.0",
@@ -70,7 +107,7 @@ def create_app():
             # Session management: Unknown user pinging is meaningless
             if 'uid' not in session:
                 return False
-            lastactivity[str(session['uid'])] = int(time.time())
+            sessions.touch(str(session['uid']))
 
     @name_space_bot.route('/bot/<string:query>')
     class Query(Resource):
@@ -83,22 +120,24 @@ def create_app():
                 # Session management
                 if 'uid' not in session:
                     session['uid'] = uuid.uuid4()
-                lastactivity[str(session['uid'])] = int(time.time())
-                cleanup_sessions()
+                uid = str(session['uid'])
 
-                if str(session['uid']) not in chatbots:
-                    chatbots[str(session['uid'])] = \
-                            DemoChatBot()
+                # Sessions share the chatbot engine, only their state is kept
+                # in the session store
+                chatbot = DemoChatBot()
+                state = sessions.load(uid)
+                if state is None:
                     new_session = True
                 else:
+                    chatbot.set_session_state(state)
                     new_session = False
 
                 # Chat response
-                print(session['uid'])
-                response = chatbots[str(session['uid'])].process_query(query)
-                buttons = chatbots[str(session['uid'])].get_buttons_for_last_response()
+                response = chatbot.process_query(query)
+                buttons = chatbot.get_buttons_for_last_response()
+                sessions.save(uid, chatbot.get_session_state())
 
-                print ({ 'query': query, 'botresponse': response, 'buttons': buttons })
+                logger.info({ 'uid': uid, 'query': query, 'botresponse': response, 'buttons': buttons })
                 return { 'response': response, 'buttons': buttons, 'new_session': new_session }
             except KeyError as exception:
                 name_space_bot.abort(500, exception.__doc__, status = "Could not retrieve information", statusCode = "500")
@@ -111,25 +150,6 @@ def create_app():
             #     def get(self):
             #         return {'success': chatbot.train()}
 
-    def cleanup_sessions():
-        """
-        Delete inactive sessions
-        """
-
-        now = int(time.time())
-
-        for uid in dict(lastactivity):
-            diff = max(0, now - lastactivity[uid])
-            print("Last activity of {}: {} -- {} sec ago".format(uid, lastactivity[uid], diff))
-
-            if diff < SESSION_TIMEOUT:
-                continue
-
-            print("Cleaning up session {}.".format(uid))
-            del lastactivity[uid]
-            if uid in chatbots:
-                del chatbots[uid]
-
     return app
 
 if __name__ == '__main__': # start up Flask server
@@ -0,0 +1,330 @@
+"""
+(C) 2021 Julian von Mendel <prog@derjulian.net>
+
+asgi.py
+====================================
+This is the asyncio based ASGI chatbot server. It serves the same web UI and
+/chatbot/bot/<query> and /chatbot/ping API as app.py, but keeps connections
+on an event loop and processes chatbot turns on a bounded thread pool, so
+idle sessions do not occupy a worker thread.
+
+Run with an ASGI server, e.g. uvicorn asgi:app --port 8080
+"""
+
+import os
+import json
+import hmac
+import uuid
+import asyncio
+import hashlib
+import logging
+import mimetypes
+import weakref
+import http.cookies
+import concurrent.futures
+
+import jinja2
+
+from example.demochatbot import DemoChatBot
+from botstory.nlp import warm_up
+from botstory.sessionstore import create_session_store, SessionReaper
+from botstory.instrumentation import create_sink, add_sink, PrometheusSink
+
+logging.basicConfig(level=logging.CRITICAL)
+logger = logging.getLogger(__name__)
+
+# Remove a user session after 2h of inactivity by default
+SESSION_TIMEOUT = int(os.environ.get('BOTSTORY_SESSION_TIMEOUT', 7200))
+
+# Where session states are kept: 'memory', 'sqlite:///<path>' or
+# 'redis://<host>:<port>/<db>', see botstory.sessionstore
+SESSION_STORE = os.environ.get('BOTSTORY_SESSION_STORE', 'memory')
+
+# Stage timing metrics: '' (disabled), 'log' or 'prometheus' (served on
+# /metrics), see botstory.instrumentation
+METRICS = os.environ.get('BOTSTORY_METRICS', '')
+
+# Threads processing chatbot turns, and turns that may wait for a thread
+# before further requests are rejected
+WORKER_THREADS = int(os.environ.get('BOTSTORY_WORKER_THREADS', os.cpu_count() or 4))
+MAX_PENDING = int(os.environ.get('BOTSTORY_MAX_PENDING', 256))
+
+SECRET_KEY = os.environ.get('BOTSTORY_SECRET_KEY',
+                            'e6shg,.?)yysffSE/%fyaydgsgtu575b').encode('utf-8')
+SESSION_COOKIE = 'botstory_session'
+STATIC_FOLDER = 'www_static'
+TEMPLATE_FOLDER = 'templates'
+
+class ChatbotApp:
+    """
+    ASGI application for the chatbot server
+
+    :param SessionStore sessions: Session store, or None to create one from
+            SESSION_STORE
+    :param int worker_threads: Threads processing chatbot turns
+    :param int max_pending: Turns that may wait for a thread
+    :param metrics: Metric sink to register, or None to create one from
+            METRICS
+    """
+
+    def __init__(self, sessions = None, worker_threads = WORKER_THREADS, \
+                 max_pending = MAX_PENDING, metrics = None):
+        # Session store, metric sink and thread pool are created in setup(),
+        # so importing this module has no side effects
+        self.sessions = sessions
+        self.metrics = metrics
+        self.worker_threads = worker_threads
+        self.reaper = None
+        self.executor = None
+        self.max_pending = worker_threads + max_pending
+        self.pending = 0 # Turns submitted to the thread pool
+        self.session_locks = weakref.WeakValueDictionary() # uid -> asyncio.Lock
+        self.template_data = None # Depends on the bot definition only
+        self.templates = jinja2.Environment(
+                loader = jinja2.FileSystemLoader(TEMPLATE_FOLDER),
+                autoescape = True)
+
+    def setup(self):
+        """
+        Open the session store, register the metric sink, create the thread
+        pool and start session expiry. Called on lifespan startup, or on the
+        first request if the ASGI server does not send lifespan events.
+        """
+
+        if self.executor is not None:
+            return
+
+        if self.sessions is None:
+            self.sessions = create_session_store(SESSION_STORE, SESSION_TIMEOUT)
+        if self.metrics is None:
+            self.metrics = create_sink(METRICS)
+        if self.metrics is not None:
+            add_sink(self.metrics)
+
+        self.reaper = SessionReaper(self.sessions, SESSION_TIMEOUT,
+                                    min(60, max(1, SESSION_TIMEOUT // 10)))
+        self.reaper.start()
+        self.executor = concurrent.futures.ThreadPoolExecutor(self.worker_threads,
+                thread_name_prefix = 'botstory-worker')
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+            return
+
+        if scope['type'] != 'http':
+            return
+
+        self.setup()
+
+        path = scope['path']
+        if scope['method'] not in ('GET', 'HEAD'):
+            await self.respond(send, 405, b'Method not allowed')
+        elif path == '/':
+            await self.index(send)
+        elif path.startswith('/static/'):
+            await self.static(send, path[len('/static/'):])
+        elif path == '/metrics' and isinstance(self.metrics, PrometheusSink):
+            await self.respond(send, 200, self.metrics.render().encode('utf-8'),
+                               PrometheusSink.CONTENT_TYPE)
+        elif path == '/chatbot/ping':
+            await self.ping(scope, send)
+        elif path.startswith('/chatbot/bot/') and \
+                '/' not in path[len('/chatbot/bot/'):] and \
+                path != '/chatbot/bot/':
+            await self.query(scope, send, path[len('/chatbot/bot/'):])
+        else:
+            await self.respond(send, 404, b'Not found')
+
+    async def lifespan(self, receive, send):
+        """
+        Handle ASGI lifespan events: Create the server resources and load
+        NLP resources on startup, stop the thread pool on shutdown
+        """
+
+        while True:
+            message = await receive()
+
+            if message['type'] == 'lifespan.startup':
+                self.setup()
+                await self.run(warm_up)
+                await send({ 'type': 'lifespan.startup.complete' })
+            elif message['type'] == 'lifespan.shutdown':
+                if self.executor is not None:
+                    self.reaper.stop()
+                    self.executor.shutdown(wait = False)
+                await send({ 'type': 'lifespan.shutdown.complete' })
+                return
+
+    async def run(self, func, *args):
+        """
+        Run blocking or CPU bound work on the thread pool
+        """
+
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, func, *args)
+
+    async def respond(self, send, status, body, content_type = 'text/plain', \
+                      headers = None):
+        """
+        Send a complete HTTP response
+        """
+
+        response_headers = [ (b'content-type', content_type.encode('utf-8')),
+                             (b'content-length', str(len(body)).encode('utf-8')) ]
+        if headers is not None:
+            response_headers.extend(headers)
+
+        await send({ 'type': 'http.response.start', 'status': status,
+                     'headers': response_headers })
+        await send({ 'type': 'http.response.body', 'body': body })
+
+    async def respond_json(self, send, data, status = 200, headers = None):
+        """
+        Send a JSON response
+        """
+
+        await self.respond(send, status, json.dumps(data).encode('utf-8'),
+                           'application/json', headers)
+
+    def get_uid(self, scope):
+        """
+        Retrieve the session id from the signed session cookie
+
+        :return: Session id or None if there is no valid session cookie
+        :rtype: str
+        """
+
+        for name, value in scope['headers']:
+            if name != b'cookie':
+                continue
+
+            cookies = http.cookies.SimpleCookie(value.decode('latin-1'))
+            if SESSION_COOKIE not in cookies:
+                continue
+
+            uid, _, signature = cookies[SESSION_COOKIE].value.partition('.')
+            if hmac.compare_digest(signature, self.sign(uid)):
+                return uid
+
+        return None
+
+    @staticmethod
+    def sign(uid):
+        """
+        Signature of a session id for the session cookie
+        """
+
+        return hmac.new(SECRET_KEY, uid.encode('utf-8'), hashlib.sha256).hexdigest()
+
+    async def index(self, send):
+        """
+        Show bot UI
+        """
+
+        if self.template_data is None:
+            self.template_data = await self.run(lambda: DemoChatBot().get_template_data())
+
+        body = self.templates.get_template('home.html').render(**self.template_data)
+        await self.respond(send, 200, body.encode('utf-8'), 'text/html')
+
+    async def static(self, send, path):
+        """
+        Static files
+        """
+
+        root = os.path.abspath(STATIC_FOLDER)
+        filename = os.path.abspath(os.path.join(root, path))
+        if not filename.startswith(root + os.sep) or not os.path.isfile(filename):
+            await self.respond(send, 404, b'Not found')
+            return
+
+        def read():
+            with open(filename, 'rb') as static_file:
+                return static_file.read()
+
+        content_type = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        await self.respond(send, 200, await self.run(read), content_type)
+
+    async def ping(self, scope, send):
+        """
+        Keep a session alive
+        """
+
+        # Session management: Unknown user pinging is meaningless
+        uid = self.get_uid(scope)
+        if uid is None:
+            await self.respond_json(send, False)
+            return
+
+        await self.run(self.sessions.touch, uid)
+        await self.respond_json(send, None)
+
+    async def query(self, scope, send, query):
+        """
+        Chat response to a user prompt
+        """
+
+        # Session management
+        uid = self.get_uid(scope)
+        headers = []
+        if uid is None:
+            uid = str(uuid.uuid4())
+            cookie = '{}={}.{}; Path=/; HttpOnly'.format(SESSION_COOKIE, uid,
+                                                        self.sign(uid))
+            headers.append((b'set-cookie', cookie.encode('latin-1')))
+
+        # Turns of the same session are processed in order
+        lock = self.session_locks.get(uid)
+        if lock is None:
+            lock = asyncio.Lock()
+            self.session_locks[uid] = lock
+
+        async with lock:
+            # Bounded backlog: Reject requests instead of queueing without
+            # limit. Only turns handed to the thread pool count, turns
+            # waiting for an earlier turn of their session do not.
+            if self.pending >= self.max_pending:
+                await self.respond_json(send, { 'message': 'Server busy' }, 503)
+                return
+
+            self.pending += 1
+            try:
+                result = await self.run(self.process_query, uid, query)
+            except KeyError:
+                logger.exception("Could not retrieve information")
+                await self.respond_json(send, { 'message': 'Could not retrieve information' },
+                                        500, headers)
+                return
+            finally:
+                self.pending -= 1
+
+        await self.respond_json(send, result, 200, headers)
+
+    def process_query(self, uid, query):
+        """
+        Process a user prompt of a session on a worker thread
+
+        :return: Dict of format { 'response': response, 'buttons': buttons,
+            'new_session': new_session }
+        :rtype: dict
+        """
+
+        # Sessions share the chatbot engine, only their state is kept in the
+        # session store
+        chatbot = DemoChatBot()
+        state = self.sessions.load(uid)
+        if state is None:
+            new_session = True
+        else:
+            chatbot.set_session_state(state)
+            new_session = False
+
+        response = chatbot.process_query(query)
+        buttons = chatbot.get_buttons_for_last_response()
+        self.sessions.save(uid, chatbot.get_session_state())
+
+        logger.info({ 'uid': uid, 'query': query, 'botresponse': response, 'buttons': buttons })
+        return { 'response': response, 'buttons': buttons, 'new_session': new_session }
+
+app = ChatbotApp()
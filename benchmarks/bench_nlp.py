@@ -0,0 +1,87 @@
+"""
+(C) 2021 Julian von Mendel <prog@derjulian.net>
+
+bench_nlp.py
+====================================
+Microbenchmark for the per-call latency of the NLP functions, comparing the
+process-wide NLP resources of botstory.nlp with loading them on every call.
+"""
+
+import os
+import sys
+import re
+import string
+import timeit
+
+import nltk
+from nltk.corpus import stopwords
+from nltk import word_tokenize
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from botstory.nlp import cleaned_episode, nlp_analyze, warm_up, \
+        TAGGER_RESOURCE # pylint: disable=wrong-import-position
+
+SENTENCES = [
+    "I would like to order one of your products please.",
+    "The date is 2020-12-01.",
+    "My name is Peter Frank.",
+    "What is a car?",
+]
+REPEAT = 5
+NUMBER = 200
+
+def legacy_cleaned_episode(raw_text, custom_stop_words = False):
+    """
+    Tokenizer that rebuilds its stop word list on every call
+    """
+
+    stop_words_list = list(string.punctuation)
+    if custom_stop_words is not None:
+        stop_words_list += stopwords.words('english')
+    if custom_stop_words:
+        stop_words_list += custom_stop_words
+
+    for char in string.punctuation:
+        raw_text = raw_text.replace(char, "")
+    raw_text = re.sub(r"[\(\[].*?[\)\]]", "", raw_text)
+
+    return [w for w in word_tokenize(raw_text) if w not in stop_words_list]
+
+def legacy_tag(sentence):
+    """
+    Tagging that resolves the tagger resource on every call
+    """
+
+    tagger = nltk.data.load(TAGGER_RESOURCE)
+    return tagger.tag(legacy_cleaned_episode(sentence, None))
+
+def bench(name, func):
+    """
+    Print the best per-call latency of func over all sentences
+    """
+
+    def run():
+        for sentence in SENTENCES:
+            func(sentence)
+
+    best = min(timeit.repeat(run, repeat = REPEAT, number = NUMBER))
+    usec = best / (NUMBER * len(SENTENCES)) * 1e6
+    print("{:<40} {:>10.1f} usec/call".format(name, usec))
+
+def main():
+    """
+    Run all benchmarks
+    """
+
+    warm_up()
+
+    bench("cleaned_episode (stop words, before)",
+          lambda s: legacy_cleaned_episode(s, []))
+    bench("cleaned_episode (stop words, after)",
+          lambda s: cleaned_episode(s, []))
+    bench("tokenize + tag (before)", legacy_tag)
+    bench("nlp_analyze (after)", nlp_analyze)
+
+if __name__ == "__main__":
+    main()
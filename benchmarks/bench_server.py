@@ -0,0 +1,306 @@
+"""
+(C) 2021 Julian von Mendel <prog@derjulian.net>
+
+bench_server.py
+====================================
+Load test of the chatbot with synthetic multi-session traffic following the
+storyline of example/demologicadapter.py (search, confirm, action). Drives
+BotClass.process_query directly and the Flask /chatbot/bot/<query> endpoint
+and reports throughput, latency percentiles, memory per session and the
+time spent per stage as JSON.
+
+Runs offline against the local SQLite store, train it first with
+make train.
+"""
+
+import os
+import sys
+import gc
+import json
+import math
+import time
+import argparse
+import threading
+import functools
+import tracemalloc
+import urllib.parse
+import concurrent.futures
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+# pylint: disable=wrong-import-position
+import chatterbot.filters
+import botstory.nlp
+import botstory.botstory
+import botstory.definitionslogicadapter
+from botstory.nlp import warm_up
+from botstory.sessionstore import encode_state
+from example.demochatbot import DemoChatBot
+
+# One session: small talk, the search -> confirm -> action storyline and a
+# blind branch
+SESSION_SCRIPT = [
+    "Hi",
+    "I would like to order one of your products please.",
+    "The date is 2020-12-01.",
+    "1 item please.",
+    "any",
+    "Yes",
+    "I would prefer the beach bar.",
+    "My name is Peter Frank.",
+    "No catering.",
+    "Yes, that's correct.",
+    "What are your opening times?",
+    "What is a car?",
+    "Bye.",
+]
+
+class StageTimer:
+    """
+    Accumulates the time spent in instrumented stages. Times are exclusive:
+    Time of a stage called from within another stage is only counted for
+    the inner stage.
+    """
+
+    def __init__(self):
+        self.seconds = {}
+        self.calls = {}
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def reset(self):
+        """
+        Forget all measurements
+        """
+
+        with self.lock:
+            self.seconds = {}
+            self.calls = {}
+
+    def measure(self, stage, func, *args, **kwargs):
+        """
+        Call func and account its time to stage
+        """
+
+        stack = self.local.__dict__.setdefault('stack', [])
+        stack.append(0.0) # Time of nested stages
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - start
+            nested = stack.pop()
+            if stack:
+                stack[-1] += elapsed
+
+            with self.lock:
+                self.seconds[stage] = self.seconds.get(stage, 0.0) + elapsed - nested
+                self.calls[stage] = self.calls.get(stage, 0) + 1
+
+    def wrap(self, stage, func):
+        """
+        Instrumented version of func
+        """
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            return self.measure(stage, func, *args, **kwargs)
+        return wrapper
+
+    def wrap_iter(self, stage, func):
+        """
+        Instrumented version of a generator function, the time of every step
+        is accounted to stage
+        """
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            iterator = iter(self.measure(stage, func, *args, **kwargs))
+            while True:
+                try:
+                    yield self.measure(stage, next, iterator)
+                except StopIteration:
+                    return
+        return wrapper
+
+TIMER = StageTimer()
+
+def instrument():
+    """
+    Instrument the NLP, logic adapter, storage and filter stages
+    """
+
+    botstory.nlp.NLPContext.analyze = TIMER.wrap('nlp', botstory.nlp.NLPContext.analyze)
+    botstory.nlp.NLPResult._compute = TIMER.wrap('nlp', botstory.nlp.NLPResult._compute) # pylint: disable=protected-access
+    botstory.botstory.nlp_analyze = TIMER.wrap('nlp', botstory.botstory.nlp_analyze)
+    botstory.definitionslogicadapter.nlp_analyze = TIMER.wrap(
+            'nlp', botstory.definitionslogicadapter.nlp_analyze)
+    chatterbot.filters.get_recent_repeated_responses = TIMER.wrap(
+            'filters', chatterbot.filters.get_recent_repeated_responses)
+
+    chatbot = DemoChatBot().chatbot
+    for adapter in chatbot.logic_adapters:
+        adapter.can_process = TIMER.wrap('adapters', adapter.can_process)
+        adapter.process = TIMER.wrap('adapters', adapter.process)
+
+        index = getattr(getattr(adapter, 'search_algorithm', None), 'index', None)
+        if index is not None:
+            index.filter = TIMER.wrap_iter('storage', index.filter)
+
+    storage = chatbot.storage
+    storage.filter = TIMER.wrap_iter('storage', storage.filter)
+    for name in ('count', 'get_random', 'create', 'update'):
+        setattr(storage, name, TIMER.wrap('storage', getattr(storage, name)))
+
+def percentile(values, percent):
+    """
+    Nearest-rank percentile of a sorted list
+    """
+
+    if not values:
+        return None
+    return values[max(0, math.ceil(percent / 100 * len(values)) - 1)]
+
+def run_sessions(sessions, threads, new_session, turn):
+    """
+    Run SESSION_SCRIPT for a number of sessions on a thread pool
+
+    :param int sessions: Number of sessions
+    :param int threads: Concurrent sessions
+    :param callable new_session: Function returning a new session
+    :param callable turn: Function processing a prompt of a session
+    :return: Dict with throughput, latency percentiles and time per stage
+    :rtype: dict
+    """
+
+    def run_session(_):
+        session = new_session()
+        latencies = []
+        for query in SESSION_SCRIPT:
+            start = time.perf_counter()
+            turn(session, query)
+            latencies.append(time.perf_counter() - start)
+        return latencies
+
+    TIMER.reset()
+    start = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(threads) as executor:
+        latencies = sorted(latency for session_latencies in
+                           executor.map(run_session, range(sessions))
+                           for latency in session_latencies)
+    seconds = time.perf_counter() - start
+
+    total = sum(latencies)
+    stages = { stage: { 'seconds': round(stage_seconds, 6),
+                        'calls': TIMER.calls[stage],
+                        'share': round(stage_seconds / total, 4) if total else None }
+               for stage, stage_seconds in sorted(TIMER.seconds.items()) }
+    other = total - sum(TIMER.seconds.values())
+    stages['other'] = { 'seconds': round(other, 6), 'calls': len(latencies),
+                        'share': round(other / total, 4) if total else None }
+
+    return {
+        'sessions': sessions,
+        'threads': threads,
+        'turns': len(latencies),
+        'seconds': round(seconds, 6),
+        'turns_per_second': round(len(latencies) / seconds, 2),
+        'latency_ms': { name: round(percentile(latencies, percent) * 1000, 3)
+                        for name, percent in (('p50', 50), ('p95', 95), ('p99', 99)) },
+        'latency_ms_max': round(latencies[-1] * 1000, 3),
+        'stages': stages,
+    }
+
+def bench_direct(sessions, threads):
+    """
+    Load test of BotClass.process_query
+    """
+
+    return run_sessions(sessions, threads, DemoChatBot,
+                        lambda chatbot, query: chatbot.process_query(query))
+
+def bench_flask(sessions, threads):
+    """
+    Load test of the Flask /chatbot/bot/<query> endpoint
+    """
+
+    import app # pylint: disable=import-outside-toplevel
+    flask_app = app.create_app()
+
+    def turn(client, query):
+        response = client.get('/chatbot/bot/' + urllib.parse.quote(query, safe = ''))
+        if response.status_code != 200:
+            raise RuntimeError('Status {} for {}'.format(response.status_code, query))
+
+    return run_sessions(sessions, threads, flask_app.test_client, turn)
+
+def bench_memory(sessions):
+    """
+    Memory held per live session after running the script, and the size of
+    the serialized session state
+    """
+
+    chatbots = []
+    gc.collect()
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+
+    for _ in range(sessions):
+        chatbot = DemoChatBot()
+        for query in SESSION_SCRIPT:
+            chatbot.process_query(query)
+        chatbots.append(chatbot)
+
+    gc.collect()
+    current = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    state_sizes = [ len(encode_state(chatbot.get_session_state()).encode('utf-8'))
+                    for chatbot in chatbots ]
+    return {
+        'sessions': sessions,
+        'bytes_per_session': int((current - baseline) / sessions),
+        'state_bytes_per_session': int(sum(state_sizes) / sessions),
+    }
+
+def main():
+    """
+    Run the benchmarks and print or write the results as JSON
+    """
+
+    parser = argparse.ArgumentParser(description = 'Chatbot load test')
+    parser.add_argument('--sessions', type = int, default = 50)
+    parser.add_argument('--threads', type = int, default = 4)
+    parser.add_argument('--mode', choices = [ 'direct', 'flask', 'all' ], default = 'all')
+    parser.add_argument('--output', help = 'JSON file to write, default stdout')
+    args = parser.parse_args()
+
+    warm_up()
+    instrument()
+
+    # Warm engine, adapters and indexes before measuring
+    chatbot = DemoChatBot()
+    for query in SESSION_SCRIPT:
+        chatbot.process_query(query)
+
+    results = {
+        'benchmark': 'bench_server',
+        'created': int(time.time()),
+        'python': sys.version.split()[0],
+        'script_turns': len(SESSION_SCRIPT),
+    }
+    if args.mode in ('direct', 'all'):
+        results['direct'] = bench_direct(args.sessions, args.threads)
+    if args.mode in ('flask', 'all'):
+        results['flask'] = bench_flask(args.sessions, args.threads)
+    results['memory'] = bench_memory(min(args.sessions, 20))
+
+    output = json.dumps(results, indent = 2, sort_keys = True)
+    if args.output is None:
+        print(output)
+    else:
+        with open(args.output, 'w') as output_file:
+            output_file.write(output + '\n')
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""
+(C) 2021 Julian von Mendel <prog@derjulian.net>
+
+bench_startup.py
+====================================
+Startup benchmark of the entry points: Measures the import of main.py,
+app.py and asgi.py with python -X importtime, lists the most expensive
+imports, and the time until the first chatbot session is ready.
+"""
+
+import os
+import sys
+import json
+import argparse
+import subprocess
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+# Name: (entry module, code to run)
+ENTRY_POINTS = {
+    'main': ('main', 'import main'),
+    'app': ('app', 'import app'),
+    'asgi': ('asgi', 'import asgi'),
+    'first session': ('main', 'import main; main.DemoChatBot()'),
+}
+REPEAT = 3
+TOP = 8
+
+def parse_importtime(stderr):
+    """
+    Parse the output of python -X importtime
+
+    :return: List of (module, self_us, cumulative_us, depth) tuples
+    :rtype: list
+    """
+
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+
+        self_us, cumulative_us, module = line[len('import time:'):].split('|')
+        depth = (len(module) - len(module.lstrip())) // 2
+        imports.append((module.strip(), int(self_us), int(cumulative_us), depth))
+
+    return imports
+
+def entry_imports(imports, entry_module):
+    """
+    Modules imported directly by an entry module
+
+    :param list imports: Result of parse_importtime()
+    :param str entry_module: Name of the entry module
+    :return: List of (module, cumulative_us) tuples, most expensive first
+    :rtype: list
+    """
+
+    # Imports are listed after all modules they import
+    children = []
+    for module, _, cumulative, depth in imports:
+        if depth == 1:
+            children.append((module, cumulative))
+        elif depth == 0:
+            if module == entry_module:
+                return sorted(children, key = lambda item: -item[1])
+            children = []
+
+    return []
+
+def measure(entry_module, code):
+    """
+    Run code in a fresh interpreter with import timing
+
+    :return: Dict with the total time of all imports and the most expensive
+        imports of the entry module, in microseconds, of the fastest run
+    :rtype: dict
+    """
+
+    best = None
+    for _ in range(REPEAT):
+        result = subprocess.run([ sys.executable, '-X', 'importtime', '-c', code ],
+                cwd = ROOT, stdout = subprocess.DEVNULL, stderr = subprocess.PIPE,
+                universal_newlines = True, check = False)
+        if result.returncode != 0:
+            return { 'error': result.stderr.strip().splitlines()[-1] }
+
+        imports = parse_importtime(result.stderr)
+        total = sum(cumulative for _, _, cumulative, depth in imports if depth == 0)
+        if best is None or total < best['total_us']:
+            best = { 'total_us': total,
+                     'top': entry_imports(imports, entry_module)[:TOP] }
+
+    return best
+
+def main():
+    """
+    Run all benchmarks
+    """
+
+    parser = argparse.ArgumentParser(description = 'Entry point startup benchmark')
+    parser.add_argument('--json', action = 'store_true', help = 'Print results as JSON')
+    args = parser.parse_args()
+
+    results = { name: measure(entry_module, code)
+                for name, (entry_module, code) in ENTRY_POINTS.items() }
+
+    if args.json:
+        print(json.dumps(results, indent = 2))
+        return
+
+    for name, result in results.items():
+        if 'error' in result:
+            print("{:<20} failed: {}".format(name, result['error']))
+            continue
+
+        print("{:<20} {:>10.1f} ms import time".format(name, result['total_us'] / 1000))
+        for module, cumulative in result['top']:
+            print("    {:<30} {:>10.1f} ms".format(module, cumulative / 1000))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""
+(C) 2021 Julian von Mendel <prog@derjulian.net>
+
+bench_training.py
+====================================
+Benchmark for training storyline data, comparing ChatterBot's ListTrainer
+with the batch tagging and bulk inserts of botstory.training.
+"""
+
+import os
+import sys
+import time
+import tempfile
+
+from chatterbot import ChatBot
+from chatterbot.trainers import ListTrainer
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from botstory.training import IncrementalTrainer # pylint: disable=wrong-import-position
+
+PAIRS = 2000 # Prompt/reply pairs, like blind branches generated from FAQs
+
+def training_data(pairs):
+    """
+    Synthetic storyline training data of alternating prompts and replies
+    """
+
+    data = []
+    for i in range(pairs):
+        data.append("What are the opening hours of location {}?".format(i))
+        data.append("Location {} is open from 9am to {}pm.".format(i, 5 + i % 4))
+    return data
+
+def bench(name, train, data):
+    """
+    Print the time to train data into an empty database
+    """
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        chatbot = ChatBot('Bench', read_only = True,
+                database_uri = 'sqlite:///{}'.format(os.path.join(tmpdir, 'db.sqlite3')))
+
+        start = time.perf_counter()
+        train(chatbot, data)
+        seconds = time.perf_counter() - start
+
+        print("{:<40} {:>10.2f} s ({:.0f} statements/s)".format(
+              name, seconds, chatbot.storage.count() / seconds))
+
+def main():
+    """
+    Run all benchmarks
+    """
+
+    data = training_data(PAIRS)
+
+    # ListTrainer trains one chained conversation, the trainers store the
+    # same number of statements
+    bench("ListTrainer (before)",
+          lambda chatbot, data: ListTrainer(chatbot, show_training_progress = False).train(data),
+          data)
+    bench("IncrementalTrainer bulk (after)",
+          lambda chatbot, data: IncrementalTrainer(chatbot).train([], data),
+          data)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+"""
+(C) 2021 Julian von Mendel <prog@derjulian.net>
+
+artifact.py
+====================================
+Prebuilt knowledge graph artifacts: A trained statement store is exported
+into a compacted, indexed and versioned SQLite file, which chatbot processes
+open read-only. Read-only connections take no locks and map the file into
+memory, so all worker processes share its pages through the OS page cache.
+"""
+
+import os
+import time
+import sqlite3
+
+ARTIFACT_FORMAT = '1' # Increased on incompatible changes of the file layout
+MMAP_SIZE = 256 * 1024 * 1024 # Bytes of the artifact to map into memory
+
+# Indexes for the statement lookups of ChatterBot and botstory adapters
+ARTIFACT_INDEXES = {
+    'ix_statement_text': 'statement (text)',
+    'ix_statement_search_text': 'statement (search_text)',
+    'ix_statement_search_in_response_to': 'statement (search_in_response_to)',
+    'ix_statement_conversation': 'statement (conversation)',
+}
+
+class ArtifactError(Exception):
+    """
+    Raised if a file is no usable knowledge graph artifact
+    """
+
+def export_artifact(storage, path, version = None):
+    """
+    Export the statement store of a ChatterBot storage adapter into an
+    artifact file
+
+    :param SQLStorageAdapter storage: Trained ChatterBot storage
+    :param str path: Path of the artifact to write, replaced if it exists
+    :param str version: Version label of the artifact, defaults to the
+        export time
+    :return: Metadata of the written artifact, see read_artifact_metadata()
+    :rtype: dict
+    """
+
+    if version is None:
+        version = time.strftime('%Y%m%d%H%M%S', time.gmtime())
+
+    tmp_path = '{}.tmp{}'.format(path, os.getpid())
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+
+    # Copy the store consistently, even while it is in use
+    source = storage.engine.raw_connection()
+    target = sqlite3.connect(tmp_path)
+    try:
+        source.connection.backup(target)
+
+        target.execute('DROP TABLE IF EXISTS botstory_artifact')
+        target.execute('CREATE TABLE botstory_artifact '
+                       '(key VARCHAR(32) PRIMARY KEY, value TEXT NOT NULL)')
+        for name, columns in ARTIFACT_INDEXES.items():
+            target.execute('CREATE INDEX IF NOT EXISTS {} ON {}'.format(name, columns))
+
+        statements = target.execute('SELECT COUNT(*) FROM statement').fetchone()[0]
+        target.executemany('INSERT INTO botstory_artifact (key, value) VALUES (?, ?)', [
+            ('format', ARTIFACT_FORMAT),
+            ('version', version),
+            ('created', str(int(time.time()))),
+            ('statements', str(statements)) ])
+        target.commit()
+
+        # Rollback journal instead of WAL, so the file is self-contained, and
+        # planner statistics plus compact pages for read-only use
+        target.execute('PRAGMA journal_mode = DELETE')
+        target.execute('ANALYZE')
+        target.execute('VACUUM')
+    finally:
+        target.close()
+        source.close()
+
+    os.replace(tmp_path, path)
+    return read_artifact_metadata(path)
+
+def connect_artifact(path):
+    """
+    Open a read-only connection to an artifact
+
+    :param str path: Path of the artifact
+    :rtype: sqlite3.Connection
+    """
+
+    uri = 'file:{}?mode=ro&immutable=1'.format(
+            os.path.abspath(path).replace('?', '%3f').replace('#', '%23'))
+    connection = sqlite3.connect(uri, uri = True, check_same_thread = False)
+    connection.execute('PRAGMA mmap_size = {}'.format(MMAP_SIZE))
+    return connection
+
+def read_artifact_metadata(path):
+    """
+    Read the metadata of an artifact
+
+    :param str path: Path of the artifact
+    :return: Dict of format { 'format': format, 'version': version,
+        'created': timestamp, 'statements': count }
+    :rtype: dict
+    :raises ArtifactError: If the file is missing, no artifact or of an
+        unsupported format
+    """
+
+    if not os.path.isfile(path):
+        raise ArtifactError('Artifact {} does not exist'.format(path))
+
+    connection = connect_artifact(path)
+    try:
+        metadata = dict(connection.execute('SELECT key, value FROM botstory_artifact'))
+    except sqlite3.DatabaseError as error:
+        raise ArtifactError('{} is no knowledge graph artifact: {}'.format(path, error))
+    finally:
+        connection.close()
+
+    if metadata.get('format') != ARTIFACT_FORMAT:
+        raise ArtifactError('Artifact {} has unsupported format {}'.format(
+                path, metadata.get('format')))
+
+    return metadata
+
+def create_artifact_engine(path, pool_size = 5):
+    """
+    Create an SQLAlchemy engine that reads an artifact
+
+    :param str path: Path of the artifact
+    :param int pool_size: Connections to keep open
+    :rtype: sqlalchemy.engine.Engine
+    """
+
+    # pylint: disable=import-outside-toplevel
+    from sqlalchemy import create_engine
+    from sqlalchemy.pool import QueuePool
+
+    return create_engine('sqlite://', creator = lambda: connect_artifact(path),
+                         poolclass = QueuePool, pool_size = pool_size)
@@ -7,15 +7,171 @@ Main class for a chatbot that covers ChatterBot init,
 retrieving chatterbot responses and training the ChatterBot knowledge graph.
 """
 
-from chatterbot import ChatBot
-import chatterbot.filters
-from chatterbot.trainers import ListTrainer
+import threading
+
+# ChatterBot, SQLAlchemy and the modules depending on them are imported on
+# first use, so entry points start without loading them
 #from chatterbot.trainers import UbuntuCorpusTrainer
-from chatterbot.trainers import ChatterBotCorpusTrainer
 
 from botstory.botstory import BotStory
+from botstory.nlp import NLPContext
+from botstory.conversation import ConversationState, active_conversation
+from botstory.instrumentation import span, instrument_chatbot
+from botstory.routing import AdapterRouter
+from botstory.chatlog import ChatLog, DEFAULT_WINDOW
+from botstory.artifact import export_artifact, read_artifact_metadata, \
+        create_artifact_engine
 
 BOT_NAME='Ron' # Bot name passed on in ChatterBot Statement objects
+STORAGE_POOL_SIZE = 5 # SQLite connections shared by all sessions of an engine
+
+# Engines shared by all sessions with the same configuration
+_engines = {}
+_engines_lock = threading.Lock()
+
+class BotEngine:
+    """
+    Heavy, read-only part of a chatbot that is shared by all sessions within a
+    process: The ChatterBot instance with its storage and logic adapters and
+    the storyline definition.
+
+    Logic adapters receive the engine as 'botclass' argument, to extend the
+    storyline definition in botstory. Per-session state is handed to them as
+    ConversationState on every call, see ConversationLogicAdapter.
+
+    :param ChatterBot chatbot: ChatterBot class, or None if a new one should be
+            created
+    :param list logic_adapters: Logic adapters to configure ChatterBot with
+    :param dict chatbot_vars: Dict with additional data to provide to logic adapters
+    :param str database_uri: Path of the SQLite database
+    :param callable build_story: Function to call with the storyline definition
+            before the logic adapters are set up
+    :param str artifact: Path of a knowledge graph artifact to open read-only
+            instead of the SQLite database, see botstory.artifact
+    """
+
+    def __init__(self, chatbot = None, logic_adapters = None, \
+                 chatbot_vars = None, database_uri = 'db/database.sqlite3', \
+                 build_story = None, artifact = None):
+        # Storyline definition, the template for all session BotStory objects
+        self.botstory = BotStory()
+        if build_story is not None:
+            build_story(self.botstory)
+
+        if chatbot_vars is None:
+            chatbot_vars = {}
+
+        # Fail early on a missing or incompatible artifact
+        self.artifact = None
+        if artifact is not None:
+            self.artifact = read_artifact_metadata(artifact)
+
+        # Per welcome message, see BotClass.get_template_data()
+        self.template_data = {}
+
+        # Dispatch of messages to logic adapters, see botstory.routing
+        self.router = None
+
+        if chatbot is not None:
+            self.chatbot = chatbot
+        else:
+            # pylint: disable=import-outside-toplevel
+            from chatterbot import ChatBot
+            import chatterbot.filters
+
+            self.chatbot = ChatBot(BOT_NAME,
+                read_only=True,
+                logic_adapters=logic_adapters,
+                filters=[chatterbot.filters.get_recent_repeated_responses],
+                input_adapter="chatterbot.input.VariableInputTypeAdapter",
+                output_adapter="chatterbot.output.OutputAdapter",
+                storage_adapter='chatterbot.storage.SQLStorageAdapter',
+                # Artifacts are attached after setup, nothing may write to them
+                database_uri=None if artifact is not None \
+                        else 'sqlite:///{}'.format(database_uri),
+                botclass=self,
+                **chatbot_vars)
+
+            if artifact is not None:
+                self._attach_artifact(artifact)
+            else:
+                self._pool_storage()
+
+            # Only the logic adapters relevant for a message process it
+            self.router = AdapterRouter(self.chatbot)
+            self.router.install()
+
+            # Stage timing, only active while metric sinks are registered
+            instrument_chatbot(self.chatbot)
+
+    @classmethod
+    def get(cls, key, **kwargs):
+        """
+        Retrieve the shared engine for a configuration, creating it on first
+        use
+
+        :param key: Hashable description of the configuration
+        :return: Engine
+        :rtype: BotEngine
+        """
+
+        with _engines_lock:
+            if key not in _engines:
+                _engines[key] = cls(**kwargs)
+
+            return _engines[key]
+
+    def _pool_storage(self):
+        """
+        Let all sessions share a pool of SQLite connections instead of opening
+        a new connection for every storage access
+        """
+
+        # pylint: disable=import-outside-toplevel
+        from sqlalchemy import create_engine
+        from sqlalchemy.pool import QueuePool
+        from chatterbot.storage import SQLStorageAdapter
+
+        storage = self.chatbot.storage
+        if not isinstance(storage, SQLStorageAdapter) or \
+                not storage.database_uri.startswith('sqlite:///'):
+            return
+
+        storage.engine = create_engine(storage.database_uri,
+                poolclass = QueuePool, pool_size = STORAGE_POOL_SIZE,
+                connect_args = { 'check_same_thread': False })
+        storage.Session.configure(bind = storage.engine)
+
+    def _attach_artifact(self, path):
+        """
+        Serve the statement store from a read-only knowledge graph artifact
+
+        :param str path: Path of the artifact
+        """
+
+        from botstory.indexedbestmatch import IndexedBestMatch # pylint: disable=import-outside-toplevel
+
+        storage = self.chatbot.storage
+        storage.engine.dispose()
+        storage.engine = create_artifact_engine(path, STORAGE_POOL_SIZE)
+        storage.Session.configure(bind = storage.engine)
+
+        # Candidate indexes were built from the setup store
+        for adapter in self.chatbot.logic_adapters:
+            if isinstance(adapter, IndexedBestMatch):
+                adapter.search_algorithm.index.invalidate()
+
+    def get_response(self, conversation, query):
+        """
+        Retrieve the ChatterBot response to a user prompt of a session
+
+        :param ConversationState conversation: Conversation state of the session
+        :param str query: Input text
+        :return: ChatterBot response statement
+        """
+
+        with active_conversation(conversation):
+            return self.chatbot.get_response(query)
 
 class BotClass:
     """
@@ -27,59 +183,88 @@ class BotClass:
     :param list logicadapters: Additional logic adapters to configure
             ChatterBot with
     :param dict chatbot_vars: Dict with additional data to provide to logic adapters
+    :param str database_uri: Path of the SQLite database
+    :param bool shared_engine: Share the ChatterBot instance, storage and
+            logic adapters with all other sessions of the same configuration
+            in this process
+    :param str artifact: Path of a knowledge graph artifact to open read-only
+            instead of the SQLite database, see export_artifact()
+    :param int chatlog_window: Number of chat log messages to keep in memory
+            and in the session state
+    :param ChatLogSpill chatlog_spill: Store of the full chat log history,
+            see botstory.chatlog
     """
 
     def __init__(self, chatbot = None, welcome_msg = "Hi.", \
                  logic_adapters = None, chatbot_vars = None, \
-                 database_uri = 'db/database.sqlite3'):
-        # Story dialog management
-        self.botstory = BotStory()
-        self._build_default_story()
-        self.button_overwrite = {} # UI buttons provided by business logic
-
-        # Chat log
-        self.chatlog = [ ]
-        self.welcome_msg = welcome_msg
-        if isinstance(self.welcome_msg, str):
-            self.chatlog_append(self.welcome_msg, bot_user=True)
-
+                 database_uri = 'db/database.sqlite3', shared_engine = True, \
+                 artifact = None, chatlog_window = DEFAULT_WINDOW, \
+                 chatlog_spill = None):
         # Chatterbot init
         if logic_adapters is None:
             logic_adapters = []
 
-        logic_adapters.extend([
+        logic_adapters = list(logic_adapters) + [
             {
-                'import_path': 'chatterbot.logic.BestMatch',
+                'import_path': 'botstory.indexedbestmatch.IndexedBestMatch',
                 'default_response': 'I am sorry, but I do not understand.',
                 'threshold': 0.90
             },
             #         'chatterbot.logic.MathematicalEvaluation',
             #         'chatterbot.logic.TimeLogicAdapter'
-        ])
+        ]
+
+        engine_args = { 'chatbot': chatbot, 'logic_adapters': logic_adapters,
+                        'chatbot_vars': chatbot_vars,
+                        'database_uri': database_uri,
+                        'build_story': self._build_default_story,
+                        'artifact': artifact }
+
+        if chatbot is None and shared_engine:
+            # All sessions with the same configuration share one engine
+            key = (type(self), repr(logic_adapters), repr(chatbot_vars),
+                   database_uri, artifact)
+            self.engine = BotEngine.get(key, **engine_args)
+        else:
+            self.engine = BotEngine(**engine_args)
+        self.chatbot = self.engine.chatbot
 
-        if chatbot_vars is None:
-            chatbot_vars = {}
+        # Story dialog management
+        self.conversation = ConversationState(
+                self.engine.botstory.new_session())
 
-        if chatbot is not None:
-            self.chatbot = chatbot
-        else:
-            self.chatbot = ChatBot(BOT_NAME,
-                read_only=True,
-                logic_adapters=logic_adapters,
-                filters=[chatterbot.filters.get_recent_repeated_responses],
-                input_adapter="chatterbot.input.VariableInputTypeAdapter",
-                output_adapter="chatterbot.output.OutputAdapter",
-                storage_adapter='chatterbot.storage.SQLStorageAdapter',
-                database_uri='sqlite:///{}'.format(database_uri),
-                botclass=self,
-                **chatbot_vars)
+        # Chat log
+        self.chatlog = ChatLog(chatlog_window, chatlog_spill)
+        self.welcome_msg = welcome_msg
+        if isinstance(self.welcome_msg, str):
+            # Only written to the chat log spill if this is a new session,
+            # see set_session_state()
+            self.chatlog_append(self.welcome_msg, bot_user=True, defer=True)
+
+    @property
+    def botstory(self):
+        """
+        Storyline state of this session
+        """
+
+        return self.conversation.botstory
+
+    @property
+    def button_overwrite(self):
+        """
+        UI buttons provided by business logic
+        """
+
+        return self.conversation.button_overwrite
 
-    def _build_default_story(self):
+    def _build_default_story(self, story):
         """
         Set up a few default conversation lines
+
+        :param BotStory story: Storyline definition to extend
         """
 
-        self.botstory.add_blind_branches([
+        story.add_blind_branches([
                 "Start over",
                 "Okay. Let's start over.",
                 "New session",
@@ -89,7 +274,7 @@ class BotClass:
                 "quit",
                 "Okay. Let's start over."
             ], add_buttons = False)
-        self.botstory.add_blind_branches([
+        story.add_blind_branches([
                 "Hi",
                 "Hello there!",
                 "Hey friend.",
@@ -127,10 +312,14 @@ class BotClass:
         :rtype: str
         """
 
-        self.chatlog_append(query)
+        with span('turn'):
+            self.chatlog_append(query)
+
+            # All logic adapters share the NLP results for this message
+            self.botstory.nlp_context = NLPContext()
 
-        response = str(self.chatbot.get_response(query))
-        self.chatlog_append(response, bot_user = True)
+            response = str(self.engine.get_response(self.conversation, query))
+            self.chatlog_append(response, bot_user = True)
 
         return response
 
@@ -138,60 +327,108 @@ class BotClass:
         """
         Retrieve chat log
 
-        :return: List of all past user prompts and bot replies
-        :rtype: list
+        :return: Chat log, iterating over all past user prompts and bot
+            replies that are kept
+        :rtype: ChatLog
         """
 
         return self.chatlog
 
-    def chatlog_append(self, msg, bot_user = False):
+    def get_session_state(self):
+        """
+        Retrieve the state of this session: Conversation state and chat log
+
+        :return: Dict of format { 'conversation': conversation_state,
+            'chatlog': chatlog_state }, see ConversationState.get_state()
+            and ChatLog.get_state()
+        :rtype: dict
+        """
+
+        return { 'conversation': self.conversation.get_state(),
+                 'chatlog': self.chatlog.get_state() }
+
+    def set_session_state(self, state):
+        """
+        Restore a session state retrieved with get_session_state()
+
+        :param dict state: Session state
+        """
+
+        self.conversation.set_state(state['conversation'])
+        self.chatlog.set_state(state['chatlog'])
+
+    def chatlog_append(self, msg, bot_user = False, defer = False):
         """
         Internal helper function to store user prompts or bot replies in chat log
         """
 
         if bot_user:
             msg = '*{}*'.format(msg)
-        self.chatlog.append(msg)
+        self.chatlog.append(msg, defer)
 
-    def train(self):
+    def train(self, incremental = True, corpus_paths = ( "chatterbot.corpus.english", )):
         """
         Training of the chatterbot knowledge graph
 
-        :return: True if training has been completed fully, False otherwise
-        :rtype: bool
+        Only corpus files and storyline conversations that changed since the
+        last training are inserted into or removed from the statement store.
+
+        :param bool incremental: False to retrain everything from scratch
+        :param list corpus_paths: Dotted ChatterBot corpus paths to train
+        :return: Training report of format { 'added': [names],
+            'updated': [names], 'removed': [names], 'unchanged': count }.
+            Earlier versions returned True; the report is always truthy, but
+            callers must not compare it with "is True".
+        :rtype: dict
         """
         # Careful, UbuntuCorpus takes over 10GB of memory
         #   trainer = UbuntuCorpusTrainer(chatbot)
         #   trainer.train()
 
-        self.chatbot.storage.drop()
+        # pylint: disable=import-outside-toplevel
+        from botstory.training import IncrementalTrainer
+        from botstory.indexedbestmatch import IndexedBestMatch
 
-        # Train with random conversations from English language corpus
-        trainer = ChatterBotCorpusTrainer(self.chatbot)
-        trainer.train("chatterbot.corpus.english")
+        trainer = IncrementalTrainer(self.chatbot)
+        if not incremental:
+            trainer.reset()
 
-        # Train with storyline data from BotStory
-        trainer = ListTrainer(self.chatbot)
-        trainer.train(self.botstory.get_training_data())
+        # Train with random conversations from English language corpus and
+        # with storyline data from BotStory
+        report = trainer.train(corpus_paths, self.botstory.get_training_data())
 
-        return True
+        # Candidate indexes need to cover the new statements
+        for adapter in self.chatbot.logic_adapters:
+            if isinstance(adapter, IndexedBestMatch):
+                adapter.rebuild_index()
 
-        # Train with conversations from json file
-        #with open(CONVERSATIONS_DATA, "rb") as f:
-        #    conversation = json.load(f)
-        #    print(conversation)
-        #    trainer.train(conversation)
-        #    return True
+        return report
 
-        #return False
+    def export_artifact(self, path, version = None):
+        """
+        Export the trained knowledge graph into a read-only artifact, to be
+        loaded with the artifact parameter
+
+        :param str path: Path of the artifact to write
+        :param str version: Version label, defaults to the export time
+        :return: Metadata of the artifact
+        :rtype: dict
+        """
+
+        return export_artifact(self.chatbot.storage, path, version)
 
     def get_template_data(self):
         """
-        Provide data for UI templates
+        Provide data for UI templates. The data only depends on the bot
+        definition and is computed once per engine.
         """
 
-        return { 'welcome': self.welcome_msg,
-                'home_buttons': self.botstory.get_branch_buttons() }
+        if self.welcome_msg not in self.engine.template_data:
+            self.engine.template_data[self.welcome_msg] = {
+                    'welcome': self.welcome_msg,
+                    'home_buttons': self.botstory.get_branch_buttons() }
+
+        return self.engine.template_data[self.welcome_msg]
 
     def get_buttons_for_last_response(self):
         """
@@ -5,32 +5,36 @@ Branch and storyline entity management and NLP for accumulating entities from
 user responses.
 """
 
-import datetime
-from botstory.nlp import nlp_prefilter, nlp_analyze
+import types
+import collections.abc
+from botstory.nlp import nlp_prefilter, nlp_analyze, WordClassMatcher
+from botstory.entities import BranchSchema
 
-class BotStory():
+class StoryDefinition:
     """
-    Branch and storyline entity management and NLP.
+    Storyline definition shared by all sessions of a bot: Branches, entity
+    definitions, word classes, training data and language database. It is
+    built once at setup and sealed when the first session is created, see
+    BotStory.new_session().
     """
 
-    def __init__(self, **kwargs):
-        super().__init__(**kwargs)
-
-        # State variables used in further class logic
+    def __init__(self):
         self.branches = [ ]
-        self.current_branch = None # Current storyline branch
-        self.open_question = False # Currently in focus entity
+        self.initial_branch = None # First branch defined, where sessions start
         self.training_data = [] # Chatterbot training data
         self.branch_buttons = [] # Buttons for initial branch choice
-        self.nlp = None # Last NLP result
+        self.sealed = False # Sessions were created, no more changes
 
         # Branch / entity definition
         self.word_classes = {
             'yes': [ "yes", "ok", "correct", "good" ],
             'no': [ "no", "nope", "incorrect", "wrong", "not", "bad" ],
         }
+        self.word_class_matcher = WordClassMatcher(self.word_classes)
         self.entities = {}
-        self.entity_values = {}
+        self.entity_names = {} # Branch -> tuple of entity names in definition order
+        self.entity_positions = {} # Branch -> { entity name: position }
+        self.schemas = {} # Compiled entity definitions
 
         # Language database
         self.lang = {
@@ -39,47 +43,60 @@ class BotStory():
             "no_confirm": "Sorry I could not help you. Let's start over.",
         }
 
+    def seal(self):
+        """
+        Prevent further changes, as sessions rely on the definition
+        """
+
+        self.sealed = True
+
+    def check_unsealed(self):
+        """
+        Internal helper to reject changes of a sealed definition
+        """
+
+        if self.sealed:
+            raise RuntimeError('The storyline definition is in use by sessions '
+                               'and cannot be changed anymore')
+
     def add_branch(self, branch_name, trigger_words = None, entities = None, \
                    button = None):
         """
-        Define a new storyline branch.
-        :param str branch_name: Branch name
-        :param list trigger_words: List of strings that should be considered
-                trigger words for the branch
-        :param entities: Dictionary with entity names as key and
-                { 'type': '<type>', 'question': 'Question text',
-                'buttons': [ 'a', 'b' ] } as value,
-                where <type> can be int:<min>:<max>, int_or_str, bool,
-                bool_confirm, date or str; The question text can contain
-                "{entity_name}" variables. Also, for type 'bool' additional
-                settings 'str_true' and 'str_false' can be given to define
-                formatting
-        :param button: String with a button name to link to the branch, or None
-                to not add show button
+        Define a new storyline branch, see BotStory.add_branch()
         """
 
+        self.check_unsealed()
+
+        # Validate entity definitions before the branch is added
+        if isinstance(entities, dict):
+            schema = BranchSchema(entities)
+
         self.branches.append(branch_name)
+        if self.initial_branch is None:
+            self.initial_branch = branch_name
 
         if isinstance(trigger_words, list):
             self.word_classes['trigger_{}'.format(branch_name)] = trigger_words
+            self.word_class_matcher.add('trigger_{}'.format(branch_name),
+                    trigger_words)
 
         if isinstance(entities, dict):
             self.entities[branch_name] = entities
-            self.entity_values[branch_name] = dict.fromkeys(entities, None)
-
-        if self.current_branch is None:
-            self.current_branch = branch_name
+            self.entity_names[branch_name] = tuple(entities)
+            self.entity_positions[branch_name] = { entity: position for position, entity
+                                                   in enumerate(entities) }
+            self.schemas[branch_name] = schema
 
         if button is not None:
             self.branch_buttons.append(button)
 
     def add_blind_branches(self, prompts, add_buttons = True):
         """
-        Define a new storyline branch.
-        :param list prompts: User prompt and bot reponses, in alternately
-        :param bool add_buttons: Add buttons for these branches?
+        Define new blind storyline branches, see BotStory.add_blind_branches()
         """
 
+        self.check_unsealed()
+
         self.training_data.extend(prompts)
 
         if add_buttons:
@@ -87,12 +104,11 @@ class BotStory():
 
     def add_blind_branch(self, prompt, reply, add_buttons = True):
         """
-        Define a new storyline branch.
-        :param str prompt: User prompt to react to
-        :param str reply: Bot response to train
-        :param bool add_buttons: Add buttons for these branches?
+        Define a new blind storyline branch, see BotStory.add_blind_branch()
         """
 
+        self.check_unsealed()
+
         self.training_data.append(prompt)
         self.training_data.append(reply)
 
@@ -117,13 +133,252 @@ class BotStory():
         #         self.training_data.append(prompt_iter + punctuation[counter])
         #         self.training_data.append(reply)
 
+class BranchValues(collections.abc.MutableMapping):
+    """
+    Entity values of a branch of a session, as dict-like view of the value
+    storage of BotStory. Only entities of the branch can be set.
+
+    :param BotStory story: Session
+    :param str branch: Branch name
+    """
+
+    def __init__(self, story, branch):
+        self.story = story
+        self.branch = branch
+
+    def __getitem__(self, entity):
+        return self.story.get_entity_value(entity, self.branch)
+
+    def __setitem__(self, entity, value):
+        self.story.set_entity_value(entity, value, self.branch)
+
+    def __delitem__(self, entity):
+        raise TypeError('Entity values cannot be deleted, set them to None instead')
+
+    def __iter__(self):
+        return iter(self.story.get_entity_names(self.branch))
+
+    def __len__(self):
+        return len(self.story.get_entity_names(self.branch))
+
+    def __repr__(self):
+        return repr(dict(self))
+
+class EntityValues(collections.abc.Mapping):
+    """
+    Entity values of a session, mapping branch names to BranchValues
+
+    :param BotStory story: Session
+    """
+
+    def __init__(self, story):
+        self.story = story
+
+    def __getitem__(self, branch):
+        if branch not in self.story.definition.entities:
+            raise KeyError(branch)
+        return BranchValues(self.story, branch)
+
+    def __iter__(self):
+        return iter(self.story.definition.entities)
+
+    def __len__(self):
+        return len(self.story.definition.entities)
+
+    def __repr__(self):
+        return repr({ branch: dict(values) for branch, values in self.items() })
+
+class BotStory():
+    """
+    Branch and storyline entity management and NLP.
+
+    The storyline definition is kept in a StoryDefinition, which is shared
+    by all sessions created with new_session(). A BotStory itself only holds
+    the state of a session. Entity values are stored per branch as list in
+    the order of the entity definitions, for branches with values only.
+
+    :param StoryDefinition definition: Storyline definition or None to start
+        a new one
+    """
+
+    __slots__ = ('definition', 'current_branch', 'open_question', 'values',
+                 'entity_overrides', 'schema_overrides', 'nlp', 'nlp_context')
+
+    def __init__(self, definition = None):
+        if definition is None:
+            definition = StoryDefinition()
+
+        # State variables used in further class logic
+        self.definition = definition
+        self.current_branch = definition.initial_branch # Current storyline branch
+        self.open_question = False # Currently in focus entity
+        self.values = None # Branch -> list of entity values, None if there are none
+        self.entity_overrides = None # Branch -> entity definitions extended in this session
+        self.schema_overrides = None # Branch -> compiled entity_overrides
+        self.nlp = None # Last NLP result
+        self.nlp_context = None # Per-message NLP cache, see botstory.nlp.NLPContext
+
+    @property
+    def branches(self):
+        """
+        Names of all branches
+        """
+
+        return self.definition.branches
+
+    @property
+    def word_classes(self):
+        """
+        Word lists of the storyline definition
+        """
+
+        return self.definition.word_classes
+
+    @property
+    def word_class_matcher(self):
+        """
+        Compiled word classes of the storyline definition
+        """
+
+        return self.definition.word_class_matcher
+
+    @property
+    def lang(self):
+        """
+        Language database
+        """
+
+        return self.definition.lang
+
+    @property
+    def entities(self):
+        """
+        Read-only entity definitions per branch, including definitions that
+        were extended in this session (see entity_store_copy())
+        """
+
+        if self.entity_overrides is None:
+            return types.MappingProxyType(self.definition.entities)
+        return types.MappingProxyType({ **self.definition.entities,
+                                        **self.entity_overrides })
+
+    @property
+    def entity_values(self):
+        """
+        Collected entity values, see get_entity_values()
+        """
+
+        return EntityValues(self)
+
+    def new_session(self):
+        """
+        Create a BotStory for a new user session. It shares the storyline
+        definition with this object, which cannot be changed afterwards, but
+        has its own storyline state and entity values.
+
+        :return: New BotStory object
+        :rtype: BotStory
+        """
+
+        self.definition.seal()
+        return BotStory(self.definition)
+
+    def get_state(self):
+        """
+        Retrieve the storyline state of this session, e.g. to keep it in a
+        session store. Entity values may contain datetime objects.
+
+        :return: Dict of format { 'current_branch': branch,
+            'open_question': entity, 'entity_values': { branch: values },
+            'entities': { branch: entities } }, where entity_values only
+            holds branches with collected values and entities only holds
+            branch entity definitions that were extended in this session
+            (see entity_store_copy())
+        :rtype: dict
+        """
+
+        return { 'current_branch': self.current_branch,
+                 'open_question': self.open_question,
+                 'entity_values': { branch: dict(BranchValues(self, branch))
+                                    for branch in (self.values or {}) },
+                 'entities': dict(self.entity_overrides or {}) }
+
+    def set_state(self, state):
+        """
+        Restore the storyline state of a session retrieved with get_state().
+        Branches and entities that are not defined (anymore) are ignored.
+
+        :param dict state: Storyline state
+        """
+
+        self.current_branch = state['current_branch']
+        self.open_question = state['open_question']
+
+        self.entity_overrides = None
+        self.schema_overrides = None
+        overrides = { branch: entities for branch, entities in state['entities'].items()
+                      if branch in self.definition.entities }
+        if overrides:
+            self.entity_overrides = overrides
+
+        self.values = None
+        for branch, values in state['entity_values'].items():
+            if branch in self.definition.entities:
+                self.set_entity_values(values, branch)
+
+    def add_branch(self, branch_name, trigger_words = None, entities = None, \
+                   button = None):
+        """
+        Define a new storyline branch.
+        :param str branch_name: Branch name
+        :param list trigger_words: List of strings that should be considered
+                trigger words for the branch
+        :param entities: Dictionary with entity names as key and
+                { 'type': '<type>', 'question': 'Question text',
+                'buttons': [ 'a', 'b' ] } as value,
+                where <type> can be int:<min>:<max>, int_or_str, bool,
+                bool_confirm, date or str; The question text can contain
+                "{entity_name}" variables. Also, for type 'bool' additional
+                settings 'str_true' and 'str_false' can be given to define
+                formatting
+        :param button: String with a button name to link to the branch, or None
+                to not add show button
+        :raises botstory.entities.EntitySchemaError: If an entity definition is
+                invalid
+        :raises RuntimeError: If sessions were created from the definition
+        """
+
+        self.definition.add_branch(branch_name, trigger_words, entities, button)
+
+        if self.current_branch is None:
+            self.current_branch = branch_name
+
+    def add_blind_branches(self, prompts, add_buttons = True):
+        """
+        Define a new storyline branch.
+        :param list prompts: User prompt and bot reponses, in alternately
+        :param bool add_buttons: Add buttons for these branches?
+        """
+
+        self.definition.add_blind_branches(prompts, add_buttons)
+
+    def add_blind_branch(self, prompt, reply, add_buttons = True):
+        """
+        Define a new storyline branch.
+        :param str prompt: User prompt to react to
+        :param str reply: Bot response to train
+        :param bool add_buttons: Add buttons for these branches?
+        """
+
+        self.definition.add_blind_branch(prompt, reply, add_buttons)
+
     def get_training_data(self):
         """
         Retrieve list with conversation flows that the ChatterBot knowledge
         graph can be trained with.
         """
 
-        return self.training_data
+        return self.definition.training_data
 
     def get_branch_buttons(self):
         """
@@ -134,7 +389,7 @@ class BotStory():
         :rtype: list
         """
 
-        return self.branch_buttons
+        return self.definition.branch_buttons
 
     def get_branch_name(self):
         """
@@ -150,18 +405,17 @@ class BotStory():
         :rtype: bool
         """
 
-        if new_branch_name not in self.branches:
+        if new_branch_name not in self.definition.branches:
             return False
 
         self.current_branch = new_branch_name
 
         # Reset collected entities in target branch
-        self.entity_values[new_branch_name] = dict.fromkeys(
-                self.entity_values[new_branch_name].keys(), None)
-        #print(self.entity_values)
+        entities = self.get_entity_names(new_branch_name)
+        if self.values is not None:
+            self.values.pop(new_branch_name, None)
 
         # Get ready for first entity response
-        entities = list(self.entities[new_branch_name].keys())
         if len(entities) == 0:
             self.open_question = None
         else:
@@ -171,44 +425,155 @@ class BotStory():
 
     def get_entity_values(self):
         """
-        Return current storyline branch
+        Return the collected entity values of all branches
+
+        :return: Mapping of branch names to dict-like views of the values of
+            the branch, values can be set through them
+        :rtype: EntityValues
         """
 
-        return self.entity_values
+        return EntityValues(self)
 
-    def get_entity_values_formatted(self):
+    def get_branch_entities(self, branch = None):
         """
-        Retrieve formatted entities for current branch
+        Retrieve the entity definitions of a branch, including definitions
+        extended in this session
 
-        :return: User feedback or None if processing completed and no response
-            is required
-        :rtype: str
+        :param str branch: Branch name or None for the current branch
+        :rtype: dict
         """
 
-        entities_formatted = {}
+        if branch is None:
+            branch = self.current_branch
 
-        # Format available entities, traverse through all that are available
-        for key in self.entity_values[self.current_branch]:
-            val = self.entity_values[self.current_branch][key]
-            entity_type = self.entities[self.current_branch][key]['type'].split(':')
+        if self.entity_overrides is not None and branch in self.entity_overrides:
+            return self.entity_overrides[branch]
+        return self.definition.entities[branch]
 
-            if entity_type[0] == 'bool' and isinstance(val, bool):
-                # The entity definition can include a string to use for True or
-                # False when inserting the value into a user prompt
-                if 'str_true' in self.entities[self.current_branch][key] and \
-                        'str_false' in self.entities[self.current_branch][key]:
-                    if val:
-                        val = self.entities[self.current_branch][key]['str_true']
-                    else:
-                        val = self.entities[self.current_branch][key]['str_false']
+    def get_entity_names(self, branch = None):
+        """
+        Retrieve the entity names of a branch in definition order
 
-            if entity_type[0] == 'date' and isinstance(val, datetime.date):
-                # Format dates
-                val = val.strftime('%d/%m/%Y')
+        :param str branch: Branch name or None for the current branch
+        :rtype: tuple
+        """
 
-            entities_formatted[key] = val
+        if branch is None:
+            branch = self.current_branch
 
-        return entities_formatted
+        if self.entity_overrides is not None and branch in self.entity_overrides:
+            return tuple(self.entity_overrides[branch])
+        return self.definition.entity_names[branch]
+
+    def _entity_position(self, entity, branch):
+        """
+        Internal helper to find the index of an entity in the value list of a
+        branch
+        """
+
+        if self.entity_overrides is not None and branch in self.entity_overrides:
+            names = tuple(self.entity_overrides[branch])
+            if entity in names:
+                return names.index(entity)
+        elif entity in self.definition.entity_positions[branch]:
+            return self.definition.entity_positions[branch][entity]
+
+        raise KeyError(entity)
+
+    def get_entity_value(self, entity, branch = None):
+        """
+        Retrieve an entity value
+
+        :param str entity: Entity name
+        :param str branch: Branch name or None for the current branch
+        :return: Value or None if it was not collected yet
+        :raises KeyError: If the branch has no such entity
+        """
+
+        if branch is None:
+            branch = self.current_branch
+
+        position = self._entity_position(entity, branch)
+        if self.values is None or branch not in self.values:
+            return None
+
+        values = self.values[branch]
+        return values[position] if position < len(values) else None
+
+    def set_entity_value(self, entity, value, branch = None):
+        """
+        Set an entity value
+
+        :param str entity: Entity name
+        :param value: Value
+        :param str branch: Branch name or None for the current branch
+        :raises KeyError: If the branch has no such entity
+        """
+
+        if branch is None:
+            branch = self.current_branch
+
+        position = self._entity_position(entity, branch)
+        if self.values is None:
+            self.values = {}
+
+        values = self.values.get(branch)
+        if values is None:
+            values = self.values[branch] = [ None ] * len(self.get_entity_names(branch))
+        elif position >= len(values):
+            # Entities were added to the branch by entity_store_copy()
+            values.extend([ None ] * (position + 1 - len(values)))
+        values[position] = value
+
+    def set_entity_values(self, values, branch = None):
+        """
+        Set several entity values, ignoring entities the branch does not have
+
+        :param dict values: key<->val dict of entity values
+        :param str branch: Branch name or None for the current branch
+        """
+
+        if branch is None:
+            branch = self.current_branch
+
+        for entity in self.get_entity_names(branch):
+            if entity in values:
+                self.set_entity_value(entity, values[entity], branch)
+
+    def get_branch_schema(self, branch = None):
+        """
+        Retrieve the compiled entity definitions of a branch. Branches whose
+        entities were extended in this session, see entity_store_copy(), are
+        compiled on first use.
+
+        :param str branch: Branch name or None for the current branch
+        :rtype: botstory.entities.BranchSchema
+        """
+
+        if branch is None:
+            branch = self.current_branch
+
+        if self.entity_overrides is None or branch not in self.entity_overrides:
+            return self.definition.schemas[branch]
+
+        schema = (self.schema_overrides or {}).get(branch)
+        if schema is None or schema.entities is not self.entity_overrides[branch]:
+            schema = BranchSchema(self.entity_overrides[branch])
+            self.schema_overrides = { **(self.schema_overrides or {}), branch: schema }
+
+        return schema
+
+    def get_entity_values_formatted(self):
+        """
+        Retrieve formatted entities for current branch
+
+        :return: User feedback or None if processing completed and no response
+            is required
+        :rtype: str
+        """
+
+        return self.get_branch_schema().format(
+                dict(BranchValues(self, self.current_branch)))
 
     def entity_store_append(self, values):
         """
@@ -216,10 +581,11 @@ class BotStory():
         entity value store.
 
         :param dict values: key<->val dict of entity values
+        :raises KeyError: If the branch has no entity of a key
         """
 
-        self.entity_values[self.current_branch] = {
-            **self.entity_values[self.current_branch], **values }
+        for entity, value in values.items():
+            self.set_entity_value(entity, value)
 
     def entity_store_copy(self, source_branch):
         """
@@ -231,13 +597,14 @@ class BotStory():
         :rtype: bool
         """
 
-        if source_branch in self.entity_values:
-            self.entity_values[self.current_branch] = {
-                **self.entity_values[self.current_branch],
-                **self.entity_values[source_branch] }
-            self.entities[self.current_branch] = {
-                **self.entities[self.current_branch],
-                **self.entities[source_branch] }
+        if source_branch in self.definition.entities:
+            values = { **BranchValues(self, self.current_branch),
+                       **BranchValues(self, source_branch) }
+            self.entity_overrides = { **(self.entity_overrides or {}),
+                self.current_branch: {
+                    **self.get_branch_entities(),
+                    **self.get_branch_entities(source_branch) } }
+            self.set_entity_values(values)
             return True
 
         return False
@@ -248,16 +615,24 @@ class BotStory():
 
         :param str text: User message
         :param dict add_word_classes: Additional word classes to consider
-        :return: NLP dict from botstory.nlp.nlp_analyze is returned
-        :rtype: dict
+        :return: NLP result in the format of botstory.nlp.nlp_analyze. It is
+            computed on demand, so only the NLP stages needed by the intent
+            and entity processing of the message run.
+        :rtype: botstory.nlp.NLPResult
         """
 
-        if add_word_classes is None:
-            add_word_classes = {}
+        if add_word_classes:
+            word_classes = self.word_class_matcher.overlay(add_word_classes)
+        else:
+            word_classes = self.word_class_matcher
 
         query = nlp_prefilter(text)
-        self.nlp = nlp_analyze(query,
-                {**self.word_classes, **add_word_classes}) # merge dicts)
+
+        # Reuse results of other logic adapters for the same message if possible
+        if self.nlp_context is None:
+            self.nlp = nlp_analyze(query, word_classes, lazy = True)
+        else:
+            self.nlp = self.nlp_context.analyze(query, word_classes)
         return self.nlp
 
     def identify_intent(self):
@@ -269,9 +644,10 @@ class BotStory():
         :rtype: str
         """
 
-        for word_class in self.word_classes:
-            if word_class[0:8] == "trigger_" and \
-                    word_class in self.nlp['word_classes']:
+        # Matched word classes in order of definition
+        for word_class in self.word_class_matcher.ordered(
+                self.nlp['word_classes']):
+            if word_class[0:8] == "trigger_":
                 branch = word_class[8:]
                 return branch
 
@@ -296,65 +672,30 @@ class BotStory():
 
         # Assemble entities from user responses
 
-        if entity not in self.entities[self.current_branch] or \
-                'type' not in self.entities[self.current_branch][entity]:
+        schema = self.get_branch_schema()
+        if entity not in schema.types:
             return None
 
-        entity_type = self.entities[self.current_branch][entity]['type'].split(':')
-
         if entity == self.open_question:
             # Parallel takeup feature: Two entities can be configured to be allowed
             # within one sentence together. Find those entities to consider:
-            for key in self.entities[self.current_branch]:
-                val = self.entities[self.current_branch][key]
-                if 'parallel_takeup' in val and val['parallel_takeup'] == entity:
-                    self.process_entity_in_user_response(key)
+            for key in schema.parallel_takeup.get(entity, []):
+                self.process_entity_in_user_response(key)
 
         # Process type formats:
         # int:<min>:<max>, int_or_str, bool, bool_confirm, date or str
-        option = None
-
-        if entity_type[0] == "int" and len(nlp['numbers']) > 0:
-            num_min = -9999
-            num_max = 9999
-            if len(entity_type) > 1:
-                num_min = int(entity_type[1])
-            if len(entity_type) > 2:
-                num_max = int(entity_type[2])
-
-            if nlp['numbers'][-1] >= num_min and nlp['numbers'][-1] <= num_max:
-                option = nlp['numbers'][-1]
-        elif entity_type[0] == "bool":
-            if 'yes' in nlp['word_classes'] and not 'no' in nlp['word_classes']:
-                option = True
-            elif 'no' in nlp['word_classes'] and not 'yes' in nlp['word_classes']:
-                option = False
-        elif entity_type[0] == "bool_confirm":
-            if 'yes' in nlp['word_classes'] and not 'no' in nlp['word_classes']:
-                option = True # Confirmed
-            elif 'no' in nlp['word_classes'] and not 'yes' in nlp['word_classes']:
+        entity_type = schema.types[entity]
+        option = entity_type.extract(nlp)
+
+        if entity_type.confirm:
+            if option is False:
                 self.enter_branch('init')
                 return self.lang["no_confirm"] # Current branch cancelled
-            else:
+            if option is None:
                 return self.lang["confirm_wrong"] # Invalid answer
-        elif entity_type[0] == "str":
-            if len(nlp['tokens']) <= 3: # If it's very short the user probably typed in just the answer string
-                option = nlp['query']
-            else: # Extract noun from a full sentence
-                option = nlp['lastnoun']
-        elif entity_type[0] == "int_or_str":
-            if len(nlp['tokens']) <= 3: # If it's very short the user probably typed in just the answer string
-                if len(nlp['numbers']) > 0:
-                    option = str(nlp['numbers'][0])
-                else:
-                    option = str(nlp['query'])
-            else: # extract noun from a full sentence
-                option = str(nlp['lastnoun'])
-        elif entity_type[0] == "date" and nlp['date'] is not None:
-            option = nlp['date']
 
         if option is not None:
-            self.entity_values[self.current_branch][entity] = option
+            self.set_entity_value(entity, option)
             self.open_question = None
 
         #print(self.entity_values[self.current_branch])
@@ -369,14 +710,15 @@ class BotStory():
         """
 
         # Prompt user for open entities
-        if self.current_branch in self.entities.keys():
+        if self.current_branch in self.definition.entities:
             # We are currently in a state in the logic flow, where we are assembling data
-            for key in self.entities[self.current_branch]:
-                if self.entity_values[self.current_branch][key] is None:
+            entities = self.get_branch_entities()
+            for key in entities:
+                if self.get_entity_value(key) is None:
                     self.open_question = key
 
                     # Format the text question with variables that may be inserted
-                    return self.entities[self.current_branch][key]['question']. \
+                    return entities[key]['question']. \
                             format(**self.get_entity_values_formatted())
 
         return None # we have assembled all entities
@@ -407,7 +749,7 @@ class BotStory():
                 not isinstance(self.open_question, str):
             return None
 
-        info = dict(self.entities[self.current_branch][self.open_question])
+        info = dict(self.get_branch_entities()[self.open_question])
         info['entity'] = self.open_question
         return info
 
@@ -420,27 +762,8 @@ class BotStory():
         :rtype: list
         """
 
-        open_entity = self.get_last_requested_entity()
-        if open_entity is None:
+        if not isinstance(self.current_branch, str) or \
+                not isinstance(self.open_question, str):
             return None
 
-        if 'buttons' in open_entity:
-            return open_entity['buttons']
-
-        entity_type = open_entity['type'].split(':')
-
-        if entity_type[0] == 'bool' or entity_type[0] == 'bool_confirm':
-            buttons = [ 'Yes', 'No' ]
-        elif entity_type[0] == 'date':
-            buttons = [ 'Today', 'Tomorrow' ]
-        elif entity_type[0] == 'int':
-            if len(entity_type) != 3:
-                buttons = []
-            else:
-                if (int(entity_type[1]) + 6) < int(entity_type[2]):
-                    entity_type[2] = int(entity_type[1]) + 6
-                buttons = list(range(int(entity_type[1]), int(entity_type[2]) + 1))
-        else:
-            buttons = []
-
-        return buttons
+        return list(self.get_branch_schema().types[self.open_question].buttons)
@@ -0,0 +1,271 @@
+"""
+(C) 2021 Julian von Mendel <prog@derjulian.net>
+
+chatlog.py
+====================================
+Bounded chat logs: A session keeps its most recent messages in a ring
+buffer, so its memory and session state do not grow with the length of the
+conversation. Optionally, all messages are appended to a spill, a log file
+or SQLite table per session, from which the full history can be streamed,
+e.g. for audits.
+"""
+
+import os
+import json
+import uuid
+import sqlite3
+import threading
+import collections
+import urllib.parse
+
+DEFAULT_WINDOW = 200 # Messages a chat log keeps in memory
+READ_BATCH_SIZE = 500 # Messages read from a spill at once
+
+class ChatLogSpill:
+    """
+    Interface of append-only message stores shared by the chat logs of all
+    sessions. Messages are keyed by log id and sequence number.
+    """
+
+    def append(self, log_id, seq, msg):
+        """
+        Store a message
+
+        :param str log_id: Id of the chat log
+        :param int seq: Sequence number of the message in the chat log
+        :param str msg: Message
+        """
+
+        raise NotImplementedError()
+
+    def read(self, log_id, stop = None):
+        """
+        Stream the stored messages of a chat log in order
+
+        :param str log_id: Id of the chat log
+        :param int stop: Only messages with a lower sequence number, or None
+            for all
+        :return: Iterator of messages
+        """
+
+        raise NotImplementedError()
+
+class FileSpill(ChatLogSpill):
+    """
+    Spill writing one log file of JSON lines per chat log into a directory
+
+    :param str directory: Directory of the log files, created if missing
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok = True)
+
+    def path(self, log_id):
+        """
+        Path of the log file of a chat log
+        """
+
+        if not log_id.isalnum():
+            raise ValueError('Invalid chat log id: {}'.format(log_id))
+        return os.path.join(self.directory, '{}.log'.format(log_id))
+
+    def append(self, log_id, seq, msg):
+        line = json.dumps({ 'seq': seq, 'msg': msg }) + '\n'
+        with open(self.path(log_id), 'a', encoding = 'utf-8') as log_file:
+            log_file.write(line)
+
+    def read(self, log_id, stop = None):
+        try:
+            log_file = open(self.path(log_id), 'r', encoding = 'utf-8')
+        except FileNotFoundError:
+            return
+
+        with log_file:
+            for line in log_file:
+                entry = json.loads(line)
+                if stop is not None and entry['seq'] >= stop:
+                    return
+                yield entry['msg']
+
+class SQLiteSpill(ChatLogSpill):
+    """
+    Spill in an SQLite table, which can be shared by all worker processes on
+    a host
+
+    :param str path: Path of the database file
+    """
+
+    def __init__(self, path):
+        self.connection = sqlite3.connect(path, check_same_thread = False,
+                                          isolation_level = None)
+        self.lock = threading.Lock()
+
+        with self.lock:
+            self.connection.execute('PRAGMA journal_mode=WAL')
+            self.connection.execute('CREATE TABLE IF NOT EXISTS botstory_chatlog '
+                    '(log_id TEXT NOT NULL, seq INTEGER NOT NULL, '
+                    'msg TEXT NOT NULL, PRIMARY KEY (log_id, seq))')
+
+    def append(self, log_id, seq, msg):
+        with self.lock:
+            self.connection.execute('INSERT OR REPLACE INTO botstory_chatlog '
+                    '(log_id, seq, msg) VALUES (?, ?, ?)', (log_id, seq, msg))
+
+    def read(self, log_id, stop = None):
+        if stop is None:
+            stop = 2 ** 63 - 1
+
+        # Read in batches, so the lock is not held while the caller iterates
+        seq = -1
+        while True:
+            with self.lock:
+                rows = self.connection.execute('SELECT seq, msg FROM botstory_chatlog '
+                        'WHERE log_id = ? AND seq > ? AND seq < ? ORDER BY seq LIMIT ?',
+                        (log_id, seq, stop, READ_BATCH_SIZE)).fetchall()
+
+            for seq, msg in rows:
+                yield msg
+
+            if len(rows) < READ_BATCH_SIZE:
+                return
+
+def create_chatlog_spill(url):
+    """
+    Create a chat log spill from a URL:
+    'file:///<directory>' for log files,
+    'sqlite:///<path>' for an SQLite table.
+
+    :param str url: Spill URL
+    :return: Spill or None for an empty URL
+    :rtype: ChatLogSpill
+    """
+
+    if not url:
+        return None
+
+    parsed = urllib.parse.urlparse(url)
+    if parsed.scheme == 'file':
+        return FileSpill(parsed.path[1:])
+
+    if parsed.scheme == 'sqlite':
+        return SQLiteSpill(parsed.path[1:])
+
+    raise ValueError("Unknown chat log spill URL: {}".format(url))
+
+class ChatLog:
+    """
+    Chat log of a session. The most recent messages are kept in a ring
+    buffer; with a spill, all messages are also appended to it and the full
+    history remains available. Iteration streams the history, older
+    messages from the spill and recent ones from memory.
+
+    A chat log only gets a log id and entries in the spill with its first
+    message that is not deferred, see append(). So chat logs that are
+    replaced by a restored session state leave nothing in the spill.
+
+    :param int window: Number of messages to keep in memory
+    :param ChatLogSpill spill: Store of all messages, or None to forget
+        messages that leave the window
+    """
+
+    def __init__(self, window = DEFAULT_WINDOW, spill = None):
+        self.messages = collections.deque(maxlen = window)
+        self.spill = spill
+        self.count = 0 # Messages appended in total
+        self.spilled = 0 # Messages written to the spill
+        self.log_id = None # Assigned on the first write to the spill
+
+    def append(self, msg, defer = False):
+        """
+        Add a message
+
+        :param str msg: Message
+        :param bool defer: Keep the message in memory only until the next
+            message that is not deferred, e.g. for a welcome message that a
+            restored session state replaces
+        """
+
+        self.messages.append(msg)
+        self.count += 1
+        if not defer:
+            self.flush()
+
+    def flush(self):
+        """
+        Write deferred messages to the spill
+        """
+
+        if self.spill is None or self.spilled == self.count:
+            return
+
+        if self.log_id is None:
+            self.log_id = uuid.uuid4().hex
+
+        # Deferred messages that already left the window are lost
+        first = self.count - len(self.messages) # Sequence number of messages[0]
+        for seq in range(max(self.spilled, first), self.count):
+            self.spill.append(self.log_id, seq, self.messages[seq - first])
+        self.spilled = self.count
+
+    def recent(self):
+        """
+        Messages in memory
+
+        :rtype: list
+        """
+
+        return list(self.messages)
+
+    def __iter__(self):
+        first = self.count - len(self.messages) # Sequence number of messages[0]
+        if self.spill is not None and self.log_id is not None and first > 0:
+            yield from self.spill.read(self.log_id, first)
+        yield from list(self.messages)
+
+    def __len__(self):
+        if self.spill is not None:
+            return self.count
+        return len(self.messages)
+
+    def __eq__(self, other):
+        if isinstance(other, (ChatLog, list, tuple)):
+            return list(self) == list(other)
+        return NotImplemented
+
+    __hash__ = None
+
+    def get_state(self):
+        """
+        Retrieve the state of the chat log, e.g. to keep it in a session
+        store. Messages in the spill are not included.
+
+        :return: Dict of format { 'messages': recent_messages,
+            'count': count, 'spilled': spilled_count, 'log_id': log_id }
+        :rtype: dict
+        """
+
+        return { 'messages': list(self.messages), 'count': self.count,
+                 'spilled': self.spilled, 'log_id': self.log_id }
+
+    def set_state(self, state):
+        """
+        Restore a state retrieved with get_state(). Deferred messages of
+        this chat log are discarded.
+
+        :param dict state: Chat log state, or a list of messages
+        """
+
+        if isinstance(state, list):
+            # Session states before bounded chat logs
+            state = { 'messages': state, 'count': len(state), 'log_id': None }
+
+        self.messages.clear()
+        self.messages.extend(state['messages'])
+        self.count = state['count']
+        self.log_id = state['log_id']
+        if 'spilled' in state:
+            self.spilled = state['spilled']
+        else:
+            # States before deferred messages were written to the spill
+            self.spilled = self.count if self.log_id is not None else 0
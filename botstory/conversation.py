@@ -0,0 +1,118 @@
+"""
+(C) 2021 Julian von Mendel <prog@derjulian.net>
+
+conversation.py
+====================================
+Per-session conversation state that is handed to logic adapters on every turn.
+"""
+
+import contextlib
+import contextvars
+
+# Conversation whose message is currently processed, see current_conversation()
+_active_conversation = contextvars.ContextVar('botstory_conversation',
+                                              default = None)
+
+class ConversationState:
+    """
+    Per-session conversation state.
+
+    Logic adapters receive the state of the session in processing on every
+    call instead of keeping state themselves, so one set of adapter instances
+    serves all sessions and threads.
+
+    :param BotStory botstory: Storyline state of the session, see
+            BotStory.new_session()
+    """
+
+    def __init__(self, botstory):
+        self.botstory = botstory
+        self.search_results = None # Search results presented to the user
+        self.button_overwrite = {} # Pending UI buttons provided by business logic
+        self.data = {} # Further data logic adapters keep for the session
+
+    def get_state(self):
+        """
+        Retrieve the conversation state, e.g. to keep it in a session store.
+        Logic adapters must only keep JSON serializable data, apart from
+        datetime objects, in search_results, button_overwrite and data.
+
+        :return: Dict of format { 'botstory': botstory_state,
+            'search_results': search_results,
+            'button_overwrite': button_overwrite, 'data': data }
+        :rtype: dict
+        """
+
+        return { 'botstory': self.botstory.get_state(),
+                 'search_results': self.search_results,
+                 'button_overwrite': dict(self.button_overwrite),
+                 'data': dict(self.data) }
+
+    def set_state(self, state):
+        """
+        Restore a conversation state retrieved with get_state()
+
+        :param dict state: Conversation state
+        """
+
+        self.botstory.set_state(state['botstory'])
+        self.search_results = state['search_results']
+        self.button_overwrite = dict(state['button_overwrite'])
+        self.data = dict(state['data'])
+
+    @property
+    def branch(self):
+        """
+        Current storyline branch
+        """
+
+        return self.botstory.get_branch_name()
+
+    @property
+    def open_question(self):
+        """
+        Entity the user was last asked for
+        """
+
+        return self.botstory.open_question
+
+    @property
+    def entity_values(self):
+        """
+        Collected entity values of all branches
+        """
+
+        return self.botstory.get_entity_values()
+
+    @property
+    def nlp_context(self):
+        """
+        NLP results of the message in processing, see botstory.nlp.NLPContext
+        """
+
+        return self.botstory.nlp_context
+
+def current_conversation():
+    """
+    Retrieve the conversation state of the message in processing
+
+    :return: Conversation state or None if no message is processed
+    :rtype: ConversationState
+    """
+
+    return _active_conversation.get()
+
+@contextlib.contextmanager
+def active_conversation(conversation):
+    """
+    Context manager to make a conversation state available to logic adapters
+    while a message is processed
+
+    :param ConversationState conversation: Conversation state of the session
+    """
+
+    token = _active_conversation.set(conversation)
+    try:
+        yield conversation
+    finally:
+        _active_conversation.reset(token)
@@ -0,0 +1,95 @@
+"""
+(C) 2021 Julian von Mendel <prog@derjulian.net>
+
+conversationlogicadapter.py
+====================================
+Base class for stateless Chatterbot logic adapters that work on the
+conversation state of the session in processing.
+"""
+
+from chatterbot.logic import LogicAdapter
+from botstory.nlp import message_words
+from botstory.conversation import current_conversation
+
+class ConversationLogicAdapter(LogicAdapter):
+    """
+    Base class for stateless Chatterbot logic adapters.
+
+    Derived classes implement can_process_conversation() and
+    process_conversation(), which receive the ConversationState of the
+    session in processing. They must not keep per-session or per-message
+    state in the adapter instance, as one instance serves all sessions.
+
+    Adapters that only respond to messages containing certain words set
+    trigger_words, so other messages are rejected by a cheap word check
+    before can_process_conversation() runs NLP.
+    """
+
+    trigger_words = None # Set of lowercase words, or None to process all messages
+
+    def can_process(self, statement):
+        """
+        Chatterbot interface to check whether a statement can be processed by
+        this logic adapter.
+        """
+
+        conversation = current_conversation()
+        if not self.triggered(statement, conversation):
+            return False
+
+        return self.can_process_conversation(statement, conversation)
+
+    def triggered(self, statement, conversation):
+        """
+        Pre-filter of can_process(): Check whether a statement contains one
+        of the trigger words, without running NLP.
+
+        :param Statement statement: User prompt
+        :param ConversationState conversation: State of the session in
+            processing, or None if the chatbot does not provide one
+        :rtype: bool
+        """
+
+        if self.trigger_words is None:
+            return True
+
+        if conversation is None or conversation.nlp_context is None:
+            words = message_words(statement.text)
+        else:
+            words = conversation.nlp_context.words(statement.text)
+
+        return not self.trigger_words.isdisjoint(words)
+
+    def process(self, statement, additional_response_selection_parameters = None):
+        """
+        Chatterbot interface for processing of statements.
+        """
+
+        return self.process_conversation(statement, current_conversation(),
+                additional_response_selection_parameters)
+
+    def can_process_conversation(self, statement, conversation):
+        """
+        Check whether a statement can be processed by this logic adapter.
+
+        :param Statement statement: User prompt
+        :param ConversationState conversation: State of the session in
+            processing, or None if the chatbot does not provide one
+        :rtype: bool
+        """
+
+        return True
+
+    def process_conversation(self, statement, conversation, \
+                             additional_response_selection_parameters = None):
+        """
+        Process a statement and return the response.
+
+        :param Statement statement: User prompt
+        :param ConversationState conversation: State of the session in
+            processing, or None if the chatbot does not provide one
+        :return: Response statement with confidence
+        :rtype: Statement
+        """
+
+        raise NotImplementedError()
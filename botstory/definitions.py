@@ -0,0 +1,151 @@
+"""
+(C) 2021 Julian von Mendel <prog@derjulian.net>
+
+definitions.py
+====================================
+Word definitions from NLTK WordNet for DefinitionsLogicAdapter: Formatted
+definitions are kept in a bounded LRU cache, and can be served from a
+precompiled lemma table, so a definition costs a single dictionary lookup
+instead of a WordNet query.
+"""
+
+import os
+import gzip
+import json
+import functools
+
+DEFINITIONS_FORMAT = '1' # Increased on incompatible changes of the table layout
+DEFAULT_CACHE_SIZE = 4096 # Words with cached definitions
+
+class DefinitionsError(Exception):
+    """
+    Raised if a file is no usable definitions table
+    """
+
+def format_definitions(definitions):
+    """
+    Format WordNet definitions as response text
+
+    :param list definitions: Definitions of the synsets of a word
+    :return: Response text or None if there are no definitions
+    :rtype: str
+    """
+
+    if len(definitions) == 0:
+        return None
+    return ". ".join(definition.capitalize() for definition in definitions) + "."
+
+def wordnet_definitions(word):
+    """
+    Query WordNet for the definitions of all synsets of a word
+
+    :param str word: Word, lemmatized by WordNet
+    :return: List of definitions
+    :rtype: list
+    """
+
+    from nltk.corpus import wordnet # pylint: disable=import-outside-toplevel
+    return [ synset.definition() for synset in wordnet.synsets(word) ]
+
+def build_definitions_table(path, lemmas = None):
+    """
+    Precompile the WordNet definitions of all lemmas into a table file
+
+    :param str path: Path of the table to write, replaced if it exists
+    :param list lemmas: Lemmas to include, defaults to all WordNet lemmas
+    :return: Dict of format { 'lemmas': count, 'definitions': count }
+    :rtype: dict
+    """
+
+    from nltk.corpus import wordnet # pylint: disable=import-outside-toplevel
+
+    if lemmas is None:
+        lemmas = wordnet.all_lemma_names()
+
+    # Definitions are stored once and referenced by index, as most synsets
+    # belong to several lemmas
+    definitions = []
+    index = {} # Synset name -> index in definitions
+    table = {} # Lemma -> list of definition indexes
+    for lemma in lemmas:
+        key = lemma.lower()
+        if key in table:
+            continue
+
+        entries = []
+        for synset in wordnet.synsets(key):
+            if synset.name() not in index:
+                index[synset.name()] = len(definitions)
+                definitions.append(synset.definition())
+            entries.append(index[synset.name()])
+        table[key] = entries
+
+    tmp_path = '{}.tmp{}'.format(path, os.getpid())
+    with gzip.open(tmp_path, 'wt', encoding = 'utf-8') as table_file:
+        json.dump({ 'format': DEFINITIONS_FORMAT, 'wordnet': wordnet.get_version(),
+                    'definitions': definitions, 'lemmas': table },
+                  table_file, separators = (',', ':'))
+    os.replace(tmp_path, path)
+
+    return { 'lemmas': len(table), 'definitions': len(definitions) }
+
+def load_definitions_table(path):
+    """
+    Load a table written by build_definitions_table()
+
+    :param str path: Path of the table
+    :return: Dict of format { lemma: tuple_of_definitions }
+    :rtype: dict
+    :raises DefinitionsError: If the file is no definitions table or of an
+        unsupported format
+    """
+
+    try:
+        with gzip.open(path, 'rt', encoding = 'utf-8') as table_file:
+            data = json.load(table_file)
+    except (OSError, ValueError) as error:
+        raise DefinitionsError('{} is no definitions table: {}'.format(path, error))
+
+    if not isinstance(data, dict) or data.get('format') != DEFINITIONS_FORMAT:
+        raise DefinitionsError('Definitions table {} has unsupported format {}'.format(
+                path, data.get('format') if isinstance(data, dict) else None))
+
+    definitions = data['definitions']
+    return { lemma: tuple(definitions[i] for i in entries)
+             for lemma, entries in data['lemmas'].items() }
+
+class DefinitionLookup:
+    """
+    Cached lookup of formatted word definitions. Words are looked up in the
+    precompiled table if one is given, other words, e.g. inflected forms,
+    are passed on to WordNet.
+
+    :param str table_path: Path of a table written by
+        build_definitions_table() or None to query WordNet only
+    :param int cache_size: Number of words to keep the definitions of
+    """
+
+    def __init__(self, table_path = None, cache_size = DEFAULT_CACHE_SIZE):
+        self.table = {} if table_path is None else load_definitions_table(table_path)
+        self.lookup_cached = functools.lru_cache(maxsize = cache_size)(self._lookup)
+
+    def _lookup(self, key):
+        """
+        Internal helper to look up the definitions of a lowercase word
+        """
+
+        definitions = self.table.get(key)
+        if definitions is None:
+            definitions = wordnet_definitions(key)
+        return format_definitions(definitions)
+
+    def lookup(self, word):
+        """
+        Formatted definitions of a word
+
+        :param str word: Word
+        :return: Response text or None if the word is unknown
+        :rtype: str
+        """
+
+        return self.lookup_cached(word.lower())
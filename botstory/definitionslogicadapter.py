@@ -7,47 +7,55 @@ Chatterbot logic adapter to pull definitions from NLTK wordnet for user prompts
 such as "What is a car?" or "Explain what a hotel is." or "Define reservation."
 """
 
-from chatterbot.logic import LogicAdapter
 from chatterbot.conversation import Statement
-from nltk.corpus import wordnet as wn
 from botstory.nlp import nlp_analyze
+from botstory.definitions import DefinitionLookup, DEFAULT_CACHE_SIZE
+from botstory.conversationlogicadapter import ConversationLogicAdapter
 
-class DefinitionsLogicAdapter(LogicAdapter):
+class DefinitionsLogicAdapter(ConversationLogicAdapter):
     """
     Chatterbot logic adapter to pull definitions from NLTK wordnet for user prompts
+
+    :param str definitions_table: Precompiled definitions table, see
+        botstory.definitions.build_definitions_table(), or None to query
+        WordNet only
+    :param int definitions_cache_size: Number of words to cache the
+        definitions of
     """
 
     def __init__(self, chatbot, **kwargs):
         super().__init__(chatbot, **kwargs)
 
-        output_text = kwargs.get('output_text')
-        self.response_statement = Statement(output_text)
+        self.output_text = kwargs.get('output_text')
+        self.definitions = DefinitionLookup(kwargs.get('definitions_table'),
+                kwargs.get('definitions_cache_size', DEFAULT_CACHE_SIZE))
 
-        # Trigger words
+        # Trigger words, checked by the can_process() pre-filter without NLP
         self.word_classes = {
             'triggerAny': ['what', 'define', 'explain' ] }
+        self.trigger_words = frozenset(self.word_classes['triggerAny'])
 
-    def can_process(self, statement):
+    def analyze(self, text, conversation, skip_words_in_nlp = 0):
         """
-        Chatterbot interface to check whether a statement can be processed by
-        this logic adapter.
+        Run NLP on a user prompt, reusing the results of other logic adapters
+        for the same message if the chatbot provides an NLP context.
         """
-        # Verify that the user prompt matches our word triggers
-        query = nlp_analyze(statement.text, self.word_classes)
 
-        if 'triggerAny' in query['word_classes']:
-            return True
+        if conversation is None or conversation.nlp_context is None:
+            return nlp_analyze(text, self.word_classes, skip_words_in_nlp)
 
-        return False
+        return conversation.nlp_context.analyze(text, self.word_classes,
+                skip_words_in_nlp)
 
-    def process(self, statement, additional_response_selection_parameters = None):
+    def process_conversation(self, statement, conversation, \
+                             additional_response_selection_parameters = None):
         """
-        Chatterbot interface for processing of statements: Identify word a
-        user wishes to defined and respond with the definition from WordNet if
-        one can be found.
+        Processing of statements: Identify word a user wishes to defined and
+        respond with the definition from WordNet if one can be found.
         """
 
-        query = nlp_analyze(statement.text, self.word_classes, 1) # skip first word
+        query = self.analyze(statement.text, conversation, 1) # skip first word
+        response_statement = Statement(self.output_text)
 
         # noun = nlp['tokens'][-1] # preliminary solution to avoid proper word tagging
         noun = query['lastnoun']
@@ -55,21 +63,16 @@ class DefinitionsLogicAdapter(LogicAdapter):
 
         # Let NLTK wordnet identify common synonyms
         if noun is None:
-            synsets = []
+            definitions = None
         else:
-            synsets = wn.synsets(noun)
+            definitions = self.definitions.lookup(noun)
 
-        if len(synsets) == 0:
+        if definitions is None:
             # No definition found; return no result with low confidence
-            self.response_statement.confidence = 0.1
-            self.response_statement.text = "Sorry, I don't understand."
+            response_statement.confidence = 0.1
+            response_statement.text = "Sorry, I don't understand."
         else:
-            # Retrieve word definitions from NLTK wordnet
-            definitions = list()
-            for i in synsets:
-                definitions.append(wn.synset(i.name()).definition().capitalize())
-
-            self.response_statement.confidence = 0.9
-            self.response_statement.text = ". ".join(definitions) + "."
+            response_statement.confidence = 0.9
+            response_statement.text = definitions
 
-        return self.response_statement
+        return response_statement
@@ -0,0 +1,236 @@
+"""
+(C) 2021 Julian von Mendel <prog@derjulian.net>
+
+entities.py
+====================================
+Compiled entity schemas of storyline branches: Entity definitions passed to
+BotStory.add_branch() are validated once and turned into typed entity
+objects, which extract values from NLP results, provide default buttons and
+format values for user prompts.
+"""
+
+import datetime
+
+INT_MIN = -9999 # Bounds of int entities without explicit bounds
+INT_MAX = 9999
+MAX_INT_BUTTONS = 7 # Buttons offered for int entities with both bounds
+
+class EntitySchemaError(ValueError):
+    """
+    Raised for invalid entity definitions
+    """
+
+class EntityType:
+    """
+    Base class of entity types
+
+    :param dict definition: Entity definition of format { 'type': '<type>',
+        'question': 'Question text', ... }, see BotStory.add_branch()
+    :param list params: Parameters following the type name in the type string
+    """
+
+    name = None
+    confirm = False # Entity confirms or cancels the branch
+    default_buttons = []
+
+    def __init__(self, definition, params):
+        if params:
+            raise EntitySchemaError('Type {} takes no parameters'.format(self.name))
+
+        self.definition = definition
+        self.buttons = definition.get('buttons', self.default_buttons)
+
+    def extract(self, nlp):
+        """
+        Extract the entity value from a user message
+
+        :param dict nlp: NLP result of the message, see botstory.nlp.nlp_analyze()
+        :return: Entity value or None if the message does not contain one
+        """
+
+        raise NotImplementedError
+
+    def format(self, value):
+        """
+        Format an entity value for insertion into a user prompt
+        """
+
+        return value
+
+class IntEntity(EntityType):
+    """
+    Integer in a range, type int:<min>:<max>
+    """
+
+    name = 'int'
+
+    def __init__(self, definition, params):
+        if len(params) > 2:
+            raise EntitySchemaError('Type int takes at most two bounds')
+
+        try:
+            bounds = [ int(param) for param in params ]
+        except ValueError:
+            raise EntitySchemaError('Invalid bounds of type int: {}'.format(params))
+
+        self.min = bounds[0] if len(bounds) > 0 else INT_MIN
+        self.max = bounds[1] if len(bounds) > 1 else INT_MAX
+        if self.min > self.max:
+            raise EntitySchemaError('Lower bound of type int is above upper bound')
+
+        # Buttons for the lowest values if both bounds are given
+        if len(bounds) == 2:
+            self.default_buttons = list(range(self.min,
+                    min(self.max, self.min + MAX_INT_BUTTONS - 1) + 1))
+
+        super().__init__(definition, [])
+
+    def extract(self, nlp):
+        if len(nlp['numbers']) > 0 and self.min <= nlp['numbers'][-1] <= self.max:
+            return nlp['numbers'][-1]
+        return None
+
+class BoolEntity(EntityType):
+    """
+    Yes or no, type bool. The definition settings 'str_true' and 'str_false'
+    define the formatting of the value.
+    """
+
+    name = 'bool'
+    default_buttons = [ 'Yes', 'No' ]
+
+    def __init__(self, definition, params):
+        super().__init__(definition, params)
+
+        self.strings = None
+        if 'str_true' in definition and 'str_false' in definition:
+            self.strings = { True: definition['str_true'], False: definition['str_false'] }
+
+    def extract(self, nlp):
+        if 'yes' in nlp['word_classes'] and not 'no' in nlp['word_classes']:
+            return True
+        if 'no' in nlp['word_classes'] and not 'yes' in nlp['word_classes']:
+            return False
+        return None
+
+    def format(self, value):
+        if self.strings is not None and isinstance(value, bool):
+            return self.strings[value]
+        return value
+
+class BoolConfirmEntity(BoolEntity):
+    """
+    Confirmation of the branch, type bool_confirm: False cancels the branch,
+    no answer is asked again
+    """
+
+    name = 'bool_confirm'
+    confirm = True
+
+class DateEntity(EntityType):
+    """
+    Date, type date
+    """
+
+    name = 'date'
+    default_buttons = [ 'Today', 'Tomorrow' ]
+
+    def extract(self, nlp):
+        return nlp['date']
+
+    def format(self, value):
+        if isinstance(value, datetime.date):
+            return value.strftime('%d/%m/%Y')
+        return value
+
+class StrEntity(EntityType):
+    """
+    Free text, type str: Short messages are taken as they are, otherwise the
+    last noun
+    """
+
+    name = 'str'
+
+    def extract(self, nlp):
+        if len(nlp['tokens']) <= 3: # If it's very short the user probably typed in just the answer string
+            return nlp['query']
+        return nlp['lastnoun'] # Extract noun from a full sentence
+
+class IntOrStrEntity(EntityType):
+    """
+    Number or free text as string, type int_or_str
+    """
+
+    name = 'int_or_str'
+
+    def extract(self, nlp):
+        if len(nlp['tokens']) <= 3: # If it's very short the user probably typed in just the answer string
+            if len(nlp['numbers']) > 0:
+                return str(nlp['numbers'][0])
+            return str(nlp['query'])
+        return str(nlp['lastnoun']) # extract noun from a full sentence
+
+ENTITY_TYPES = { entity_type.name: entity_type for entity_type in
+                 (IntEntity, BoolEntity, BoolConfirmEntity, DateEntity,
+                  StrEntity, IntOrStrEntity) }
+
+def compile_entity(entity, definition):
+    """
+    Validate an entity definition and create its typed entity object
+
+    :param str entity: Entity name
+    :param dict definition: Entity definition, see BotStory.add_branch()
+    :rtype: EntityType
+    :raises EntitySchemaError: If the definition is invalid
+    """
+
+    if not isinstance(definition, dict) or not isinstance(definition.get('type'), str):
+        raise EntitySchemaError('Entity {} needs a type'.format(entity))
+    if not isinstance(definition.get('question'), str):
+        raise EntitySchemaError('Entity {} needs a question'.format(entity))
+
+    name, *params = definition['type'].split(':')
+    if name not in ENTITY_TYPES:
+        raise EntitySchemaError('Entity {} has unknown type {}'.format(entity, name))
+
+    try:
+        return ENTITY_TYPES[name](definition, params)
+    except EntitySchemaError as error:
+        raise EntitySchemaError('Entity {}: {}'.format(entity, error))
+
+class BranchSchema:
+    """
+    Compiled entity definitions of a storyline branch
+
+    :param dict entities: Entity definitions of the branch, see
+        BotStory.add_branch()
+    :raises EntitySchemaError: If a definition is invalid
+    """
+
+    def __init__(self, entities):
+        self.entities = entities # Definitions the schema was compiled from
+        self.types = { entity: compile_entity(entity, definition)
+                       for entity, definition in entities.items() }
+
+        # Entities to take up from a message answering another entity
+        self.parallel_takeup = {}
+        for entity, definition in entities.items():
+            target = definition.get('parallel_takeup')
+            if target is None:
+                continue
+            if target not in entities or target == entity:
+                raise EntitySchemaError('Entity {} has invalid parallel_takeup {}'.format(
+                        entity, target))
+            self.parallel_takeup.setdefault(target, []).append(entity)
+
+    def format(self, values):
+        """
+        Format the entity values of the branch for insertion into user
+        prompts
+
+        :param dict values: Entity values
+        :rtype: dict
+        """
+
+        return { entity: self.types[entity].format(value) if entity in self.types else value
+                 for entity, value in values.items() }
@@ -0,0 +1,272 @@
+"""
+(C) 2021 Julian von Mendel <prog@derjulian.net>
+
+indexedbestmatch.py
+====================================
+Chatterbot BestMatch logic adapter that retrieves its candidate statements
+through an in-memory inverted index instead of a substring search over the
+whole statement table.
+"""
+
+import string
+import threading
+
+from sqlalchemy import not_
+from sqlalchemy.exc import SQLAlchemyError
+from chatterbot.logic import BestMatch
+from chatterbot.search import IndexedTextSearch
+from chatterbot.conversation import Statement
+
+ID_CHUNK_SIZE = 500 # Statement ids per query, below SQLite's variable limit
+MAX_CACHED_WORDS = 10000 # Query words to cache index lookups for
+GRAM_SIZE = 3 # Longest substrings of indexed words to find them by
+
+# SQLite LIKE ignores case for ASCII characters only
+ASCII_LOWER = str.maketrans(string.ascii_uppercase, string.ascii_lowercase)
+
+class StatementIndex:
+    """
+    Inverted index of the words in statement search texts to statement ids.
+
+    Lookups match the semantics of ChatterBot's search_text_contains filter
+    (SQL LIKE '%word%'): A query word matches all statements with an indexed
+    word containing it. Indexed words are found through their substrings of
+    up to GRAM_SIZE characters, so a lookup never scans the vocabulary.
+    """
+
+    def __init__(self):
+        self.postings = None # Indexed word -> list of statement ids
+        self.grams = None # Substring of up to GRAM_SIZE characters -> indexed words
+        self.statement_ids = [] # All statement ids
+        self.cache = {} # Query word -> statement ids
+        self.lock = threading.Lock()
+
+    def build(self, storage):
+        """
+        Index all statements in a storage adapter
+
+        :param SQLStorageAdapter storage: Chatterbot storage
+        """
+
+        statement_model = storage.get_model('statement')
+        session = storage.Session()
+        postings = {}
+        statement_ids = []
+
+        try:
+            for statement_id, search_text in session.query(statement_model.id,
+                    statement_model.search_text).order_by(statement_model.id):
+                statement_ids.append(statement_id)
+                for word in set((search_text or '').translate(ASCII_LOWER).split(' ')):
+                    postings.setdefault(word, []).append(statement_id)
+        finally:
+            session.close()
+
+        grams = {}
+        for word in postings:
+            for gram in word_grams(word):
+                grams.setdefault(gram, set()).add(word)
+
+        with self.lock:
+            self.postings = postings
+            self.grams = grams
+            self.statement_ids = statement_ids
+            self.cache = {}
+
+    def invalidate(self):
+        """
+        Drop the index, it will be rebuilt on next use
+        """
+
+        with self.lock:
+            self.postings = None
+            self.grams = None
+            self.cache = {}
+
+    def snapshot(self, storage):
+        """
+        Retrieve the current index, building it if necessary. The snapshot
+        stays usable if the index is rebuilt or dropped meanwhile.
+
+        :param SQLStorageAdapter storage: Chatterbot storage
+        :return: Tuple of (postings, grams, statement_ids)
+        :rtype: tuple
+        """
+
+        with self.lock:
+            if self.postings is not None:
+                return self.postings, self.grams, self.statement_ids
+
+        self.build(storage)
+        return self.snapshot(storage)
+
+    def lookup(self, word, snapshot):
+        """
+        Retrieve the ids of all statements whose search text contains a word
+
+        :param str word: Query word
+        :param tuple snapshot: Index retrieved with snapshot()
+        :return: Set of statement ids
+        :rtype: set
+        """
+
+        postings, grams, statement_ids = snapshot
+
+        word = word.translate(ASCII_LOWER)
+        if word == '':
+            return set(statement_ids)
+
+        with self.lock:
+            if self.postings is postings and word in self.cache:
+                return self.cache[word]
+
+        # Indexed words containing the query word contain all its grams
+        candidates = None
+        for gram in word_grams(word, complete = False):
+            words = grams.get(gram, ())
+            if candidates is None or len(words) < len(candidates):
+                candidates = words
+
+        ids = set()
+        for indexed_word in candidates:
+            if word in indexed_word:
+                ids.update(postings[indexed_word])
+
+        with self.lock:
+            if self.postings is postings:
+                if len(self.cache) >= MAX_CACHED_WORDS:
+                    self.cache = {}
+                self.cache[word] = ids
+
+        return ids
+
+    def filter(self, storage, search_text):
+        """
+        Retrieve the statements search_text_contains would find, in the same
+        order, excluding statements by the bot itself
+
+        :param SQLStorageAdapter storage: Chatterbot storage
+        :param str search_text: Indexed text of the input statement
+        :return: Generator of Statement objects
+        """
+
+        snapshot = self.snapshot(storage)
+
+        ids = set()
+        for word in search_text.split(' '):
+            ids.update(self.lookup(word, snapshot))
+        ids = sorted(ids)
+
+        statement_model = storage.get_model('statement')
+        session = storage.Session()
+
+        try:
+            for start in range(0, len(ids), ID_CHUNK_SIZE):
+                query = session.query(statement_model).filter(
+                        statement_model.id.in_(ids[start:start + ID_CHUNK_SIZE]),
+                        not_(statement_model.persona.startswith('bot:'))) \
+                        .order_by(statement_model.id)
+
+                for statement in query:
+                    yield storage.model_to_object(statement)
+        finally:
+            session.close()
+
+def word_grams(word, complete = True):
+    """
+    Substrings of a word used to find indexed words containing a query word
+
+    :param str word: Word
+    :param bool complete: All substrings of up to GRAM_SIZE characters, as
+        indexed, or only the longest ones, which suffice for a lookup
+    :return: Set of substrings
+    :rtype: set
+    """
+
+    if not complete:
+        size = min(len(word), GRAM_SIZE)
+        return { word[start:start + size] for start in range(len(word) - size + 1) }
+
+    return { word[start:start + size]
+             for size in range(1, GRAM_SIZE + 1)
+             for start in range(len(word) - size + 1) }
+
+class IndexedCandidateSearch(IndexedTextSearch):
+    """
+    Chatterbot search algorithm that compares the input statement only with
+    the candidates found in a StatementIndex
+    """
+
+    name = 'indexed_candidate_search'
+
+    def __init__(self, chatbot, **kwargs):
+        super().__init__(chatbot, **kwargs)
+        self.index = StatementIndex()
+
+    def search(self, input_statement, **additional_parameters):
+        """
+        Search for close matches to the input. Confidence scores for
+        subsequent results will order of increasing value.
+        """
+
+        if additional_parameters:
+            # Further filters are not covered by the index
+            yield from super().search(input_statement, **additional_parameters)
+            return
+
+        input_search_text = input_statement.search_text
+        if not input_statement.search_text:
+            input_search_text = self.chatbot.storage.tagger.get_bigram_pair_string(
+                    input_statement.text)
+
+        closest_match = Statement(text='')
+        closest_match.confidence = 0
+
+        # Find the closest matching known statement
+        for statement in self.index.filter(self.chatbot.storage, input_search_text):
+            confidence = self.compare_statements(input_statement, statement)
+
+            if confidence > closest_match.confidence:
+                statement.confidence = confidence
+                closest_match = statement
+
+                yield closest_match
+
+class IndexedBestMatch(BestMatch):
+    """
+    Chatterbot BestMatch logic adapter that only scores the candidates
+    found in an inverted index of the statement store. Responses are the same
+    as the ones of BestMatch.
+    """
+
+    def __init__(self, chatbot, **kwargs):
+        super().__init__(chatbot, **kwargs)
+
+        self.search_algorithm = IndexedCandidateSearch(chatbot, **kwargs)
+        self.create_response_index()
+
+    def create_response_index(self):
+        """
+        Add an SQL index for the lookup of responses to the closest match
+        """
+
+        storage = self.chatbot.storage
+        if not hasattr(storage, 'engine'):
+            return
+
+        try:
+            with storage.engine.begin() as connection:
+                connection.execute('CREATE INDEX IF NOT EXISTS '
+                        'ix_statement_search_in_response_to '
+                        'ON statement (search_in_response_to)')
+        except SQLAlchemyError as error:
+            # Read-only databases keep working without the index, but
+            # responses are looked up with full table scans
+            self.chatbot.logger.warning('Could not create response index: {}'.format(error))
+
+    def rebuild_index(self):
+        """
+        Rebuild the candidate index, e.g. after training
+        """
+
+        self.search_algorithm.index.build(self.chatbot.storage)
@@ -0,0 +1,399 @@
+"""
+(C) 2021 Julian von Mendel <prog@derjulian.net>
+
+instrumentation.py
+====================================
+Timing of the stages of a chatbot turn: NLP, logic adapters, storage and
+filters record spans, which are passed on to pluggable sinks for logging,
+Prometheus metrics or tests. Without a sink, instrumentation is disabled and
+a span costs a single attribute lookup.
+"""
+
+import time
+import bisect
+import logging
+import threading
+import functools
+import contextvars
+import collections
+
+# Upper bounds in seconds of the histogram buckets
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1.0, 2.5, 5.0)
+
+# Innermost open span of the current thread or task
+_current_span = contextvars.ContextVar('botstory_span', default = None)
+
+class Span:
+    """
+    Timing of one stage
+
+    :param str stage: Stage name, e.g. 'nlp' or 'adapter.process'
+    :param dict labels: Additional labels, e.g. { 'adapter': 'BestMatch' }
+    :param Span parent: Enclosing span or None
+    """
+
+    __slots__ = ('stage', 'labels', 'parent', 'start', 'duration', 'error')
+
+    def __init__(self, stage, labels, parent):
+        self.stage = stage
+        self.labels = labels
+        self.parent = parent
+        self.start = time.perf_counter()
+        self.duration = None
+        self.error = False
+
+    @property
+    def depth(self):
+        """
+        Number of enclosing spans
+        """
+
+        depth = 0
+        parent = self.parent
+        while parent is not None:
+            depth += 1
+            parent = parent.parent
+        return depth
+
+class _NullSpan:
+    """
+    Context manager doing nothing, used while instrumentation is disabled
+    """
+
+    def __enter__(self):
+        return None
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+_NULL_SPAN = _NullSpan()
+
+class _SpanContext:
+    """
+    Context manager recording a span
+    """
+
+    __slots__ = ('instrumentation', 'span', 'token')
+
+    def __init__(self, instrumentation, stage, labels):
+        self.instrumentation = instrumentation
+        self.span = Span(stage, labels, _current_span.get())
+        self.token = None
+
+    def __enter__(self):
+        self.token = _current_span.set(self.span)
+        self.span.start = time.perf_counter()
+        return self.span
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.span.duration = time.perf_counter() - self.span.start
+        self.span.error = exc_type is not None and exc_type is not GeneratorExit
+        _current_span.reset(self.token)
+        self.instrumentation.record(self.span)
+        return False
+
+class Instrumentation:
+    """
+    Registry of sinks that receive finished spans
+    """
+
+    def __init__(self):
+        self.sinks = []
+        self.enabled = False
+
+    def add_sink(self, sink):
+        """
+        Send spans to a sink, enabling instrumentation
+
+        :param sink: Object with a record(span) method
+        :return: The sink
+        """
+
+        self.sinks = self.sinks + [ sink ]
+        self.enabled = True
+        return sink
+
+    def remove_sink(self, sink):
+        """
+        Stop sending spans to a sink, disabling instrumentation if it was the
+        last one
+        """
+
+        self.sinks = [ other for other in self.sinks if other is not sink ]
+        self.enabled = bool(self.sinks)
+
+    def span(self, stage, **labels):
+        """
+        Context manager timing a stage
+
+        :param str stage: Stage name
+        :param labels: Additional labels
+        """
+
+        if not self.enabled:
+            return _NULL_SPAN
+        return _SpanContext(self, stage, labels)
+
+    def record(self, span):
+        """
+        Pass a finished span on to all sinks
+        """
+
+        for sink in self.sinks:
+            sink.record(span)
+
+# Process-wide instrumentation used by all chatbots
+instrumentation = Instrumentation()
+
+def span(stage, **labels):
+    """
+    Context manager timing a stage with the process-wide instrumentation
+
+    :param str stage: Stage name
+    :param labels: Additional labels
+    """
+
+    return instrumentation.span(stage, **labels)
+
+def add_sink(sink):
+    """
+    Send spans of the process-wide instrumentation to a sink
+    """
+
+    return instrumentation.add_sink(sink)
+
+def remove_sink(sink):
+    """
+    Stop sending spans of the process-wide instrumentation to a sink
+    """
+
+    instrumentation.remove_sink(sink)
+
+def timed(stage, func, **labels):
+    """
+    Instrumented version of a function
+
+    :param str stage: Stage name
+    :param callable func: Function to time
+    :param labels: Additional labels
+    """
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not instrumentation.enabled:
+            return func(*args, **kwargs)
+        with _SpanContext(instrumentation, stage, labels):
+            return func(*args, **kwargs)
+    return wrapper
+
+def timed_iter(stage, func, **labels):
+    """
+    Instrumented version of a function returning an iterator: Each span
+    covers the call and the consumption of the iterator. The span does not
+    become the parent of spans started by the consumer in between.
+
+    :param str stage: Stage name
+    :param callable func: Function to time
+    :param labels: Additional labels
+    """
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not instrumentation.enabled:
+            return func(*args, **kwargs)
+
+        def iterate():
+            iter_span = Span(stage, labels, _current_span.get())
+            try:
+                yield from func(*args, **kwargs)
+            except Exception:
+                iter_span.error = True
+                raise
+            finally:
+                iter_span.duration = time.perf_counter() - iter_span.start
+                instrumentation.record(iter_span)
+        return iterate()
+    return wrapper
+
+def instrument_chatbot(chatbot):
+    """
+    Time the logic adapters, storage access and response filters of a
+    ChatterBot instance
+
+    :param ChatterBot chatbot: ChatterBot instance
+    """
+
+    # Filters are module functions, looked up by ChatterBot on every call
+    import chatterbot.filters # pylint: disable=import-outside-toplevel
+    filter_function = chatterbot.filters.get_recent_repeated_responses
+    if not hasattr(filter_function, '__wrapped__'):
+        chatterbot.filters.get_recent_repeated_responses = timed('filter',
+                filter_function, filter = filter_function.__name__)
+
+    for adapter in chatbot.logic_adapters:
+        name = type(adapter).__name__
+        adapter.can_process = timed('adapter.can_process', adapter.can_process,
+                                    adapter = name)
+        adapter.process = timed('adapter.process', adapter.process, adapter = name)
+
+    storage = chatbot.storage
+    storage.filter = timed_iter('storage.filter', storage.filter)
+    for method in ('count', 'get_random', 'create', 'update'):
+        if hasattr(storage, method):
+            setattr(storage, method, timed('storage.' + method, getattr(storage, method)))
+
+class LoggingSink:
+    """
+    Sink writing every span to a logger
+
+    :param logging.Logger logger: Logger, defaults to the botstory.instrumentation logger
+    :param int level: Log level
+    """
+
+    def __init__(self, logger = None, level = logging.INFO):
+        self.logger = logger if logger is not None else logging.getLogger(__name__)
+        self.level = level
+
+    def record(self, span):
+        """
+        Log a finished span
+        """
+
+        if self.logger.isEnabledFor(self.level):
+            self.logger.log(self.level, { 'stage': span.stage, 'labels': span.labels,
+                    'depth': span.depth, 'seconds': span.duration, 'error': span.error })
+
+class MemorySink:
+    """
+    Sink aggregating spans into counters and histograms per stage and label
+    set, and keeping the most recent spans e.g. for tests
+
+    :param tuple buckets: Upper bounds in seconds of the histogram buckets
+    :param int keep: Number of recent spans to keep
+    """
+
+    def __init__(self, buckets = DEFAULT_BUCKETS, keep = 1000):
+        self.buckets = tuple(sorted(buckets))
+        self.spans = collections.deque(maxlen = keep)
+        self.metrics = {} # (stage, labels) -> [ bucket counts, sum, count, errors ]
+        self.lock = threading.Lock()
+
+    def record(self, span):
+        """
+        Aggregate a finished span
+        """
+
+        key = (span.stage, tuple(sorted(span.labels.items())))
+        bucket = bisect.bisect_left(self.buckets, span.duration)
+
+        with self.lock:
+            self.spans.append(span)
+            metric = self.metrics.get(key)
+            if metric is None:
+                metric = self.metrics[key] = [ [ 0 ] * (len(self.buckets) + 1), 0.0, 0, 0 ]
+            metric[0][bucket] += 1
+            metric[1] += span.duration
+            metric[2] += 1
+            metric[3] += span.error
+
+    def count(self, stage, **labels):
+        """
+        Number of recorded spans of a stage
+
+        :param str stage: Stage name
+        :param labels: Only count spans with these labels
+        :rtype: int
+        """
+
+        with self.lock:
+            return sum(metric[2] for (metric_stage, metric_labels), metric
+                       in self.metrics.items()
+                       if metric_stage == stage and
+                       set(labels.items()) <= set(metric_labels))
+
+    def seconds(self, stage):
+        """
+        Total time of all recorded spans of a stage
+
+        :param str stage: Stage name
+        :rtype: float
+        """
+
+        with self.lock:
+            return sum(metric[1] for (metric_stage, _), metric
+                       in self.metrics.items() if metric_stage == stage)
+
+    def reset(self):
+        """
+        Forget all recorded spans
+        """
+
+        with self.lock:
+            self.spans.clear()
+            self.metrics = {}
+
+class PrometheusSink(MemorySink):
+    """
+    Sink aggregating spans into histograms in the Prometheus text exposition
+    format, see render()
+    """
+
+    CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+    def render(self):
+        """
+        Current metrics in the Prometheus text exposition format
+
+        :rtype: str
+        """
+
+        def label_string(labels, extra = ()):
+            return ','.join('{}="{}"'.format(name, str(value).replace('\\', '\\\\')
+                            .replace('"', '\\"').replace('\n', '\\n'))
+                            for name, value in labels + tuple(extra))
+
+        with self.lock:
+            metrics = sorted((key, (list(metric[0]),) + tuple(metric[1:]))
+                             for key, metric in self.metrics.items())
+
+        lines = [ '# HELP botstory_stage_seconds Time spent per stage of a chatbot turn',
+                  '# TYPE botstory_stage_seconds histogram' ]
+        for (stage, labels), (buckets, total, count, _) in metrics:
+            labels = (('stage', stage),) + labels
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), buckets):
+                cumulative += bucket_count
+                lines.append('botstory_stage_seconds_bucket{{{}}} {}'.format(
+                        label_string(labels, [ ('le', '+Inf' if bound == float('inf')
+                                                else repr(bound)) ]), cumulative))
+            lines.append('botstory_stage_seconds_sum{{{}}} {}'.format(label_string(labels), total))
+            lines.append('botstory_stage_seconds_count{{{}}} {}'.format(label_string(labels), count))
+
+        lines += [ '# HELP botstory_stage_errors_total Stages ended by an exception',
+                   '# TYPE botstory_stage_errors_total counter' ]
+        for (stage, labels), (_, _, _, errors) in metrics:
+            lines.append('botstory_stage_errors_total{{{}}} {}'.format(
+                    label_string((('stage', stage),) + labels), errors))
+
+        return '\n'.join(lines) + '\n'
+
+def create_sink(name):
+    """
+    Create a sink by name, e.g. from the BOTSTORY_METRICS environment variable
+
+    :param str name: 'log', 'prometheus' or 'memory'
+    :return: Sink or None for an empty name
+    :raises ValueError: Unknown sink name
+    """
+
+    if not name:
+        return None
+    if name == 'log':
+        return LoggingSink()
+    if name == 'prometheus':
+        return PrometheusSink()
+    if name == 'memory':
+        return MemorySink()
+
+    raise ValueError('Unknown metrics sink: {}'.format(name))
@@ -9,10 +9,101 @@ NLP functions
 import re
 import string
 import datetime
-import nltk
-import dateutil.parser
-from nltk.corpus import stopwords
-from nltk import word_tokenize
+import threading
+import itertools
+import collections.abc
+import concurrent.futures
+from botstory.instrumentation import span
+
+TAGGER_RESOURCE = 'taggers/maxent_treebank_pos_tagger/english.pickle'
+
+# Precompiled helpers for cleaned_episode()
+PUNCTUATION = frozenset(string.punctuation)
+PUNCTUATION_TABLE = str.maketrans('', '', string.punctuation)
+STAGE_NOTES_REGEX = re.compile(r"[\(\[].*?[\)\]]")
+
+# Spelled-out numbers for find_numbers()
+NUMBER_UNITS = { word: value for value, word in enumerate([ "zero", "one",
+    "two", "three", "four", "five", "six", "seven", "eight", "nine", "ten",
+    "eleven", "twelve", "thirteen", "fourteen", "fifteen", "sixteen",
+    "seventeen", "eighteen", "nineteen" ]) }
+NUMBER_TENS = { "twenty": 20, "thirty": 30, "forty": 40, "fifty": 50,
+    "sixty": 60, "seventy": 70, "eighty": 80, "ninety": 90 }
+NUMBER_COMPOUNDS = { tens + unit: NUMBER_TENS[tens] + NUMBER_UNITS[unit]
+    for tens in NUMBER_TENS for unit in list(NUMBER_UNITS)[1:10] } # "twenty-one"
+NUMBER_SCALES = { "hundred": 100, "thousand": 1000 }
+
+# Date patterns for extract_date()
+MONTHS = { "january": 1, "february": 2, "march": 3, "april": 4, "may": 5,
+    "june": 6, "july": 7, "august": 8, "september": 9, "october": 10,
+    "november": 11, "december": 12, "jan": 1, "feb": 2, "mar": 3, "apr": 4,
+    "jun": 6, "jul": 7, "aug": 8, "sep": 9, "sept": 9, "oct": 10, "nov": 11,
+    "dec": 12 }
+WEEKDAYS = { "monday": 0, "tuesday": 1, "wednesday": 2, "thursday": 3,
+    "friday": 4, "saturday": 5, "sunday": 6 }
+RELATIVE_DAYS = { "today": 0, "tonight": 0, "tomorrow": 1,
+    "day after tomorrow": 2 }
+MONTH_PATTERN = "|".join(sorted(MONTHS, key = len, reverse = True))
+ISO_DATE_REGEX = re.compile(r"\b(\d{4})-(\d{1,2})-(\d{1,2})\b")
+NUMERIC_DATE_REGEX = re.compile(r"\b(\d{1,2})([/.])(\d{1,2})\2(\d{4}|\d{2})\b")
+MONTH_DAY_REGEX = re.compile(r"\b(?P<month>" + MONTH_PATTERN + r")\.?\s+"
+        r"(?P<day>\d{1,2})(?:st|nd|rd|th)?\b(?:,?\s+(?P<year>\d{4})\b)?",
+        re.IGNORECASE)
+DAY_MONTH_REGEX = re.compile(r"\b(?P<day>\d{1,2})(?:st|nd|rd|th)?\s+(?:of\s+)?"
+        r"(?P<month>" + MONTH_PATTERN + r")\b\.?(?:,?\s+(?P<year>\d{4})\b)?",
+        re.IGNORECASE)
+RELATIVE_DATE_REGEX = re.compile(r"\b(?:(?P<next>next)\s+)?(?P<word>day after tomorrow|"
+        + "|".join(list(RELATIVE_DAYS)[:3] + list(WEEKDAYS)) + r")\b", re.IGNORECASE)
+# Remaining forms dateutil is asked for, "may" is too ambiguous on its own
+DATE_HINT_REGEX = re.compile(r"\b(?:" + "|".join(month for month in MONTHS if month != "may")
+        + r")\b|\d+[/.-]\d+", re.IGNORECASE)
+
+# Process-wide NLP resources, see nlp_resources()
+_resources = {}
+_resources_lock = threading.Lock()
+
+def nlp_resources():
+    """
+    Retrieve the process-wide NLP resources, which are loaded once on first
+    use. NLTK and dateutil are only imported then, to keep the import of
+    botstory modules fast. Call warm_up() at startup to avoid the loading
+    delay on the first user message.
+
+    :return: Dict of format { 'tagger': treebank_tagger,
+        'stopwords': frozenset_of_english_stop_words,
+        'tokenize': word_tokenize_function, 'parse_date': dateutil_parse }
+    :rtype: dict
+    """
+
+    if not _resources:
+        with _resources_lock:
+            if not _resources:
+                # pylint: disable=import-outside-toplevel
+                import nltk
+                import dateutil.parser
+                from nltk.corpus import stopwords
+
+                resources = {
+                    # treebankTagger works better than standard
+                    #    nltk.pos_words() function
+                    'tagger': nltk.data.load(TAGGER_RESOURCE),
+                    'stopwords': frozenset(stopwords.words('english')),
+                    'tokenize': nltk.word_tokenize,
+                    'parse_date': dateutil.parser.parse,
+                }
+                _resources.update(resources)
+
+    return _resources
+
+def warm_up():
+    """
+    Load all NLP resources, so that further NLP calls are pure computation
+    """
+
+    resources = nlp_resources()
+
+    # Tokenizer models are loaded lazily by NLTK itself
+    resources['tokenize']("Warm up")
 
 def cleaned_episode(raw_text, custom_stop_words = False):
     """
@@ -27,37 +118,34 @@ def cleaned_episode(raw_text, custom_stop_words = False):
     """
 
     # Add only English language stopwords and punctuation list together
-    stop_words_list = list(string.punctuation)
+    stop_words = PUNCTUATION
     if custom_stop_words is not None:
-        stop_words_list += stopwords.words('english')
+        stop_words = stop_words | nlp_resources()['stopwords']
 
     # If a list of additional custom stopwords are passed add them to the default
     # NLTK stopwords and punctuation list
     if custom_stop_words:
-        stop_words_list += custom_stop_words
+        stop_words = stop_words | frozenset(custom_stop_words)
 
     # Removes all punctuation
-    for char in string.punctuation:
-        raw_text = raw_text.replace(char, "")
+    raw_text = raw_text.translate(PUNCTUATION_TABLE)
 
     # Removes all text between and including brackets and parenthesis with RegEx
-    raw_text_no_stage_notes = re.sub("[\(\[].*?[\)\]]", "", raw_text)
+    raw_text_no_stage_notes = STAGE_NOTES_REGEX.sub("", raw_text)
 
     # Remove all text with colons (:), i.e. character line indications
-    raw_text_no_stage_notes_or_names = raw_text_no_stage_notes.split(" ")
-
-    for i in raw_text_no_stage_notes_or_names:
-        if i.endswith(':') or i == '' or i == ' ':
-            raw_text_no_stage_notes_or_names.remove(i)
+    raw_text_no_stage_notes_or_names = [i for i in
+            raw_text_no_stage_notes.split(" ")
+            if not (i.endswith(':') or i == '' or i == ' ')]
 
     # Rejoin all of the text as one string for tokenization
     raw_text_rejoined = " ".join(raw_text_no_stage_notes_or_names)
 
     # Tokenize the raw text
-    token_list = word_tokenize(raw_text_rejoined)
+    token_list = nlp_resources()['tokenize'](raw_text_rejoined)
 
     # Remove stop words and punctuation
-    cleaned_and_tokenized_list = [w for w in token_list if w not in stop_words_list]
+    cleaned_and_tokenized_list = [w for w in token_list if w not in stop_words]
 
     return cleaned_and_tokenized_list
 
@@ -81,34 +169,203 @@ def nlp_prefilter(query):
 
     return query
 
+def message_words(text):
+    """
+    Cheap split of a message into a set of lowercase words, without
+    tokenizer, e.g. to check for trigger words before running NLP
+
+    :param str text: Input text
+    :rtype: frozenset
+    """
+
+    return frozenset(text.translate(PUNCTUATION_TABLE).lower().split())
+
+def _date_or_none(year, month, day):
+    """
+    Internal helper to create a date at midnight, or None if it is invalid
+    """
+
+    try:
+        return datetime.datetime(year, month, day)
+    except ValueError:
+        return None
+
+def _full_year(year, today):
+    """
+    Internal helper to expand two digit years like dateutil: To the century
+    within 50 years of today
+    """
+
+    if year >= 100:
+        return year
+
+    year += today.year // 100 * 100
+    if year > today.year + 50:
+        year -= 100
+    elif year < today.year - 50:
+        year += 100
+    return year
+
+def extract_date(text, today = None):
+    """
+    Find a date in a sentence. Common date forms and relative words are
+    matched with precompiled patterns; dateutil's fuzzy parser is only asked
+    if the sentence contains further date hints such as month names. Numbers
+    on their own, e.g. "2 nights", are not taken as date.
+
+    :param str text: Input text
+    :param datetime.date today: Reference date for relative words and missing
+        years, defaults to the current date
+    :return: Date as datetime at midnight, or None
+    :rtype: datetime.datetime
+    """
+
+    if today is None:
+        today = datetime.date.today()
+    today = datetime.datetime(today.year, today.month, today.day)
+
+    for match in ISO_DATE_REGEX.finditer(text):
+        date = _date_or_none(int(match.group(1)), int(match.group(2)),
+                             int(match.group(3)))
+        if date is not None:
+            return date
+
+    for match in NUMERIC_DATE_REGEX.finditer(text):
+        first, second = int(match.group(1)), int(match.group(3))
+        year = _full_year(int(match.group(4)), today)
+
+        # Month first like dateutil, unless that is impossible
+        date = _date_or_none(year, first, second) or _date_or_none(year, second, first)
+        if date is not None:
+            return date
+
+    for regex in (MONTH_DAY_REGEX, DAY_MONTH_REGEX):
+        for match in regex.finditer(text):
+            year = today.year if match.group('year') is None else int(match.group('year'))
+            date = _date_or_none(year, MONTHS[match.group('month').lower()],
+                                 int(match.group('day')))
+            if date is not None:
+                return date
+
+    match = RELATIVE_DATE_REGEX.search(text)
+    if match is not None:
+        word = match.group('word').lower()
+        if word in RELATIVE_DAYS:
+            return today + datetime.timedelta(days = RELATIVE_DAYS[word])
+
+        # Weekdays: The next one, including today unless "next" is used
+        days = (WEEKDAYS[word] - today.weekday()) % 7
+        if days == 0 and match.group('next'):
+            days = 7
+        return today + datetime.timedelta(days = days)
+
+    if DATE_HINT_REGEX.search(text) is None:
+        return None
+
+    try:
+        date = nlp_resources()['parse_date'](text, fuzzy = True, default = today)
+    except (ValueError, OverflowError):
+        return None
+
+    return datetime.datetime(date.year, date.month, date.day)
+
+def _number_word(token):
+    """
+    Internal helper to look up a spelled-out number word
+
+    :return: (kind, value) with kind 'unit', 'tens', 'hundred' or 'thousand',
+        or None if the token is no number word
+    :rtype: tuple
+    """
+
+    word = token.lower()
+    if word in NUMBER_UNITS:
+        return 'unit', NUMBER_UNITS[word]
+    if word in NUMBER_COMPOUNDS:
+        return 'unit', NUMBER_COMPOUNDS[word]
+    if word in NUMBER_TENS:
+        return 'tens', NUMBER_TENS[word]
+    if word == 'hundred':
+        return 'hundred', 100
+    if word == 'thousand':
+        return 'thousand', 1000
+    return None
+
+def _spelled_number(tokens, start):
+    """
+    Internal helper to read a spelled-out number starting at a token, e.g.
+    "twenty one" or "two hundred and five"
+
+    :return: (value, end) with end the index after the number, or None if no
+        number starts at the token
+    :rtype: tuple
+    """
+
+    total = 0 # Thousands
+    current = 0 # Below a thousand
+    last = None # Kind of the previous number word
+    end = start
+
+    for i in range(start, len(tokens)):
+        word = _number_word(tokens[i])
+        if word is None and tokens[i].lower() == 'and' and \
+                last in ('hundred', 'thousand') and i + 1 < len(tokens):
+            # "and" only joins a scale word and a following number
+            following = _number_word(tokens[i + 1])
+            if following is not None and following[0] in ('unit', 'tens'):
+                continue
+        if word is None:
+            break
+
+        kind, value = word
+        if kind == 'unit' and (last in (None, 'hundred', 'thousand') or
+                               (last == 'tens' and value < 10)):
+            current += value
+        elif kind == 'tens' and last in (None, 'hundred', 'thousand'):
+            current += value
+        elif kind == 'hundred' and last in ('unit', 'tens') and current < 100:
+            current *= value
+        elif kind == 'thousand' and last in ('unit', 'tens', 'hundred') and total == 0:
+            total, current = current * value, 0
+        else:
+            break
+
+        last = kind
+        end = i + 1
+
+    if end == start:
+        return None
+    return total + current, end
+
 def find_numbers(tokens):
     """
-    Find numbers and numeric words in token list
+    Find numbers and numeric words in token list. Spelled-out numbers, also
+    of several words such as "twenty one", are replaced by a single token
+    with the numeric value.
 
     :param list tokens: List of tokens
     :return: (tokens, numbers)
     :rtype: tuple
     """
 
-    num_words = ["zero","one","two","three","four","five","six","seven",
-        "eight","nine","ten","eleven","twelve","thirteen","fourteen",
-        "fifteen","sixteen","seventeen","eighteen","nineteen","twenty"]
+    result = []
     numbers = list()
-    # TODO: be smart and only consider numbers that are NOT part of a date
-    # Problem: The date parser likes to mark numeric values that are NO
-    #    dates as dates
+    i = 0
 
-    for i, token in enumerate(tokens): #enmerate(tokens_without_date):
-        # Replace numeric words in sentence with the actual numeric value
-        if token.lower() in num_words:
-            number = num_words.index(token.lower())
-            tokens[i] = str(number)
+    while i < len(tokens):
+        spelled = _spelled_number(tokens, i)
+        if spelled is None:
+            result.append(tokens[i])
+            i += 1
+        else:
+            result.append(str(spelled[0]))
+            i = spelled[1]
 
-    for token in tokens: #tokens_without_date:
+    for token in result:
         if token.isnumeric():
             numbers.append(int(token))
 
-    return tokens, numbers
+    return result, numbers
 
 def find_nouns(tagged_words, skip_words_in_nlp = 0):
     """
@@ -152,39 +409,201 @@ def find_nouns(tagged_words, skip_words_in_nlp = 0):
 
     return nouns
 
+class WordClassMatcher:
+    """
+    Compiled word class matcher.
+
+    Word lists are compiled into an inverted index of word -> word classes, so
+    matching a token list costs one lookup per token regardless of the number
+    of word classes. Entries containing spaces are matched as phrases against
+    consecutive tokens. As before, tokens are lowercased for matching while
+    word list entries are used as given.
+
+    :param dict word_classes: Dictionary of word lists to find and tag with the
+        respective dictionary key
+    :param WordClassMatcher parent: Matcher to extend, see overlay()
+    """
+
+    def __init__(self, word_classes = None, parent = None):
+        self.parent = parent
+        self.word_classes = {} # Word class -> tuple of words, in definition order
+        self.index = {} # Word -> set of word classes
+        self.phrases = {} # First phrase word -> list of (phrase, word class)
+        self.positions = {} # Word class -> position in order of definition
+        self._key = None
+
+        if word_classes:
+            self.update(word_classes)
+
+    def add(self, word_class, words):
+        """
+        Add a word class, replacing a previous definition of the same name
+
+        :param str word_class: Word class name
+        :param list words: Words or phrases of the word class
+        """
+
+        self._unindex(word_class)
+        self.word_classes[word_class] = tuple(words)
+        self.positions.setdefault(word_class, len(self.positions))
+        self._key = None
+
+        for word in self.word_classes[word_class]:
+            phrase = tuple(word.split())
+            if len(phrase) > 1:
+                self.phrases.setdefault(phrase[0], []).append(
+                        (phrase, word_class))
+            else:
+                self.index.setdefault(word, set()).add(word_class)
+
+    def remove(self, word_class):
+        """
+        Remove a word class
+
+        :param str word_class: Word class name
+        """
+
+        self._unindex(word_class)
+        self.word_classes.pop(word_class, None)
+        self.positions.pop(word_class, None)
+        self._key = None
+
+    def _unindex(self, word_class):
+        """
+        Internal helper to drop the words of a word class from the index
+        """
+
+        for word in self.word_classes.get(word_class, ()):
+            phrase = tuple(word.split())
+            if len(phrase) > 1:
+                self.phrases[phrase[0]].remove((phrase, word_class))
+                if not self.phrases[phrase[0]]:
+                    del self.phrases[phrase[0]]
+            elif word in self.index:
+                self.index[word].discard(word_class)
+                if not self.index[word]:
+                    del self.index[word]
+
+    def update(self, word_classes):
+        """
+        Add multiple word classes
+
+        :param dict word_classes: Dictionary of word lists
+        """
+
+        for word_class in word_classes:
+            self.add(word_class, word_classes[word_class])
+
+    def overlay(self, word_classes):
+        """
+        Cheaply extend this matcher with additional word classes, without
+        modifying it. Word classes of the same name replace the ones of this
+        matcher, like merging the word class dicts would.
+
+        :param dict word_classes: Dictionary of word lists
+        :return: New matcher
+        :rtype: WordClassMatcher
+        """
+
+        return WordClassMatcher(word_classes, parent = self)
+
+    @property
+    def key(self):
+        """
+        Hashable representation of all word classes, e.g. for caching
+        """
+
+        if self._key is None:
+            own_key = tuple(self.word_classes.items())
+            if self.parent is None:
+                self._key = own_key
+            else:
+                self._key = (self.parent.key, own_key)
+
+        return self._key
+
+    def ordered(self, word_classes):
+        """
+        Sort word classes in the order they were first defined in this matcher,
+        dropping word classes this matcher does not define
+
+        :param set word_classes: Word class names, e.g. a match() result
+        :return: List of word class names
+        :rtype: list
+        """
+
+        return sorted([word_class for word_class in word_classes
+                       if word_class in self.positions],
+                      key = self.positions.get)
+
+    def match(self, tokens):
+        """
+        Match word classes to the token list
+
+        :param list tokens: List of tokens
+        :return: Matched word classes
+        :rtype: set
+        """
+
+        words = [token.lower() for token in tokens]
+        classes = set()
+
+        for i, word in enumerate(words):
+            if word in self.index:
+                classes.update(self.index[word])
+
+            for phrase, word_class in self.phrases.get(word, ()):
+                if tuple(words[i:i + len(phrase)]) == phrase:
+                    classes.add(word_class)
+
+        if self.parent is not None:
+            # Parent word classes may be replaced by our own definition
+            classes.update(self.parent.match(tokens).difference(
+                    self.word_classes))
+
+        return classes
+
 def identify_word_classes(tokens, word_classes):
     """
     Match word classes to the token list
 
     :param list tokens: List of tokens
     :param dict word_classes: Dictionary of word lists to find and tag with the
-        respective dictionary key
+        respective dictionary key, or a compiled WordClassMatcher
     :return: Matched word classes
-    :rtype: list
+    :rtype: set
     """
 
     if word_classes is None:
-        word_classes = []
+        return set()
 
-    classes = set()
-    for key in word_classes:
-        for token in tokens:
-            if token.lower() in word_classes[key]:
-                classes.add(key)
-    return classes
+    if not isinstance(word_classes, WordClassMatcher):
+        word_classes = WordClassMatcher(word_classes)
 
-def nlp_analyze(query, word_classes = None, skip_words_in_nlp = 0):
+    return word_classes.match(tokens)
+
+def _word_classes_key(word_classes):
     """
-    Run a number of NLP tasks on a given sentence
+    Internal helper to build a hashable cache key for a word class dict or
+    WordClassMatcher
+    """
+
+    if isinstance(word_classes, WordClassMatcher):
+        return word_classes.key
+
+    if not word_classes:
+        return None
+
+    return tuple((key, tuple(word_classes[key])) for key in word_classes)
+
+def _nlp_tokens(query):
+    """
+    Internal helper running the first NLP stages on a sentence:
+    Tokenization and number search
 
     :param str query: Input text
-    :param dict word_classes: Dictionary of word lists to find and tag with the
-        respective dictionary key
-    :param int skip_words_in_nlp: Parameter for find_nouns()
     :return: Dict of format { 'query': cleaned_query, 'tokens': tokens,
-        'tags': tagged_words,
-        'word_classes': classes, 'numbers': numbers, 'date': date,
-        'nouns': nouns, 'lastnoun': lastnoun }
+        'numbers': numbers }
     :rtype: dict
     """
 
@@ -193,45 +612,246 @@ def nlp_analyze(query, word_classes = None, skip_words_in_nlp = 0):
     #      tokens = nltk.word_tokenize(query)
     #      print(tokens)
 
-    # Find date in sentence
-    date = None
-    tokens_without_date = tokens
-
-    try:
-        # TODO: improve this bad if clause and the entire date identification part
-        # Problem: It often misclassifies numbers as dates, e.g. "2 nights"
-        #   is interpreted as date.
-        if len(tokens) > 1 or (len(tokens) == 1 and not query.isnumeric()):
-            date, tokens_without_date = dateutil.parser.parse(query,
-                                                    fuzzy_with_tokens=True)
-    except:
-        pass
-
     # Find numbers
     tokens, numbers = find_numbers(tokens)
 
     # Rebuild string
     cleaned_query = " ".join(tokens)
 
-    # Tag words (treebankTagger works better than standard nltk.pos_words()
-    #    function)
-    treebank_tagger = nltk.data.load(
-        'taggers/maxent_treebank_pos_tagger/english.pickle')
-    tagged_words = treebank_tagger.tag(tokens)
+    return { 'query': cleaned_query, 'tokens': tokens, 'numbers': numbers }
+
+class NLPBase:
+    """
+    NLP stages of a sentence which do not depend on word classes or
+    skip_words_in_nlp: Tokenization and number search, date parsing and POS
+    tagging. Each stage runs on first access of one of its fields.
+
+    :param str text: Input text
+    """
+
+    # Field -> stage computing it
+    STAGES = { 'query': 'tokens', 'tokens': 'tokens', 'numbers': 'tokens',
+               'date': 'date', 'tags': 'tags' }
+
+    __slots__ = ('text', 'fields')
+
+    def __init__(self, text):
+        self.text = text
+        self.fields = {}
+
+    def __getitem__(self, field):
+        if field not in self.fields:
+            stage = self.STAGES[field]
+            if stage == 'tokens':
+                self.fields.update(_nlp_tokens(self.text))
+            elif stage == 'date':
+                # Find date in sentence
+                with span('nlp.date'):
+                    self.fields['date'] = extract_date(self.text)
+            else:
+                # Tag words
+                tokens = self['tokens']
+                with span('nlp.tag'):
+                    self.fields['tags'] = nlp_resources()['tagger'].tag(tokens)
+
+        return self.fields[field]
+
+class NLPResult(collections.abc.Mapping):
+    """
+    Result of nlp_analyze(), computed on demand: Fields are only computed
+    when they are accessed, so e.g. a yes/no answer, which only needs the
+    word classes, does not run date parsing or POS tagging. Results are
+    shared between callers and must not be modified.
+
+    :param NLPBase base: NLP stages of the sentence
+    :param dict word_classes: Dictionary of word lists to find and tag with the
+        respective dictionary key, or a compiled WordClassMatcher
+    :param int skip_words_in_nlp: Parameter for find_nouns()
+    """
+
+    FIELDS = ('query', 'tokens', 'tags', 'word_classes', 'numbers', 'date',
+              'nouns', 'lastnoun')
+
+    def __init__(self, base, word_classes = None, skip_words_in_nlp = 0):
+        self.base = base
+        self.word_classes = word_classes
+        self.skip_words_in_nlp = skip_words_in_nlp
+        self.fields = {}
+
+    def _compute(self, field):
+        """
+        Compute a field and the stages it depends on
+        """
+
+        if field in NLPBase.STAGES:
+            self.fields[field] = self.base[field]
+        elif field == 'word_classes':
+            # Identify matching word classes
+            self.fields[field] = identify_word_classes(self.base['tokens'],
+                                                       self.word_classes)
+        else:
+            # Compile the final sequence of untagged or tagged as noun words
+            #    (uninterrupted)
+            nouns = find_nouns(self.base['tags'], self.skip_words_in_nlp)
+            self.fields['nouns'] = nouns
+            self.fields['lastnoun'] = nouns[-1] if nouns else None
+
+        return self.fields[field]
+
+    def __getitem__(self, field):
+        if field in self.fields:
+            return self.fields[field]
+        if field not in self.FIELDS:
+            raise KeyError(field)
+
+        with span('nlp', field = field):
+            return self._compute(field)
 
-    # Compile the final sequence of untagged or tagged as noun words
-    #    (uninterrupted)
-    nouns = find_nouns(tagged_words, skip_words_in_nlp)
+    def __iter__(self):
+        return iter(self.FIELDS)
 
-    if len(nouns) == 0:
-        lastnoun = None
-    else:
-        lastnoun = nouns[-1]
+    def __len__(self):
+        return len(self.FIELDS)
 
-    # Identify matching word classes
-    classes = identify_word_classes(tokens, word_classes)
+    def __repr__(self):
+        return '<NLPResult {!r} computed={}>'.format(self.base.text, sorted(self.fields))
 
-    # Return all our preliminary data
-    return { 'query': cleaned_query, 'tokens': tokens, 'tags': tagged_words,
+    def to_dict(self):
+        """
+        Compute all fields
+
+        :return: Dict in the format of nlp_analyze()
+        :rtype: dict
+        """
+
+        return { field: self.fields[field] if field in self.fields else self._compute(field)
+                 for field in self.FIELDS }
+
+def nlp_analyze(query, word_classes = None, skip_words_in_nlp = 0, lazy = False):
+    """
+    Run a number of NLP tasks on a given sentence
+
+    :param str query: Input text
+    :param dict word_classes: Dictionary of word lists to find and tag with the
+        respective dictionary key, or a compiled WordClassMatcher
+    :param int skip_words_in_nlp: Parameter for find_nouns()
+    :param bool lazy: Return an NLPResult which runs the NLP tasks on demand
+        instead of running all of them now
+    :return: Dict of format { 'query': cleaned_query, 'tokens': tokens,
+        'tags': tagged_words,
         'word_classes': classes, 'numbers': numbers, 'date': date,
         'nouns': nouns, 'lastnoun': lastnoun }
+    :rtype: dict
+    """
+
+    result = NLPResult(NLPBase(query), word_classes, skip_words_in_nlp)
+    if lazy:
+        return result
+
+    with span('nlp'):
+        return result.to_dict()
+
+def _nlp_analyze_batch(queries, word_classes = None, skip_words_in_nlp = 0):
+    """
+    Internal helper for nlp_analyze_many(), processing one batch of sentences
+    within the current process
+    """
+
+    bases = [NLPBase(query) for query in queries]
+
+    # Tag all sentences in a single tagger call
+    tagged_sents = nlp_resources()['tagger'].tag_sents(
+            [base['tokens'] for base in bases])
+
+    results = []
+    for base, tagged_words in zip(bases, tagged_sents):
+        base.fields['tags'] = tagged_words
+        results.append(NLPResult(base, word_classes, skip_words_in_nlp).to_dict())
+
+    return results
+
+def nlp_analyze_many(queries, word_classes = None, skip_words_in_nlp = 0, \
+                     processes = None, chunk_size = 500):
+    """
+    Run nlp_analyze() on a list of sentences in batch, e.g. for offline replay
+    of transcripts or preprocessing of training data
+
+    :param list queries: List of input texts
+    :param dict word_classes: Dictionary of word lists to find and tag with the
+        respective dictionary key
+    :param int skip_words_in_nlp: Parameter for find_nouns()
+    :param int processes: Number of worker processes to spread the batch on,
+        or None to process it in the current process
+    :param int chunk_size: Number of sentences per worker task; batches not
+        larger than this are always processed in the current process
+    :return: List of dicts in the format of nlp_analyze(), in query order
+    :rtype: list
+    """
+
+    queries = list(queries)
+
+    if processes is None or processes <= 1 or len(queries) <= chunk_size:
+        return _nlp_analyze_batch(queries, word_classes, skip_words_in_nlp)
+
+    chunks = [queries[i:i + chunk_size]
+              for i in range(0, len(queries), chunk_size)]
+    results = []
+
+    with concurrent.futures.ProcessPoolExecutor(processes,
+            initializer = warm_up) as executor:
+        for chunk_results in executor.map(_nlp_analyze_batch, chunks,
+                itertools.repeat(word_classes, len(chunks)),
+                itertools.repeat(skip_words_in_nlp, len(chunks))):
+            results.extend(chunk_results)
+
+    return results
+
+class NLPContext:
+    """
+    Per-message cache of nlp_analyze() results.
+
+    All logic adapters asked to answer the same user message share one
+    context, so tokenization, date parsing and POS tagging run at most once
+    per message. Results are computed on demand, see NLPResult: Stages no
+    adapter asks for do not run at all. The stages are cached per query
+    text, the results per query text, word class set and skip_words_in_nlp
+    value. Results are shared between callers and must not be modified.
+    """
+
+    def __init__(self):
+        self.base = {} # query -> NLPBase
+        self.results = {} # (query, word classes, skip) -> NLPResult
+        self.message_words = {} # query -> message_words() result
+
+    def words(self, query):
+        """
+        Cached equivalent of message_words()
+
+        :param str query: Input text
+        :rtype: frozenset
+        """
+
+        if query not in self.message_words:
+            self.message_words[query] = message_words(query)
+        return self.message_words[query]
+
+    def analyze(self, query, word_classes = None, skip_words_in_nlp = 0):
+        """
+        Cached, lazy equivalent of nlp_analyze()
+
+        :param str query: Input text
+        :param dict word_classes: Dictionary of word lists to find and tag with
+            the respective dictionary key
+        :param int skip_words_in_nlp: Parameter for find_nouns()
+        :return: Result in the format of nlp_analyze()
+        :rtype: NLPResult
+        """
+
+        key = (query, _word_classes_key(word_classes), skip_words_in_nlp)
+        if key not in self.results:
+            if query not in self.base:
+                self.base[query] = NLPBase(query)
+
+            self.results[key] = NLPResult(self.base[query], word_classes,
+                    skip_words_in_nlp)
+        return self.results[key]
@@ -0,0 +1,125 @@
+"""
+(C) 2021 Julian von Mendel <prog@derjulian.net>
+
+replay.py
+====================================
+Replay of transcripts of user prompts, used as regression test of the
+chatbot responses: Independent conversations of a transcript are replayed
+on a process pool, every worker sharing one pre-warmed chatbot engine, and
+the output can be compared with a previously recorded transcript.
+"""
+
+import difflib
+import concurrent.futures
+
+from botstory.nlp import warm_up
+
+CONVERSATION_SEPARATOR = "\n--- new conversation ---\n\n"
+
+# Chatbot factory of a replay worker process
+_factory = None
+
+def split_transcript(lines):
+    """
+    Split a transcript into independent conversations
+
+    :param list lines: Lines of user prompts, an empty line starts a new
+        conversation
+    :return: List of conversations, each a list of prompt lines
+    :rtype: list
+    """
+
+    conversations = [ [] ]
+    for line in lines:
+        if line.strip() == "":
+            conversations.append([])
+        else:
+            conversations[-1].append(line)
+
+    return conversations
+
+def replay_conversation(factory, prompts):
+    """
+    Replay one conversation with a new chatbot session
+
+    :param callable factory: Function returning a new chatbot session, e.g.
+        a BotClass subclass
+    :param list prompts: User prompts
+    :return: Output lines of the conversation
+    :rtype: list
+    """
+
+    chatbot = factory()
+    output = []
+
+    for prompt in prompts:
+        output.append("> {}".format(prompt.strip()))
+        output.append(str(chatbot.process_query(prompt)))
+
+    return output
+
+def _init_worker(factory):
+    """
+    Internal helper to prepare a replay worker process: NLP resources and
+    the shared chatbot engine are loaded once per worker
+    """
+
+    global _factory # pylint: disable=global-statement
+    _factory = factory
+
+    warm_up()
+    factory()
+
+def _replay_worker(prompts):
+    """
+    Internal helper to replay a conversation in a worker process
+    """
+
+    return replay_conversation(_factory, prompts)
+
+def replay(conversations, factory, processes = None):
+    """
+    Replay conversations, in parallel if there are several processes
+
+    :param list conversations: List of conversations, see split_transcript()
+    :param callable factory: Picklable function returning a new chatbot
+        session
+    :param int processes: Worker processes, None for one per CPU, 1 to replay
+        in this process
+    :return: Output lines of each conversation, in order of the input
+    :rtype: list
+    """
+
+    if processes == 1 or len(conversations) < 2:
+        warm_up()
+        return [ replay_conversation(factory, prompts) for prompts in conversations ]
+
+    with concurrent.futures.ProcessPoolExecutor(processes, initializer = _init_worker,
+                                                initargs = (factory,)) as executor:
+        return list(executor.map(_replay_worker, conversations))
+
+def format_transcript(outputs):
+    """
+    Format the output of replayed conversations like the recorded
+    transcripts
+
+    :param list outputs: Output lines of each conversation, see replay()
+    :rtype: str
+    """
+
+    return CONVERSATION_SEPARATOR.join(
+            "".join(line + "\n" for line in output) for output in outputs)
+
+def diff_transcript(transcript, expected):
+    """
+    Compare a replayed transcript with the recorded one
+
+    :param str transcript: Replayed transcript
+    :param str expected: Recorded transcript
+    :return: Lines of a unified diff, empty if the transcripts are equal
+    :rtype: list
+    """
+
+    return list(difflib.unified_diff(expected.splitlines(True),
+                                     transcript.splitlines(True),
+                                     'expected', 'replayed'))
@@ -0,0 +1,171 @@
+"""
+(C) 2021 Julian von Mendel <prog@derjulian.net>
+
+routing.py
+====================================
+Dispatch of user messages to the logic adapters of a ChatterBot instance:
+Instead of letting every adapter check and process every message, messages
+of an active story branch go to the story adapters, other messages to the
+adapters whose trigger words they contain, and only unclaimed messages to
+the remaining adapters such as BestMatch.
+"""
+
+from botstory.nlp import message_words
+from botstory.conversation import current_conversation
+
+ROUTE_CONFIDENCE = 1 # Confidence of a response that ends the dispatch
+
+class AdapterRouter:
+    """
+    Routing table of the logic adapters of a ChatterBot instance, replacing
+    ChatBot.generate_response(). Adapters are evaluated in stages:
+
+    1. If a story branch is active, adapters with story_adapter set
+    2. Adapters whose trigger_words occur in the message
+    3. Adapters without trigger words
+
+    Adapters with trigger words that do not occur in the message are not
+    evaluated at all. The dispatch ends after a stage that produced a
+    response of ROUTE_CONFIDENCE, no other adapter can return a better one.
+    The response is then selected from all evaluated adapters like
+    ChatterBot does.
+
+    :param ChatterBot chatbot: ChatterBot instance
+    """
+
+    def __init__(self, chatbot):
+        self.chatbot = chatbot
+        self.adapters = list(chatbot.logic_adapters)
+
+        # Adapter positions, to keep the configured order
+        self.story = [] # Adapters of active story branches
+        self.triggers = {} # Trigger word -> adapters
+        self.fallback = [] # Adapters without trigger words
+        for position, adapter in enumerate(self.adapters):
+            if getattr(adapter, 'story_adapter', False):
+                self.story.append(position)
+
+            trigger_words = getattr(adapter, 'trigger_words', None)
+            if trigger_words is None:
+                if position not in self.story:
+                    self.fallback.append(position)
+                continue
+
+            for word in trigger_words:
+                self.triggers.setdefault(word, []).append(position)
+
+    def install(self):
+        """
+        Let the ChatterBot instance dispatch messages with this routing table
+        """
+
+        self.chatbot.generate_response = self.generate_response
+
+    def stages(self, statement, conversation):
+        """
+        Adapters to evaluate for a message, per stage
+
+        :param Statement statement: User prompt
+        :param ConversationState conversation: State of the session in
+            processing, or None if the chatbot does not provide one
+        :return: Generator of lists of adapter positions
+        """
+
+        if conversation is None:
+            # Without conversation state, adapters decide themselves
+            yield list(range(len(self.adapters)))
+            return
+
+        if conversation.branch != 'init':
+            yield self.story
+
+        if conversation.nlp_context is None:
+            words = message_words(statement.text)
+        else:
+            words = conversation.nlp_context.words(statement.text)
+
+        yield sorted({ position for word in words
+                       for position in self.triggers.get(word, ()) })
+        yield self.fallback
+
+    def generate_response(self, input_statement, \
+                          additional_response_selection_parameters = None):
+        """
+        Equivalent of ChatBot.generate_response(): Let the routed logic
+        adapters process a statement and select the response
+
+        :param Statement input_statement: User prompt
+        :param dict additional_response_selection_parameters: Parameters for
+            the logic adapters
+        :return: Response statement
+        :rtype: Statement
+        """
+
+        results = {} # Adapter position -> response
+        evaluated = set()
+        for stage in self.stages(input_statement, current_conversation()):
+            for position in stage:
+                if position in evaluated:
+                    continue
+                evaluated.add(position)
+
+                adapter = self.adapters[position]
+                if not adapter.can_process(input_statement):
+                    self.chatbot.logger.info('Not processing the statement using {}'.format(
+                            adapter.class_name))
+                    continue
+
+                output = adapter.process(input_statement,
+                        additional_response_selection_parameters)
+                results[position] = output
+                self.chatbot.logger.info('{} selected "{}" as a response with a confidence of {}'.format(
+                        adapter.class_name, output.text, output.confidence))
+
+            if any(output.confidence >= ROUTE_CONFIDENCE for output in results.values()):
+                break
+
+        result = select_response([ results[position] for position in sorted(results) ])
+
+        Statement = self.chatbot.storage.get_object('statement') # pylint: disable=invalid-name
+        response = Statement(text = result.text,
+                             in_response_to = input_statement.text,
+                             conversation = input_statement.conversation,
+                             persona = 'bot:' + self.chatbot.name)
+        response.confidence = result.confidence
+        return response
+
+def select_response(results):
+    """
+    Select the response among the results of logic adapters like ChatterBot:
+    The first one of the highest confidence, unless at least three adapters
+    responded and several of them agree on the same response
+
+    :param list results: Response statements in adapter order
+    :return: Response statement
+    :rtype: Statement
+    """
+
+    result = None
+    max_confidence = -1
+    for output in results:
+        if output.confidence > max_confidence:
+            result = output
+            max_confidence = output.confidence
+
+    if len(results) >= 3:
+        options = {} # Response -> [ statement of highest confidence, count ]
+        for output in results:
+            key = output.text + ':' + (output.in_response_to or '')
+            if key not in options:
+                options[key] = [ output, 1 ]
+                continue
+
+            options[key][1] += 1
+            if options[key][0].confidence < output.confidence:
+                options[key][0] = output
+
+        most_common = max(options.values(), key = lambda option: option[1])
+        if most_common[1] > 1:
+            result = most_common[0]
+
+    return result
@@ -0,0 +1,479 @@
+"""
+(C) 2021 Julian von Mendel <prog@derjulian.net>
+
+sessionstore.py
+====================================
+Session stores keeping the state of chatbot sessions (see
+BotClass.get_session_state()) outside of the web server process, so multiple
+workers can serve the same sessions and conversations survive restarts.
+"""
+
+import json
+import time
+import logging
+import socket
+import sqlite3
+import datetime
+import threading
+import collections
+import urllib.parse
+
+DEFAULT_MAXSIZE = 100000 # Sessions an in-memory store keeps at most
+DEFAULT_TIMEOUT = 7200 # Seconds of inactivity after which a session expires
+DEFAULT_REAPER_INTERVAL = 60 # Seconds between two runs of a SessionReaper
+
+logger = logging.getLogger(__name__)
+
+def _encode_value(value):
+    """
+    Internal helper for JSON encoding of the types found in session states
+    """
+
+    if isinstance(value, datetime.datetime):
+        return { '__datetime__': value.isoformat() }
+
+    if isinstance(value, datetime.date):
+        return { '__date__': value.isoformat() }
+
+    raise TypeError("{} is not JSON serializable".format(type(value).__name__))
+
+def _decode_value(obj):
+    """
+    Internal helper for JSON decoding of the types found in session states
+    """
+
+    if '__datetime__' in obj:
+        return datetime.datetime.fromisoformat(obj['__datetime__'])
+
+    if '__date__' in obj:
+        return datetime.date.fromisoformat(obj['__date__'])
+
+    return obj
+
+def encode_state(state):
+    """
+    Serialize a session state to JSON, including datetime entity values
+
+    :param dict state: Session state
+    :return: JSON string
+    :rtype: str
+    """
+
+    return json.dumps(state, default = _encode_value)
+
+def decode_state(data):
+    """
+    Deserialize a session state serialized with encode_state()
+
+    :param str data: JSON string
+    :return: Session state
+    :rtype: dict
+    """
+
+    return json.loads(data, object_hook = _decode_value)
+
+class SessionStore:
+    """
+    Interface of session stores. Session states are dicts as returned by
+    BotClass.get_session_state(), keyed by session id.
+    """
+
+    def load(self, uid):
+        """
+        Load a session state and refresh the last activity of the session
+
+        :param str uid: Session id
+        :return: Session state or None if the session is unknown or expired
+        :rtype: dict
+        """
+
+        raise NotImplementedError()
+
+    def save(self, uid, state):
+        """
+        Save a session state and refresh the last activity of the session
+
+        :param str uid: Session id
+        :param dict state: Session state
+        """
+
+        raise NotImplementedError()
+
+    def delete(self, uid):
+        """
+        Remove a session
+
+        :param str uid: Session id
+        """
+
+        raise NotImplementedError()
+
+    def touch(self, uid):
+        """
+        Refresh the last activity of a session
+
+        :param str uid: Session id
+        :return: True if the session is known
+        :rtype: bool
+        """
+
+        raise NotImplementedError()
+
+    def expire(self, timeout):
+        """
+        Remove all sessions that were inactive for a given time
+
+        :param int timeout: Seconds of inactivity
+        :return: Number of removed sessions
+        :rtype: int
+        """
+
+        raise NotImplementedError()
+
+class MemorySessionStore(SessionStore):
+    """
+    Session store within the current process, which drops the least recently
+    used sessions if more than maxsize sessions are kept.
+
+    Sessions are kept ordered by last activity, which makes refreshing a
+    session O(1) and expiry O(1) per expired session.
+
+    :param int maxsize: Maximum number of sessions, or None for no limit
+    """
+
+    def __init__(self, maxsize = DEFAULT_MAXSIZE):
+        self.maxsize = maxsize
+        self.sessions = collections.OrderedDict() # uid -> (state, lastactivity)
+        self.lock = threading.Lock()
+
+    def load(self, uid):
+        with self.lock:
+            if uid not in self.sessions:
+                return None
+
+            state = self.sessions[uid][0]
+            self.sessions[uid] = (state, time.time())
+            self.sessions.move_to_end(uid)
+            return state
+
+    def save(self, uid, state):
+        with self.lock:
+            self.sessions[uid] = (state, time.time())
+            self.sessions.move_to_end(uid)
+
+            while self.maxsize is not None and len(self.sessions) > self.maxsize:
+                self.sessions.popitem(last = False)
+
+    def delete(self, uid):
+        with self.lock:
+            self.sessions.pop(uid, None)
+
+    def touch(self, uid):
+        with self.lock:
+            if uid not in self.sessions:
+                return False
+
+            self.sessions[uid] = (self.sessions[uid][0], time.time())
+            self.sessions.move_to_end(uid)
+            return True
+
+    def expire(self, timeout):
+        limit = time.time() - timeout
+        count = 0
+
+        with self.lock:
+            # Sessions are ordered by last activity
+            while self.sessions:
+                uid = next(iter(self.sessions))
+                if self.sessions[uid][1] >= limit:
+                    break
+
+                del self.sessions[uid]
+                count += 1
+
+        return count
+
+    def __len__(self):
+        return len(self.sessions)
+
+class SQLiteSessionStore(SessionStore):
+    """
+    Session store in an SQLite database, which can be shared by all worker
+    processes on a host.
+
+    :param str path: Path of the database file
+    """
+
+    def __init__(self, path):
+        self.connection = sqlite3.connect(path, check_same_thread = False,
+                                          isolation_level = None)
+        self.lock = threading.Lock()
+
+        with self.lock:
+            self.connection.execute('PRAGMA journal_mode=WAL')
+            self.connection.execute('CREATE TABLE IF NOT EXISTS botstory_session '
+                    '(uid TEXT PRIMARY KEY, state TEXT NOT NULL, '
+                    'lastactivity REAL NOT NULL)')
+            self.connection.execute('CREATE INDEX IF NOT EXISTS '
+                    'botstory_session_lastactivity '
+                    'ON botstory_session (lastactivity)')
+
+    def load(self, uid):
+        with self.lock:
+            row = self.connection.execute('SELECT state FROM botstory_session '
+                    'WHERE uid = ?', (uid,)).fetchone()
+            if row is None:
+                return None
+
+            self.connection.execute('UPDATE botstory_session '
+                    'SET lastactivity = ? WHERE uid = ?', (time.time(), uid))
+
+        return decode_state(row[0])
+
+    def save(self, uid, state):
+        data = encode_state(state)
+
+        with self.lock:
+            self.connection.execute('INSERT OR REPLACE INTO botstory_session '
+                    '(uid, state, lastactivity) VALUES (?, ?, ?)',
+                    (uid, data, time.time()))
+
+    def delete(self, uid):
+        with self.lock:
+            self.connection.execute('DELETE FROM botstory_session '
+                    'WHERE uid = ?', (uid,))
+
+    def touch(self, uid):
+        with self.lock:
+            cursor = self.connection.execute('UPDATE botstory_session '
+                    'SET lastactivity = ? WHERE uid = ?', (time.time(), uid))
+            return cursor.rowcount > 0
+
+    def expire(self, timeout):
+        with self.lock:
+            cursor = self.connection.execute('DELETE FROM botstory_session '
+                    'WHERE lastactivity < ?', (time.time() - timeout,))
+            return cursor.rowcount
+
+    def __len__(self):
+        with self.lock:
+            return self.connection.execute('SELECT COUNT(*) '
+                    'FROM botstory_session').fetchone()[0]
+
+class RedisError(Exception):
+    """
+    Error reply of a Redis server
+    """
+
+class RedisConnection:
+    """
+    Minimal client for the Redis protocol (RESP), sufficient for the session
+    store. Works with Redis and Redis compatible servers.
+
+    :param str host: Server host
+    :param int port: Server port
+    :param int db: Database number
+    :param float socket_timeout: Socket timeout in seconds
+    """
+
+    def __init__(self, host = 'localhost', port = 6379, db = 0, \
+                 socket_timeout = 5.0):
+        self.address = (host, port)
+        self.db = db
+        self.socket_timeout = socket_timeout
+        self.sock = None
+        self.reader = None
+        self.lock = threading.Lock()
+
+    def _connect(self):
+        """
+        Internal helper to open the connection and select the database
+        """
+
+        self.sock = socket.create_connection(self.address, self.socket_timeout)
+        self.reader = self.sock.makefile('rb')
+        if self.db:
+            self._command('SELECT', self.db)
+
+    def close(self):
+        """
+        Close the connection
+        """
+
+        if self.sock is not None:
+            self.reader.close()
+            self.sock.close()
+        self.sock = None
+        self.reader = None
+
+    def _command(self, *args):
+        """
+        Internal helper to send a command on the open connection and read the
+        reply
+        """
+
+        request = [ b'*%d\r\n' % len(args) ]
+        for arg in args:
+            if not isinstance(arg, bytes):
+                arg = str(arg).encode('utf-8')
+            request.append(b'$%d\r\n%s\r\n' % (len(arg), arg))
+
+        self.sock.sendall(b''.join(request))
+        return self._read_reply()
+
+    def _read_reply(self):
+        """
+        Internal helper to read one reply from the server
+        """
+
+        line = self.reader.readline()
+        if not line:
+            raise ConnectionError("Connection closed by Redis server")
+
+        prefix, payload = line[:1], line[1:-2]
+
+        if prefix == b'+':
+            return payload.decode('utf-8')
+        if prefix == b'-':
+            raise RedisError(payload.decode('utf-8'))
+        if prefix == b':':
+            return int(payload)
+        if prefix == b'$':
+            length = int(payload)
+            if length < 0:
+                return None
+            data = self.reader.read(length + 2)
+            return data[:-2]
+        if prefix == b'*':
+            length = int(payload)
+            if length < 0:
+                return None
+            return [self._read_reply() for _ in range(length)]
+
+        raise RedisError("Unknown reply from Redis server: {!r}".format(line))
+
+    def execute(self, *args):
+        """
+        Execute a command, reconnecting once if the connection was lost
+
+        :return: Server reply
+        """
+
+        with self.lock:
+            for attempt in range(2):
+                try:
+                    if self.sock is None:
+                        self._connect()
+                    return self._command(*args)
+                except (ConnectionError, OSError):
+                    self.close()
+                    if attempt > 0:
+                        raise
+
+        return None
+
+class RedisSessionStore(SessionStore):
+    """
+    Session store on a Redis protocol server, which can be shared by worker
+    processes on multiple hosts. Sessions expire through Redis key timeouts,
+    so expire() has nothing to do.
+
+    :param RedisConnection connection: Server connection
+    :param int timeout: Seconds of inactivity after which a session expires
+    :param str prefix: Key prefix for session states
+    """
+
+    def __init__(self, connection, timeout = DEFAULT_TIMEOUT, \
+                 prefix = 'botstory:session:'):
+        self.connection = connection
+        self.timeout = timeout
+        self.prefix = prefix
+
+    def load(self, uid):
+        data = self.connection.execute('GET', self.prefix + uid)
+        if data is None:
+            return None
+
+        self.touch(uid)
+        return decode_state(data.decode('utf-8'))
+
+    def save(self, uid, state):
+        self.connection.execute('SET', self.prefix + uid, encode_state(state),
+                                'EX', int(self.timeout))
+
+    def delete(self, uid):
+        self.connection.execute('DEL', self.prefix + uid)
+
+    def touch(self, uid):
+        return self.connection.execute('EXPIRE', self.prefix + uid,
+                                       int(self.timeout)) == 1
+
+    def expire(self, timeout):
+        return 0
+
+class SessionReaper(threading.Thread):
+    """
+    Background thread removing expired sessions from a session store, so
+    request handling does not need to care about expiry.
+
+    :param SessionStore store: Session store
+    :param int timeout: Seconds of inactivity after which a session expires
+    :param float interval: Seconds between two expiry runs
+    """
+
+    def __init__(self, store, timeout = DEFAULT_TIMEOUT, \
+                 interval = DEFAULT_REAPER_INTERVAL):
+        super().__init__(name = 'botstory-session-reaper', daemon = True)
+        self.store = store
+        self.timeout = timeout
+        self.interval = interval
+        self.stop_event = threading.Event()
+
+    def run(self):
+        while not self.stop_event.wait(self.interval):
+            try:
+                count = self.store.expire(self.timeout)
+            except Exception: # pylint: disable=broad-except
+                logger.exception("Session expiry failed")
+                continue
+
+            if count > 0:
+                logger.info("Cleaned up %d sessions.", count)
+
+    def stop(self):
+        """
+        Stop the thread after the current expiry run
+        """
+
+        self.stop_event.set()
+
+def create_session_store(url = 'memory', timeout = DEFAULT_TIMEOUT):
+    """
+    Create a session store from a URL:
+    'memory' or 'memory://?maxsize=<n>' for an in-memory store,
+    'sqlite:///<path>' for an SQLite store,
+    'redis://<host>:<port>/<db>' for a Redis protocol store.
+
+    :param str url: Session store URL
+    :param int timeout: Seconds of inactivity after which a session expires
+    :return: Session store
+    :rtype: SessionStore
+    """
+
+    parsed = urllib.parse.urlparse(url)
+    options = dict(urllib.parse.parse_qsl(parsed.query))
+
+    if url == 'memory' or parsed.scheme == 'memory':
+        maxsize = int(options.get('maxsize', DEFAULT_MAXSIZE))
+        return MemorySessionStore(maxsize)
+
+    if parsed.scheme == 'sqlite':
+        return SQLiteSessionStore(parsed.path[1:])
+
+    if parsed.scheme == 'redis':
+        db = int(parsed.path[1:]) if parsed.path[1:] else 0
+        connection = RedisConnection(parsed.hostname or 'localhost',
+                                     parsed.port or 6379, db)
+        return RedisSessionStore(connection, timeout)
+
+    raise ValueError("Unknown session store URL: {}".format(url))
@@ -0,0 +1,326 @@
+"""
+(C) 2021 Julian von Mendel <prog@derjulian.net>
+
+training.py
+====================================
+Incremental training of the ChatterBot knowledge graph: Only corpus files and
+storyline conversation pairs that changed since the last training are
+inserted into or removed from the statement store. Statements are tagged
+once per distinct text and written with bulk inserts in a single transaction.
+"""
+
+import os
+import hashlib
+import datetime
+
+from sqlalchemy import text, select
+from chatterbot.trainers import Trainer
+from chatterbot.conversation import Statement
+from chatterbot.corpus import DATA_DIRECTORY, list_corpus_files, load_corpus
+
+CHUNK_SIZE = 500 # Sources per query, below SQLite's variable limit
+
+class IncrementalTrainer(Trainer):
+    """
+    Trainer that tracks which training sources are in the statement store.
+
+    A training source is either a corpus file or a prompt/reply pair of
+    storyline training data. Each source is identified by a short key, which
+    is also stored as conversation label of its statements, and tracked with
+    a content hash in the botstory_training table.
+
+    This differs from ChatterBot's ListTrainer in two ways: Statements are
+    labelled with their source key instead of the conversation 'training',
+    and each storyline prompt/reply pair is a conversation of its own, so a
+    prompt is not stored as response to the reply of the previous pair.
+    """
+
+    def _execute(self, statement, **params):
+        """
+        Internal helper to execute SQL on the statement store
+
+        :return: List of result rows
+        :rtype: list
+        """
+
+        with self.chatbot.storage.engine.begin() as connection:
+            result = connection.execute(text(statement), **params)
+            if not result.returns_rows:
+                return []
+            return result.fetchall()
+
+    def _create_table(self):
+        """
+        Internal helper to create the table tracking the trained sources
+        """
+
+        self._execute('CREATE TABLE IF NOT EXISTS botstory_training '
+                '(source VARCHAR(32) PRIMARY KEY, name TEXT NOT NULL, '
+                'digest VARCHAR(64) NOT NULL)')
+
+    def get_trained_sources(self):
+        """
+        Retrieve the sources that are in the statement store
+
+        :return: Dict of format { source_key: (name, digest) }
+        :rtype: dict
+        """
+
+        self._create_table()
+        rows = self._execute('SELECT source, name, digest FROM botstory_training')
+        return { row[0]: (row[1], row[2]) for row in rows }
+
+    def reset(self):
+        """
+        Remove all statements and tracked sources
+        """
+
+        self.chatbot.storage.drop()
+        self._create_table()
+        self._execute('DELETE FROM botstory_training')
+
+    @staticmethod
+    def source_key(name):
+        """
+        Short key of a training source, used as statement conversation label
+
+        :param str name: Unique name of the source
+        :rtype: str
+        """
+
+        return 'train:' + hashlib.sha1(name.encode('utf-8')).hexdigest()[:24]
+
+    def get_sources(self, corpus_paths = (), conversation = ()):
+        """
+        Collect the training sources to train
+
+        :param list corpus_paths: Dotted ChatterBot corpus paths
+        :param list conversation: Storyline training data of alternating
+            prompts and replies, see BotStory.get_training_data()
+        :return: Dict of format { source_key: (name, digest, loader) }, where
+            loader is a function returning a list of
+            (conversation_texts, categories) tuples
+        :rtype: dict
+        """
+
+        sources = {}
+
+        for corpus_path in corpus_paths:
+            for file_path in list_corpus_files(corpus_path):
+                with open(file_path, 'rb') as corpus_file:
+                    digest = hashlib.sha256(corpus_file.read()).hexdigest()
+
+                name = 'corpus:{}'.format(os.path.relpath(file_path, DATA_DIRECTORY))
+                sources[self.source_key(name)] = (name, digest,
+                        lambda file_path = file_path: [
+                            (texts, categories)
+                            for corpus, categories, _ in load_corpus(file_path)
+                            for texts in corpus ])
+
+        for prompt, reply in zip(conversation[::2], conversation[1::2]):
+            name = 'story:{}\n{}'.format(prompt, reply)
+            digest = hashlib.sha256(name.encode('utf-8')).hexdigest()
+            sources[self.source_key(name)] = (name, digest,
+                    lambda prompt = prompt, reply = reply: [
+                        ([ prompt, reply ], []) ])
+
+        return sources
+
+    def get_text_index_strings(self, texts):
+        """
+        Compute the search texts of many statement texts at once, tagging
+        each distinct text only once
+
+        :param list texts: Statement texts
+        :return: Dict of format { text: search_text }
+        :rtype: dict
+        """
+
+        tagger = self.chatbot.storage.tagger
+        return { text: tagger.get_bigram_pair_string(text)
+                 for text in dict.fromkeys(texts) }
+
+    def build_rows(self, sources):
+        """
+        Preprocess the statements of many sources in one batch
+
+        :param list sources: List of (source_key, conversations) tuples,
+            where conversations is a list of (conversation_texts, categories)
+        :return: List of (statement_row, categories) tuples in insertion order
+        :rtype: list
+        """
+
+        search_texts = self.get_text_index_strings(
+                statement_text
+                for _, conversations in sources
+                for texts, _ in conversations
+                for statement_text in texts)
+
+        created_at = datetime.datetime.now(datetime.timezone.utc)
+        rows = []
+
+        for source_key, conversations in sources:
+            for texts, categories in conversations:
+                previous_statement_text = None
+                previous_statement_search_text = ''
+
+                for statement_text in texts:
+                    statement = self.get_preprocessed_statement(Statement(
+                        text=statement_text,
+                        search_text=search_texts[statement_text],
+                        in_response_to=previous_statement_text,
+                        search_in_response_to=previous_statement_search_text,
+                        conversation=source_key
+                    ))
+
+                    rows.append(({
+                        'text': statement.text,
+                        'search_text': statement.search_text,
+                        'conversation': statement.conversation,
+                        'persona': statement.persona,
+                        'in_response_to': statement.in_response_to,
+                        'search_in_response_to': statement.search_in_response_to,
+                        'created_at': created_at
+                    }, categories))
+
+                    previous_statement_text = statement.text
+                    previous_statement_search_text = statement.search_text
+
+        return rows
+
+    def _tables(self):
+        """
+        Internal helper to retrieve the statement, tag and tag association
+        tables of the storage
+        """
+
+        statement_model = self.chatbot.storage.get_model('statement')
+        tag_model = self.chatbot.storage.get_model('tag')
+        return statement_model.__table__, tag_model.__table__, \
+                statement_model.tags.property.secondary
+
+    def delete_sources(self, connection, source_keys):
+        """
+        Remove all statements of sources from the statement store
+
+        :param connection: SQLAlchemy connection with an open transaction
+        :param list source_keys: Source keys
+        """
+
+        statement_table, _, association_table = self._tables()
+        source_keys = list(source_keys)
+
+        for start in range(0, len(source_keys), CHUNK_SIZE):
+            chunk = source_keys[start:start + CHUNK_SIZE]
+            statement_ids = select([ statement_table.c.id ]).where(
+                    statement_table.c.conversation.in_(chunk))
+
+            connection.execute(association_table.delete().where(
+                    association_table.c.statement_id.in_(statement_ids)))
+            connection.execute(statement_table.delete().where(
+                    statement_table.c.conversation.in_(chunk)))
+            connection.execute(text('DELETE FROM botstory_training WHERE source IN ({})'.format(
+                    ', '.join(':source{}'.format(i) for i in range(len(chunk))))),
+                    **{ 'source{}'.format(i): key for i, key in enumerate(chunk) })
+
+    def insert_sources(self, connection, sources):
+        """
+        Insert the statements of sources into the statement store with bulk
+        inserts
+
+        :param connection: SQLAlchemy connection with an open transaction
+        :param list sources: List of (source_key, name, digest, conversations)
+        """
+
+        statement_table, tag_table, association_table = self._tables()
+        rows = self.build_rows([ (source_key, conversations)
+                                 for source_key, _, _, conversations in sources ])
+        if rows:
+            connection.execute(statement_table.insert(), [ row for row, _ in rows ])
+
+        # Tags: Statement ids of a source ascend in insertion order
+        tag_names = { name for _, categories in rows for name in categories }
+        if tag_names:
+            tag_ids = dict(connection.execute(select([ tag_table.c.name, tag_table.c.id ])))
+            missing = [ { 'name': name } for name in sorted(tag_names) if name not in tag_ids ]
+            if missing:
+                connection.execute(tag_table.insert(), missing)
+                tag_ids = dict(connection.execute(select([ tag_table.c.name, tag_table.c.id ])))
+
+            categories = {}
+            for row, row_categories in rows:
+                categories.setdefault(row['conversation'], []).append(row_categories)
+
+            associations = []
+            source_keys = list(categories)
+            for start in range(0, len(source_keys), CHUNK_SIZE):
+                statement_ids = {}
+                for statement_id, source_key in connection.execute(
+                        select([ statement_table.c.id, statement_table.c.conversation ])
+                        .where(statement_table.c.conversation.in_(
+                            source_keys[start:start + CHUNK_SIZE]))
+                        .order_by(statement_table.c.id)):
+                    statement_ids.setdefault(source_key, []).append(statement_id)
+
+                for source_key, ids in statement_ids.items():
+                    for statement_id, row_categories in zip(ids, categories[source_key]):
+                        associations.extend({ 'statement_id': statement_id,
+                                              'tag_id': tag_ids[name] }
+                                            for name in set(row_categories))
+
+            if associations:
+                connection.execute(association_table.insert(), associations)
+
+        if sources:
+            connection.execute(text('INSERT OR REPLACE INTO botstory_training '
+                    '(source, name, digest) VALUES (:source, :name, :digest)'),
+                    [ { 'source': source_key, 'name': name, 'digest': digest }
+                      for source_key, name, digest, _ in sources ])
+
+    def train(self, corpus_paths = (), conversation = ()): # pylint: disable=arguments-differ
+        """
+        Bring the statement store up to date with the given corpora and
+        storyline training data. All changes are written in a single
+        transaction.
+
+        :param list corpus_paths: Dotted ChatterBot corpus paths
+        :param list conversation: Storyline training data of alternating
+            prompts and replies, see BotStory.get_training_data()
+        :return: Dict of format { 'added': [names], 'updated': [names],
+            'removed': [names], 'unchanged': count }
+        :rtype: dict
+        """
+
+        trained = self.get_trained_sources()
+        if not trained:
+            # Statements of earlier, untracked training are replaced
+            self.reset()
+
+        sources = self.get_sources(corpus_paths, conversation)
+        report = { 'added': [], 'updated': [], 'removed': [], 'unchanged': 0 }
+        to_delete = []
+        to_insert = []
+
+        for source_key, (name, _) in trained.items():
+            if source_key not in sources:
+                to_delete.append(source_key)
+                report['removed'].append(name)
+
+        for source_key, (name, digest, loader) in sources.items():
+            if source_key in trained:
+                if trained[source_key][1] == digest:
+                    report['unchanged'] += 1
+                    continue
+
+                to_delete.append(source_key)
+                report['updated'].append(name)
+            else:
+                report['added'].append(name)
+
+            to_insert.append((source_key, name, digest, loader()))
+
+        with self.chatbot.storage.engine.begin() as connection:
+            self.delete_sources(connection, to_delete)
+            self.insert_sources(connection, to_insert)
+
+        return report
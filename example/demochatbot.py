@@ -6,8 +6,21 @@ demochatbot.py
 Chatbot demo
 """
 
+import os
 import tempfile
 import botstory.botclass
+from botstory.chatlog import create_chatlog_spill
+
+# Knowledge graph artifact to serve instead of db/database.sqlite3, see
+# main.py --export
+ARTIFACT = os.environ.get('BOTSTORY_ARTIFACT') or None
+
+# Precompiled WordNet definitions, see main.py --export-definitions
+DEFINITIONS = os.environ.get('BOTSTORY_DEFINITIONS') or None
+
+# Store of full chat logs: '' (disabled), 'file:///<directory>' or
+# 'sqlite:///<path>', see botstory.chatlog
+CHATLOG_SPILL = create_chatlog_spill(os.environ.get('BOTSTORY_CHATLOG_SPILL', ''))
 
 # Base class for the specific chatbot
 class DemoChatBot(botstory.botclass.BotClass):
@@ -20,6 +33,8 @@ class DemoChatBot(botstory.botclass.BotClass):
         super().__init__(welcome_msg = 'Hi. How may I help you?',
                 logic_adapters = [
                    'example.demologicadapter.DemoLogicAdapter',
-                   'botstory.definitionslogicadapter.DefinitionsLogicAdapter'
-                ], chatbot_vars = { })
+                   { 'import_path': 'botstory.definitionslogicadapter.DefinitionsLogicAdapter',
+                     'definitions_table': DEFINITIONS }
+                ], chatbot_vars = { }, artifact = ARTIFACT,
+                chatlog_spill = CHATLOG_SPILL)
 
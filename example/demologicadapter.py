@@ -8,44 +8,47 @@ Chatterbot logic adapter to collect information and run action triggers.
 
 import re
 from nltk.metrics.distance import jaro_similarity
-from chatterbot.logic import LogicAdapter
 from chatterbot.conversation import Statement
+from botstory.conversationlogicadapter import ConversationLogicAdapter
 
 JARO_SIMILARITY_LIMIT = 0.6
+TRIGGER_ANY = [ 'search', 'price', 'offer', 'action', 'product', 'products' ]
 
-class DemoLogicAdapter(LogicAdapter):
+class DemoLogicAdapter(ConversationLogicAdapter):
     """
     Chatterbot logic adapter
     """
 
+    story_adapter = True
+    trigger_words = frozenset(TRIGGER_ANY)
+
     def __init__(self, chatbot, **kwargs):
         super().__init__(chatbot, **kwargs)
 
-        output_text = kwargs.get('output_text')
-        self.response_statement = Statement(output_text)
-
+        self.output_text = kwargs.get('output_text')
         self.reservations_db = kwargs.get('reservations_db')
-        self.botclass = kwargs.get('botclass')
-        self.botstory = self.botclass.botstory
 
-        self.botstory.add_branch("init",
+        # Storyline definition shared by all sessions
+        botstory = kwargs.get('botclass').botstory
+
+        botstory.add_branch("init",
                 [ 'quit', 'exit', 'help', 'bye', 'reconsidered', 'cu' ],
                 { })
-        self.botstory.add_branch('search',
+        botstory.add_branch('search',
                 [ 'search', 'offer', 'price', 'products', 'offer' ],
                 {
                     'date': { 'type': 'date', 'question': "What date are you interested in?" },
                     'quantity': { 'type': 'int:1:20', 'parallel_takeup': 'date', 'question': 'Ok, the date is {date}. What quantity are you interested in?' },
                     'size': { 'type': 'str', 'question': 'What size do you prefer? We offer small, mid and large.', 'buttons': [ 'small', 'mid', 'large' ] },
                 })
-        self.botstory.add_branch('search_confirm',
+        botstory.add_branch('search_confirm',
                  [ ], # Can't be user triggered, it's programmatically initiated after search
                  {
                      # date and nights we overtake from the previous search branch
                      'action_now': { 'type': 'bool_confirm', 'question': 'Would you like to order now?' },
                  },
                  button = 'Trigger search')
-        self.botstory.add_branch('action',
+        botstory.add_branch('action',
                  [ 'action', 'trigger' ],
                  {
                      # date, quantity and size we overtake from the previous search branch
@@ -58,7 +61,7 @@ class DemoLogicAdapter(LogicAdapter):
                  })
 
         # "Blind" branches with no further logic
-        self.botstory.add_blind_branches([
+        botstory.add_blind_branches([
             "Can you tell me your contact information?",
             "Sure. Our address is ...",
             "What are your opening times?",
@@ -71,28 +74,41 @@ class DemoLogicAdapter(LogicAdapter):
             "search_results": "On {date} for quantity {quantity} and size {size} I can offer you these options:\n{search_results}\nWould you like to order now?",
             "done": "Thank you! Can I help you with anything else?" }
 
-        self.search_results = None # Used in further class logic
+    def triggered(self, statement, conversation):
+        """
+        Pre-filter of can_process(): Trigger words are only required to start
+        a story branch.
+        """
 
-    def can_process(self, statement):
+        if conversation is not None and conversation.branch != "init":
+            # A story branch is already active
+            return True
+
+        return super().triggered(statement, conversation)
+
+    def can_process_conversation(self, statement, conversation):
         """
-        Chatterbot interface to check whether a statement can be processed by
-        this logic adapter.
+        Check whether a statement can be processed by this logic adapter.
         """
 
+        if conversation is None:
+            # Story branches need the state of a session
+            return False
+
         # Verify that the user prompt matches our word triggers
-        if self.botstory.get_branch_name() != "init":
+        if conversation.branch != "init":
             # A story branch is already active
             return True
 
-        nlp = self.botstory.process_query(statement.text,
-                { 'trigger_any': [ 'search', 'price', 'offer', 'action', 'product', 'products' ] })
+        nlp = conversation.botstory.process_query(statement.text,
+                { 'trigger_any': TRIGGER_ANY })
 
         if 'trigger_any' in nlp['word_classes']:
             return True
 
         return False
 
-    def switch_branch(self):
+    def switch_branch(self, conversation):
         """
         Try to identify the intent in a user prompt and switch branch if
         adequate.
@@ -105,18 +121,19 @@ class DemoLogicAdapter(LogicAdapter):
         :rtype: str
         """
 
-        branch = self.botstory.get_branch_name()
-        suggested_branch = self.botstory.identify_intent()
+        botstory = conversation.botstory
+        branch = botstory.get_branch_name()
+        suggested_branch = botstory.identify_intent()
 #print("current branch: {}".format(branch))
 #print("suggested branch: {}".format(suggested_branch))
 
         if branch != "init" and suggested_branch == 'init':
-            self.botstory.enter_branch('init')
+            botstory.enter_branch('init')
             return self.lang['done']
 
         if branch == "init" and suggested_branch == 'search':
-            self.botstory.enter_branch(suggested_branch)
-            return self.botstory.prompt_for_open_entities()
+            botstory.enter_branch(suggested_branch)
+            return botstory.prompt_for_open_entities()
 
             # Use a more colorful free-style opening
             #self.botstory.set_requested_entity('date')
@@ -124,7 +141,7 @@ class DemoLogicAdapter(LogicAdapter):
 
         return None
 
-    def process_entity_in_user_response(self):
+    def process_entity_in_user_response(self, conversation):
         """
         Process entities in the user response.
 
@@ -136,9 +153,11 @@ class DemoLogicAdapter(LogicAdapter):
         :rtype: str
         """
 
-        text = self.botstory.process_entity_in_user_response()
-        branch = self.botstory.get_branch_name()
-        entity_values = self.botstory.get_entity_values()
+        botstory = conversation.botstory
+        search_results = conversation.search_results
+        text = botstory.process_entity_in_user_response()
+        branch = botstory.get_branch_name()
+        entity_values = botstory.get_entity_values()
 
         if branch != 'action' or branch not in entity_values or \
                 'queryname' not in entity_values[branch]:
@@ -155,7 +174,7 @@ class DemoLogicAdapter(LogicAdapter):
             # Note: Jaro similarity is more suitable than Levenshtein distance here
             best_match = -1
             best_match_score = 0
-            for i, room in enumerate(self.search_results):
+            for i, room in enumerate(search_results):
                 score = jaro_similarity(room['name'], queryname)
                 if score > best_match_score:
                     best_match_score = score
@@ -165,13 +184,13 @@ class DemoLogicAdapter(LogicAdapter):
                 i = best_match
 
         # Save updated entities back
-        if 0 <= i < len(self.search_results):
-            entity_values[branch]['queryname'] = self.search_results[i]["name"]
-            self.botstory.entity_store_append(entity_values[branch])
+        if 0 <= i < len(search_results):
+            entity_values[branch]['queryname'] = search_results[i]["name"]
+            botstory.entity_store_append(entity_values[branch])
 
         return text
 
-    def trigger_branch_action(self):
+    def trigger_branch_action(self, conversation):
         """
         If all entities have been assembled, process the actual user intent
         and interface it to the ERP.
@@ -181,8 +200,9 @@ class DemoLogicAdapter(LogicAdapter):
         :rtype: str
         """
 
-        branch = self.botstory.get_branch_name()
-        entity_values = self.botstory.get_entity_values()
+        botstory = conversation.botstory
+        branch = botstory.get_branch_name()
+        entity_values = botstory.get_entity_values()
 
         # We have all data and the confirmation! Trigger actions.
         #print(entity_values)
@@ -199,45 +219,45 @@ class DemoLogicAdapter(LogicAdapter):
             #        entity_values['search']['quantity'], \
             #        None, entity_values['search']['size'], \
             #        entity_values['search']['date'])
-            self.search_results = [ { "id": 1, "name": "Rooftop bar", "price": 246 },
+            conversation.search_results = [ { "id": 1, "name": "Rooftop bar", "price": 246 },
                                     { "id": 2, "name": "Beach bar", "price": 369 },
                                      { "id": 3, "name": "Food truck", "price": 123 } ]
 
-            if len(self.search_results) == 0:
+            if len(conversation.search_results) == 0:
                 # No rooms with given parameters are available
-                self.botstory.enter_branch('init')
+                botstory.enter_branch('init')
                 return self.lang["no_search_results"]
 
             # Print search results
             search_results = []
-            self.botclass.button_overwrite['queryname'] = []
+            conversation.button_overwrite['queryname'] = []
             i = 1
-            for item in self.search_results:
+            for item in conversation.search_results:
                 name_safe = "".join([c for c in item['name'].lower() if re.match(r'\w', c)]) # alphanumeric_
                 vals_formatted = {'i': i, 'name': item['name'],
                                   'shortname': name_safe, 'price': item['price']}
                 search_results.append("\t{i}) {name} for {price} EUR\n".format(**vals_formatted))
-                self.botclass.button_overwrite['queryname'].append(
+                conversation.button_overwrite['queryname'].append(
                     '<b>{name}</b><!--<img src="/static/img/{shortname}.jpg" />-->'.format(**vals_formatted))
                 i += 1
 
-            entities_formatted = self.botstory.get_entity_values_formatted()
+            entities_formatted = botstory.get_entity_values_formatted()
             entities_formatted['search_results'] = "".join(search_results)
 
             # Have the user confirm whether she wants to book
-            self.botstory.enter_branch('search_confirm')
+            botstory.enter_branch('search_confirm')
 
             return self.lang["search_results"].format(**entities_formatted)
 
         if branch == "search_confirm":
             # User would like to move on with booking
-            self.botstory.enter_branch('action')
+            botstory.enter_branch('action')
 
             # Copy over entities that were accumulated in search branch
-            self.botstory.entity_store_copy('search')
+            botstory.entity_store_copy('search')
 
             # Prompt for missing entities
-            prompt = self.botstory.prompt_for_open_entities()
+            prompt = botstory.prompt_for_open_entities()
             return prompt
 
         if branch == "action":
@@ -254,14 +274,15 @@ class DemoLogicAdapter(LogicAdapter):
             #self.reservations_db.book(id, entity_values['book']['date'], \
             #    entity_values['book']['quantity'], entity_values['book']['name'], \
             #    entity_values['book']['catering'])
-            self.botstory.enter_branch('init')
+            botstory.enter_branch('init')
             return self.lang["done"]
 
         return None
 
-    def process(self, statement, additional_response_selection_parameters = None):
+    def process_conversation(self, statement, conversation, \
+                             additional_response_selection_parameters = None):
         """
-        Chatterbot interface for processing of statements:
+        Processing of statements:
         If adequate, perform any of the following:
         a) Switch storyline  branch
         b) Assemble entities
@@ -270,30 +291,30 @@ class DemoLogicAdapter(LogicAdapter):
         """
 
         # Perform NLP
-        self.botstory.process_query(statement.text)
-        #nlp = self.botstory.process_query(statement.text)
+        conversation.botstory.process_query(statement.text)
+        #nlp = conversation.botstory.process_query(statement.text)
         #print(nlp)
-        #print(self.botstory.get_last_requested_entity())
-
-        self.response_statement.confidence = 1
+        #print(conversation.botstory.get_last_requested_entity())
 
-        self.response_statement.text = self.switch_branch()
-        if self.response_statement.text is not None:
-            return self.response_statement
+        response_statement = Statement(self.output_text)
+        response_statement.confidence = 1
 
-        self.response_statement.text = self.process_entity_in_user_response()
-        if self.response_statement.text is not None:
-            return self.response_statement
+        response_statement.text = self.switch_branch(conversation)
+        if response_statement.text is not None:
+            return response_statement
 
-        self.response_statement.text = self.botstory.prompt_for_open_entities()
-        if self.response_statement.text is not None:
-            return self.response_statement
+        response_statement.text = self.process_entity_in_user_response(conversation)
+        if response_statement.text is not None:
+            return response_statement
 
-        self.response_statement.text = self.trigger_branch_action()
-        if self.response_statement.text is not None:
-            return self.response_statement
+        response_statement.text = conversation.botstory.prompt_for_open_entities()
+        if response_statement.text is not None:
+            return response_statement
 
-        self.response_statement.text = self.lang['dontunderstand']
-        self.response_statement.confidence = 0.1
-        return self.response_statement
+        response_statement.text = self.trigger_branch_action(conversation)
+        if response_statement.text is not None:
+            return response_statement
 
+        response_statement.text = self.lang['dontunderstand']
+        response_statement.confidence = 0.1
+        return response_statement
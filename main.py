@@ -8,10 +8,16 @@ This is the main program for the command line chatbot interface
 
 import sys
 import logging
+import functools
 
 from example.demochatbot import DemoChatBot
+from botstory.nlp import warm_up
+from botstory.definitions import build_definitions_table
+from botstory.replay import split_transcript, replay, format_transcript, \
+        diff_transcript
 
 TEST_CONVERSATIONS_FILE = 'tests/conversations.txt'
+TEST_CONVERSATIONS_PROCESSED_FILE = 'tests/conversations_processed.txt'
 logging.basicConfig(level=logging.CRITICAL)
 #logging.basicConfig(level=logging.INFO)
 
@@ -44,38 +50,53 @@ def main_cli():
         except (KeyboardInterrupt, EOFError, SystemExit):
             break
 
-def main_sim():
-    """
-    Load prompts from txt file and print bot responses
+def main_sim(check = False):
     """
+    Load prompts from txt file and print bot responses. Conversations are
+    replayed in parallel.
 
-    current_chatbot = DemoChatBot(tmp_erp = True)
+    :param bool check: Print a diff to the recorded responses instead
+    :return: Exit status, 1 if check finds differences
+    :rtype: int
+    """
 
     with open(TEST_CONVERSATIONS_FILE, "r") as conversation_input:
-        for line in conversation_input:
-            if line.strip() == "":
-                # New conversation, reset data
-                current_chatbot = DemoChatBot(tmp_erp = True)
-                print("\n--- new conversation ---\n")
-                continue
-
-            # Process user prompt and print response
-            print("> {}".format(line.strip()))
-            response = current_chatbot.process_query(line)
-            print(response)
+        conversations = split_transcript(conversation_input)
+
+    transcript = format_transcript(replay(conversations,
+            functools.partial(DemoChatBot, tmp_erp = True)))
+
+    if not check:
+        sys.stdout.write(transcript)
+        return 0
+
+    with open(TEST_CONVERSATIONS_PROCESSED_FILE, "r") as expected_output:
+        diff = diff_transcript(transcript, expected_output.read())
 
-        conversation_input.close()
+    sys.stdout.writelines(diff)
+    return 1 if diff else 0
 
 # Command line interface
 if __name__ == "__main__":
+    warm_up() # Load NLP resources once before the first message
     if len(sys.argv) == 1: # No parameter: start up the chatbot
         main_cli()
     elif sys.argv[1] == "--train": # Train the knowledge graph of the chatbot
         print("Training...")
         chatbot_to_train = DemoChatBot()
-        chatbot_to_train.train()
-        print("Done")
+        report = chatbot_to_train.train(incremental = "--full" not in sys.argv[2:])
+        print("Done: {} added, {} updated, {} removed, {} unchanged".format(
+            len(report['added']), len(report['updated']),
+            len(report['removed']), report['unchanged']))
+    elif sys.argv[1] == "--export" and len(sys.argv) > 2: # Export a read-only knowledge graph artifact
+        metadata = DemoChatBot().export_artifact(sys.argv[2])
+        print("Exported version {} with {} statements to {}".format(
+            metadata['version'], metadata['statements'], sys.argv[2]))
+    elif sys.argv[1] == "--export-definitions" and len(sys.argv) > 2: # Precompile WordNet definitions
+        counts = build_definitions_table(sys.argv[2])
+        print("Exported {} definitions of {} lemmas to {}".format(
+            counts['definitions'], counts['lemmas'], sys.argv[2]))
     elif sys.argv[1] == "--sim": # Load stored up user prompts and print bot answers
-        main_sim()
+        sys.exit(main_sim(check = "--check" in sys.argv[2:]))
     else:
-        print("usage: {} [--train|--sim]".format(sys.argv[0]))
+        print("usage: {} [--train [--full]|--export <path>|--export-definitions <path>|--sim [--check]]".format(sys.argv[0]))
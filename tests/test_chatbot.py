@@ -1,7 +1,13 @@
 import sys
 import os
+import tempfile
 import unittest
+from chatterbot.conversation import Statement
+from chatterbot.search import IndexedTextSearch
 from botstory.botclass import BotClass
+from botstory.training import IncrementalTrainer
+from botstory.artifact import ArtifactError
+from botstory.chatlog import create_chatlog_spill
 
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
@@ -11,3 +17,121 @@ class TestChatbot(unittest.TestCase):
         # Check whether the bot is able to respond to a simple phrase from conversations.json
         self.assertEqual(chatbot.process_query("Thank you."), "You're welcome.")
         self.assertEqual(chatbot.process_query("thank you"), "You're welcome.")
+
+    def test_shared_engine(self):
+        chatbot = BotClass()
+        other_chatbot = BotClass()
+
+        # Sessions share the engine, but not their conversation state
+        self.assertIs(chatbot.engine, other_chatbot.engine)
+        self.assertIsNot(chatbot.conversation, other_chatbot.conversation)
+        self.assertIsNot(chatbot.botstory, other_chatbot.botstory)
+        self.assertEqual(other_chatbot.process_query("Thank you."), "You're welcome.")
+        self.assertEqual(chatbot.get_chatlog(), [ "*Hi.*" ])
+        self.assertEqual(len(other_chatbot.get_chatlog()), 3)
+
+    def test_chatlog_spill(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            spill = create_chatlog_spill('file:///' + os.path.join(tmpdir, 'logs'))
+            chatbot = BotClass(chatlog_spill = spill)
+            chatbot.process_query("Thank you.")
+
+            # Servers build a bot per request and restore the session state
+            state = chatbot.get_session_state()
+            for _ in range(3):
+                chatbot = BotClass(chatlog_spill = spill)
+                chatbot.set_session_state(state)
+                chatbot.process_query("Thank you.")
+                state = chatbot.get_session_state()
+
+            self.assertEqual(os.listdir(os.path.join(tmpdir, 'logs')),
+                             [ '{}.log'.format(state['chatlog']['log_id']) ])
+            self.assertEqual(len(chatbot.get_chatlog()), 9)
+            self.assertEqual(list(chatbot.get_chatlog())[:2], [ "*Hi.*", "Thank you." ])
+
+    def test_indexed_best_match(self):
+        chatbot = BotClass()
+        indexed_search = chatbot.chatbot.logic_adapters[-1].search_algorithm
+        text_search = IndexedTextSearch(chatbot.chatbot)
+
+        # The candidate index finds the same matches as the full text search
+        for text in [ "Thank you.", "Are you sentient?", "Tell me a joke.", "" ]:
+            expected = [ (match.id, match.confidence)
+                         for match in text_search.search(Statement(text = text)) ]
+            result = [ (match.id, match.confidence)
+                       for match in indexed_search.search(Statement(text = text)) ]
+            self.assertEqual(result, expected)
+
+    def test_incremental_training(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            chatbot = BotClass(database_uri = os.path.join(tmpdir, 'db.sqlite3'),
+                               shared_engine = False)
+            trainer = IncrementalTrainer(chatbot.chatbot)
+            conversation = [ "Hello", "Hi there", "How are you?", "Fine." ]
+
+            report = trainer.train([], conversation)
+            self.assertEqual(len(report['added']), 2)
+            self.assertEqual(chatbot.chatbot.storage.count(), 4)
+
+            # Search texts are the ones of the ChatterBot tagger
+            tagger = chatbot.chatbot.storage.tagger
+            for statement in chatbot.chatbot.storage.filter():
+                self.assertEqual(statement.search_text, tagger.get_bigram_pair_string(statement.text))
+
+            # Every prompt/reply pair is a conversation labelled with its source
+            statements = { statement.text: statement
+                           for statement in chatbot.chatbot.storage.filter() }
+            self.assertIsNone(statements["How are you?"].in_response_to)
+            self.assertEqual(statements["Fine."].in_response_to, "How are you?")
+            self.assertEqual(statements["Fine."].conversation,
+                             trainer.source_key('story:How are you?\nFine.'))
+            self.assertNotEqual(statements["Hello"].conversation,
+                                statements["How are you?"].conversation)
+
+            # Unchanged sources are skipped, removed sources are deleted
+            report = trainer.train([], conversation)
+            self.assertEqual(report['unchanged'], 2)
+            self.assertEqual(report['added'], [])
+
+            report = trainer.train([], conversation[:2] + [ "Bye", "Goodbye." ])
+            self.assertEqual((len(report['added']), len(report['removed']), report['unchanged']),
+                             (1, 1, 1))
+            self.assertEqual(sorted(statement.text for statement in chatbot.chatbot.storage.filter()),
+                             [ "Bye", "Goodbye.", "Hello", "Hi there" ])
+
+    def test_train(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            chatbot = BotClass(database_uri = os.path.join(tmpdir, 'db.sqlite3'),
+                               shared_engine = False)
+            corpus = [ "chatterbot.corpus.english.greetings" ]
+
+            report = chatbot.train(corpus_paths = corpus)
+            self.assertIn('corpus:' + os.path.join('english', 'greetings.yml'), report['added'])
+            self.assertEqual(chatbot.process_query("Nice to meet you."), "Thank you.")
+            self.assertEqual(chatbot.train(corpus_paths = corpus)['added'], [])
+
+            # Full retraining replaces all statements
+            count = chatbot.chatbot.storage.count()
+            report = chatbot.train(incremental = False, corpus_paths = corpus)
+            self.assertEqual(report['unchanged'], 0)
+            self.assertEqual(chatbot.chatbot.storage.count(), count)
+            self.assertEqual(chatbot.process_query("Nice to meet you."), "Thank you.")
+
+    def test_artifact(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            chatbot = BotClass(database_uri = os.path.join(tmpdir, 'db.sqlite3'),
+                               shared_engine = False)
+            IncrementalTrainer(chatbot.chatbot).train([], [ "Thank you.", "You're welcome." ])
+
+            path = os.path.join(tmpdir, 'knowledge.artifact')
+            metadata = chatbot.export_artifact(path, '1.0')
+            self.assertEqual((metadata['version'], metadata['statements']), ('1.0', '2'))
+
+            # The artifact answers like the database it was exported from
+            artifact_chatbot = BotClass(artifact = path, shared_engine = False)
+            self.assertEqual(artifact_chatbot.engine.artifact['version'], '1.0')
+            self.assertEqual(artifact_chatbot.process_query("Thank you."), "You're welcome.")
+
+            with self.assertRaises(ArtifactError):
+                BotClass(artifact = os.path.join(tmpdir, 'missing.artifact'),
+                         shared_engine = False)
@@ -0,0 +1,59 @@
+import sys
+import os
+import tempfile
+import unittest
+from botstory.chatlog import ChatLog, create_chatlog_spill
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+class TestChatLog(unittest.TestCase):
+    def test_window(self):
+        chatlog = ChatLog(3)
+        for i in range(5):
+            chatlog.append(str(i))
+
+        # Only the window is kept without spill
+        self.assertEqual(chatlog, [ '2', '3', '4' ])
+        self.assertEqual(len(chatlog), 3)
+        self.assertEqual(chatlog.get_state()['count'], 5)
+
+        # Session states of unbounded chat logs are cut to the window
+        chatlog.set_state([ 'a', 'b', 'c', 'd' ])
+        self.assertEqual(chatlog.recent(), [ 'b', 'c', 'd' ])
+
+    def test_spill(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            for url in ('file:///' + os.path.join(tmpdir, 'logs'),
+                        'sqlite:///' + os.path.join(tmpdir, 'chatlog.sqlite3')):
+                spill = create_chatlog_spill(url)
+                chatlog = ChatLog(2, spill)
+                for i in range(5):
+                    chatlog.append(str(i))
+
+                # The full history is streamed from spill and window
+                self.assertEqual(list(chatlog), [ '0', '1', '2', '3', '4' ])
+                self.assertEqual(len(chatlog), 5)
+
+                # Restored from a session state
+                restored = ChatLog(2, spill)
+                restored.set_state(chatlog.get_state())
+                restored.append('5')
+                self.assertEqual(restored.recent(), [ '4', '5' ])
+                self.assertEqual(list(restored), [ str(i) for i in range(6) ])
+
+            # Deferred messages replaced by a restored state are not spilled
+            spill = create_chatlog_spill('file:///' + os.path.join(tmpdir, 'deferred'))
+            chatlog = ChatLog(2, spill)
+            chatlog.append('*Hi.*', defer = True)
+            chatlog.set_state(restored.get_state())
+            self.assertEqual(os.listdir(os.path.join(tmpdir, 'deferred')), [])
+
+            # Otherwise they are written with the next message
+            chatlog = ChatLog(2, spill)
+            chatlog.append('*Hi.*', defer = True)
+            chatlog.append('Hello')
+            self.assertEqual(list(spill.read(chatlog.log_id)), [ '*Hi.*', 'Hello' ])
+
+        self.assertIsNone(create_chatlog_spill(''))
+        with self.assertRaises(ValueError):
+            create_chatlog_spill('unknown://')
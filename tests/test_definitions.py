@@ -0,0 +1,45 @@
+import sys
+import os
+import gzip
+import json
+import tempfile
+import unittest
+from botstory.definitions import DefinitionLookup, DefinitionsError, \
+        build_definitions_table, wordnet_definitions, format_definitions
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+class TestDefinitions(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, 'definitions.json.gz')
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_table_lookup(self):
+        with gzip.open(self.path, 'wt', encoding = 'utf-8') as table_file:
+            json.dump({ 'format': '1', 'wordnet': '3.0',
+                        'definitions': [ 'a motor vehicle', 'a cable car' ],
+                        'lemmas': { 'car': [ 0, 1 ], 'auto': [ 0 ] } }, table_file)
+
+        definitions = DefinitionLookup(self.path, cache_size = 2)
+        self.assertEqual(definitions.lookup('Car'), "A motor vehicle. A cable car.")
+        self.assertEqual(definitions.lookup('auto'), "A motor vehicle.")
+        self.assertEqual(definitions.lookup_cached.cache_info().currsize, 2)
+
+        with open(self.path, 'w') as table_file:
+            table_file.write('no table')
+        with self.assertRaises(DefinitionsError):
+            DefinitionLookup(self.path)
+
+    def test_wordnet(self):
+        # A precompiled table answers like WordNet
+        counts = build_definitions_table(self.path, [ 'car', 'saw' ])
+        self.assertEqual(counts['lemmas'], 2)
+
+        definitions = DefinitionLookup(self.path)
+        for word in ('car', 'saw', 'cars'):
+            self.assertEqual(definitions.lookup(word),
+                    format_definitions(wordnet_definitions(word)))
+        self.assertIsNone(definitions.lookup('xqzvw'))
@@ -0,0 +1,82 @@
+import sys
+import os
+import datetime
+import unittest
+from botstory.botstory import BotStory
+from botstory.entities import EntitySchemaError
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+def nlp(numbers = (), word_classes = (), date = None, tokens = ('x',)):
+    return { 'query': ' '.join(tokens), 'tokens': list(tokens), 'numbers': list(numbers),
+             'word_classes': set(word_classes), 'date': date, 'lastnoun': None }
+
+class TestEntities(unittest.TestCase):
+    def build_story(self):
+        story = BotStory()
+        story.add_branch('init', [ 'quit' ], { })
+        story.add_branch('search', [ 'search' ], {
+            'date': { 'type': 'date', 'question': 'What date?' },
+            'quantity': { 'type': 'int:1:20', 'parallel_takeup': 'date', 'question': 'How many?' },
+            'catering': { 'type': 'bool', 'question': 'Catering?',
+                          'str_true': '', 'str_false': 'no ' },
+            'confirm': { 'type': 'bool_confirm', 'question': 'Correct?' } })
+        return story
+
+    def test_schema_errors(self):
+        story = BotStory()
+        for entities in [ { 'a': { 'type': 'float', 'question': 'A?' } },
+                          { 'a': { 'type': 'int:5:1', 'question': 'A?' } },
+                          { 'a': { 'type': 'int:x', 'question': 'A?' } },
+                          { 'a': { 'type': 'str' } },
+                          { 'a': { 'type': 'str', 'question': 'A?', 'parallel_takeup': 'b' } } ]:
+            with self.assertRaises(EntitySchemaError):
+                story.add_branch('broken', [], entities)
+        self.assertEqual(story.branches, [])
+
+    def test_entities(self):
+        story = self.build_story().new_session()
+        story.enter_branch('search')
+        self.assertEqual(story.get_last_requested_entity_buttons(), [ 'Today', 'Tomorrow' ])
+
+        # The quantity is taken up from the answer to the date question
+        story.nlp = nlp(numbers = [ 3 ], date = datetime.datetime(2020, 12, 1))
+        self.assertIsNone(story.process_entity_in_user_response())
+        self.assertEqual(story.entity_values['search']['quantity'], 3)
+
+        story.open_question = 'quantity'
+        self.assertEqual(story.get_last_requested_entity_buttons(), [ 1, 2, 3, 4, 5, 6, 7 ])
+        story.nlp = nlp(numbers = [ 30 ])
+        story.process_entity_in_user_response('catering')
+        story.nlp = nlp(word_classes = [ 'no' ])
+        story.process_entity_in_user_response('catering')
+        self.assertEqual(story.get_entity_values_formatted(), {
+            'date': '01/12/2020', 'quantity': 3, 'catering': 'no ', 'confirm': None })
+
+        story.open_question = 'confirm'
+        story.nlp = nlp()
+        self.assertEqual(story.process_entity_in_user_response(), story.lang['confirm_wrong'])
+        story.nlp = nlp(word_classes = [ 'no' ])
+        self.assertEqual(story.process_entity_in_user_response(), story.lang['no_confirm'])
+        self.assertEqual(story.get_branch_name(), 'init')
+
+    def test_sessions(self):
+        template = self.build_story()
+        story = template.new_session()
+        other = template.new_session()
+        self.assertIs(story.definition, other.definition)
+        self.assertFalse(hasattr(story, '__dict__'))
+
+        # Values are kept per session, unknown entities are rejected
+        story.enter_branch('search')
+        story.entity_values['search']['quantity'] = 4
+        self.assertEqual(story.get_entity_value('quantity'), 4)
+        self.assertIsNone(other.entity_values['search']['quantity'])
+        with self.assertRaises(KeyError):
+            story.entity_store_append({ 'size': 2 })
+        self.assertEqual(story.get_state()['entity_values'], { 'search': {
+            'date': None, 'quantity': 4, 'catering': None, 'confirm': None } })
+
+        # The shared definition cannot be changed anymore
+        with self.assertRaises(RuntimeError):
+            template.add_branch('late', [ 'late' ], { })
@@ -0,0 +1,50 @@
+import sys
+import os
+import unittest
+from botstory.instrumentation import Instrumentation, MemorySink, \
+        PrometheusSink, instrumentation, span, timed, timed_iter, add_sink, \
+        remove_sink
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+class TestInstrumentation(unittest.TestCase):
+    def test_disabled(self):
+        self.assertFalse(Instrumentation().enabled)
+        with Instrumentation().span('nlp') as current_span:
+            self.assertIsNone(current_span)
+
+    def test_spans(self):
+        sink = add_sink(MemorySink())
+        try:
+            process = timed('adapter.process', lambda: 42, adapter = 'Demo')
+            search = timed_iter('storage.filter', lambda: iter([ 1, 2 ]))
+
+            with span('turn'):
+                self.assertEqual(process(), 42)
+                self.assertEqual(list(search()), [ 1, 2 ])
+                with self.assertRaises(KeyError):
+                    with span('nlp'):
+                        raise KeyError('query')
+        finally:
+            remove_sink(sink)
+
+        self.assertFalse(instrumentation.enabled)
+        self.assertEqual([ (s.stage, s.depth, s.error) for s in sink.spans ], [
+            ('adapter.process', 1, False), ('storage.filter', 1, False),
+            ('nlp', 1, True), ('turn', 0, False) ])
+        self.assertEqual(sink.count('adapter.process', adapter = 'Demo'), 1)
+        self.assertEqual(sink.count('adapter.process', adapter = 'Other'), 0)
+        self.assertGreater(sink.seconds('turn'), 0)
+
+    def test_prometheus(self):
+        sink = PrometheusSink(buckets = (0.1, 1))
+        local = Instrumentation()
+        local.add_sink(sink)
+        with local.span('adapter.process', adapter = 'Demo'):
+            pass
+
+        text = sink.render()
+        self.assertIn('botstory_stage_seconds_bucket{stage="adapter.process",adapter="Demo",le="0.1"} 1', text)
+        self.assertIn('botstory_stage_seconds_bucket{stage="adapter.process",adapter="Demo",le="+Inf"} 1', text)
+        self.assertIn('botstory_stage_seconds_count{stage="adapter.process",adapter="Demo"} 1', text)
+        self.assertIn('botstory_stage_errors_total{stage="adapter.process",adapter="Demo"} 0', text)
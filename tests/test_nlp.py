@@ -2,7 +2,10 @@ import sys
 import os
 import unittest
 import string
-from botstory.nlp import nlp_analyze
+import datetime
+from botstory.nlp import nlp_analyze, NLPContext, cleaned_episode, \
+        nlp_resources, warm_up, nlp_analyze_many, WordClassMatcher, \
+        identify_word_classes, extract_date, find_numbers, message_words
 
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
@@ -59,8 +62,8 @@ class TestNLP(unittest.TestCase):
         nlp = nlp_analyze("Let's meet on Nov 12 2021.")
         self.assertEqual(str(nlp["date"]), "2021-11-12 00:00:00")
 
-        #nlp = nlp_analyze("Let's meet on Nov 12, 2021 for 2 days.") # fails
-        #self.assertEqual(str(nlp["date"]), "2021-11-12 00:00:00")
+        nlp = nlp_analyze("Let's meet on Nov 12, 2021 for 2 days.")
+        self.assertEqual(str(nlp["date"]), "2021-11-12 00:00:00")
 
         nlp = nlp_analyze("Let's meet on Nov 12, 2021 for two days.")
         self.assertEqual(str(nlp["date"]), "2021-11-12 00:00:00")
@@ -70,3 +73,107 @@ class TestNLP(unittest.TestCase):
 
         nlp = nlp_analyze("Let's meet on December 3rd 2020.")
         self.assertEqual(str(nlp["date"]), "2020-12-03 00:00:00")
+
+    def test_dates_and_numbers(self):
+        today = datetime.date(2021, 3, 10) # A Wednesday
+
+        self.assertEqual(extract_date("On 2021-12-01 please", today), datetime.datetime(2021, 12, 1))
+        self.assertEqual(extract_date("On 25/12/21", today), datetime.datetime(2021, 12, 25))
+        self.assertEqual(extract_date("The 3rd of May", today), datetime.datetime(2021, 5, 3))
+        self.assertEqual(extract_date("Tomorrow", today), datetime.datetime(2021, 3, 11))
+        self.assertEqual(extract_date("next wednesday", today), datetime.datetime(2021, 3, 17))
+        self.assertEqual(extract_date("on friday", today), datetime.datetime(2021, 3, 12))
+
+        # Numbers on their own are no dates
+        self.assertIsNone(extract_date("2 nights", today))
+        self.assertIsNone(extract_date("1 item please.", today))
+
+        # Spelled-out numbers of several words
+        self.assertEqual(find_numbers(["twenty", "one", "apples"]), (["21", "apples"], [21]))
+        self.assertEqual(find_numbers(["two", "hundred", "and", "five"]), (["205"], [205]))
+        self.assertEqual(find_numbers(["one", "and", "two"]), (["1", "and", "2"], [1, 2]))
+
+    def test_nlp_context(self):
+        word_classes = { 'vehicles': ['car', 'motorcycle' ] }
+        context = NLPContext()
+
+        # Repeated analysis of the same message is served from the cache
+        nlp = context.analyze("What does 'car' mean?", word_classes)
+        self.assertIs(context.analyze("What does 'car' mean?", word_classes), nlp)
+        self.assertEqual(nlp, nlp_analyze("What does 'car' mean?", word_classes))
+
+        # Other word classes or skip values reuse the tokens and tags
+        nlp_skip = context.analyze("What does 'car' mean?", None, 1)
+        self.assertIs(nlp_skip['tags'], nlp['tags'])
+        self.assertFalse("vehicles" in nlp_skip["word_classes"])
+        self.assertEqual(len(context.base), 1)
+
+        # Stages run only for the fields accessed
+        nlp = context.analyze("Yes, two please", { 'yes': ['yes'] })
+        self.assertTrue('yes' in nlp['word_classes'])
+        self.assertEqual(nlp['numbers'], [2])
+        self.assertEqual(sorted(context.base["Yes, two please"].fields),
+                ['numbers', 'query', 'tokens'])
+        self.assertEqual(dict(nlp), nlp_analyze("Yes, two please", { 'yes': ['yes'] }))
+
+        # Words for trigger pre-filters are split once per message
+        words = context.words("Define: Car!")
+        self.assertEqual(words, message_words("Define: Car!"))
+        self.assertEqual(words, frozenset([ 'define', 'car' ]))
+        self.assertIs(context.words("Define: Car!"), words)
+
+    def test_nlp_resources(self):
+        warm_up()
+        resources = nlp_resources()
+        self.assertIs(nlp_resources()['tagger'], resources['tagger'])
+        self.assertTrue('the' in resources['stopwords'])
+
+        # Punctuation is always removed, English stop words only on request
+        self.assertEqual(cleaned_episode("Where is the car?", None),
+                ['Where', 'is', 'the', 'car'])
+        self.assertEqual(cleaned_episode("Where is the car?", ['Where']),
+                ['car'])
+
+    def test_nlp_analyze_many(self):
+        word_classes = { 'vehicles': ['car', 'motorcycle' ] }
+        queries = [ "What does 'car' mean?", "I have 256, 2 and three apples.",
+                "Let's meet on Nov 12 2021.", "" ]
+
+        results = nlp_analyze_many(queries, word_classes)
+        self.assertEqual(len(results), len(queries))
+        for query, nlp in zip(queries, results):
+            self.assertEqual(nlp, nlp_analyze(query, word_classes))
+
+        # Spreading the batch on worker processes keeps the query order
+        results = nlp_analyze_many(queries * 3, word_classes, processes = 2,
+                chunk_size = 2)
+        self.assertEqual(results[5]["numbers"], [256, 2, 3])
+        self.assertEqual(str(results[10]["date"]), "2021-11-12 00:00:00")
+
+    def test_word_class_matcher(self):
+        matcher = WordClassMatcher({
+                'vehicles': ['car', 'motorcycle', 'fire truck' ],
+                'colours': ['red', 'blue' ]})
+        tokens = [ 'The', 'red', 'Fire', 'truck' ]
+
+        # Single words and phrases are matched case insensitively
+        self.assertEqual(matcher.match(tokens), {'vehicles', 'colours'})
+        self.assertEqual(identify_word_classes(tokens, matcher),
+                identify_word_classes(tokens, {'vehicles': ['fire truck'],
+                                               'colours': ['red']}))
+        self.assertEqual(matcher.match([ 'fire', 'red', 'truck' ]), {'colours'})
+
+        # Overlays replace word classes of the same name without touching
+        # the original matcher
+        overlay = matcher.overlay({ 'colours': ['green'], 'size': ['big'] })
+        self.assertEqual(overlay.match([ 'big', 'red', 'car' ]),
+                {'vehicles', 'size'})
+        self.assertEqual(matcher.match([ 'big', 'red', 'car' ]),
+                {'vehicles', 'colours'})
+        self.assertNotEqual(overlay.key, matcher.key)
+
+        # Redefined word classes keep their position
+        matcher.add('vehicles', [ 'bike' ])
+        self.assertEqual(matcher.match([ 'car', 'bike' ]), {'vehicles'})
+        self.assertEqual(matcher.ordered({'colours', 'vehicles', 'size'}),
+                ['vehicles', 'colours'])
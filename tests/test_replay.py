@@ -0,0 +1,30 @@
+import sys
+import os
+import unittest
+from botstory.replay import split_transcript, replay, format_transcript, \
+        diff_transcript
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+class EchoBot:
+    def __init__(self):
+        self.turns = 0
+
+    def process_query(self, query):
+        self.turns += 1
+        return "{} {}".format(self.turns, query.strip().upper())
+
+class TestReplay(unittest.TestCase):
+    def test_replay(self):
+        lines = [ "Hi\n", "Bye\n", "\n", "Hello\n" ]
+        conversations = split_transcript(lines)
+        self.assertEqual(conversations, [ [ "Hi\n", "Bye\n" ], [ "Hello\n" ] ])
+
+        # Every conversation gets a new session, output keeps the input order
+        expected = "> Hi\n1 HI\n> Bye\n2 BYE\n\n--- new conversation ---\n\n> Hello\n1 HELLO\n"
+        for processes in [ 1, 2 ]:
+            transcript = format_transcript(replay(conversations, EchoBot, processes))
+            self.assertEqual(transcript, expected)
+
+        self.assertEqual(diff_transcript(expected, expected), [])
+        self.assertNotEqual(diff_transcript(expected.replace("HELLO", "HEY"), expected), [])
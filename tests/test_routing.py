@@ -0,0 +1,99 @@
+import sys
+import os
+import logging
+import unittest
+from botstory.botstory import BotStory
+from botstory.nlp import NLPContext
+from botstory.conversation import ConversationState, active_conversation
+from botstory.routing import AdapterRouter, select_response
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+class Statement:
+    def __init__(self, text, in_response_to = None, conversation = None, persona = None):
+        self.text = text
+        self.in_response_to = in_response_to
+        self.conversation = conversation
+        self.persona = persona
+        self.confidence = 0
+
+class Adapter:
+    def __init__(self, name, confidence, trigger_words = None, story_adapter = False):
+        self.class_name = name
+        self.confidence = confidence
+        self.trigger_words = trigger_words
+        self.story_adapter = story_adapter
+        self.calls = 0
+
+    def can_process(self, statement):
+        return True
+
+    def process(self, statement, additional_response_selection_parameters = None):
+        self.calls += 1
+        response = Statement(self.class_name)
+        response.confidence = self.confidence
+        return response
+
+class Storage:
+    def get_object(self, name):
+        return Statement
+
+class ChatBot:
+    name = 'Test'
+    storage = Storage()
+    logger = logging.getLogger(__name__)
+
+    def __init__(self, logic_adapters):
+        self.logic_adapters = logic_adapters
+
+class TestRouting(unittest.TestCase):
+    def setUp(self):
+        self.story = Adapter('story', 1, frozenset([ 'order' ]), True)
+        self.definitions = Adapter('definitions', 0.9, frozenset([ 'what' ]))
+        self.best_match = Adapter('best_match', 0.5)
+        self.router = AdapterRouter(ChatBot([ self.story, self.definitions, self.best_match ]))
+
+        botstory = BotStory()
+        botstory.add_branch('init', [], {})
+        botstory.add_branch('search', [], { 'size': { 'type': 'str', 'question': 'Size?' } })
+        self.conversation = ConversationState(botstory.new_session())
+
+    def respond(self, text):
+        self.conversation.botstory.nlp_context = NLPContext()
+        with active_conversation(self.conversation):
+            return self.router.generate_response(Statement(text))
+
+    def calls(self):
+        return [ self.story.calls, self.definitions.calls, self.best_match.calls ]
+
+    def test_routing(self):
+        # Unclaimed messages fall back to adapters without trigger words
+        self.assertEqual(self.respond("Hello").text, 'best_match')
+        self.assertEqual(self.calls(), [ 0, 0, 1 ])
+
+        # Trigger words route to their adapters, without fallback on full confidence
+        self.assertEqual(self.respond("I'd like to order").text, 'story')
+        self.assertEqual(self.calls(), [ 1, 0, 1 ])
+
+        # Lower confidence keeps evaluating the remaining adapters
+        self.assertEqual(self.respond("What is a car?").text, 'definitions')
+        self.assertEqual(self.calls(), [ 1, 1, 2 ])
+
+        # Active story branches go to the story adapter
+        self.conversation.botstory.enter_branch('search')
+        self.assertEqual(self.respond("Large").text, 'story')
+        self.assertEqual(self.calls(), [ 2, 1, 2 ])
+
+    def test_select_response(self):
+        def statement(text, confidence):
+            result = Statement(text)
+            result.confidence = confidence
+            return result
+
+        # First one of the highest confidence
+        self.assertEqual(select_response([ statement('a', 0.5), statement('b', 0.9),
+                                           statement('c', 0.9) ]).text, 'b')
+
+        # Agreement of several adapters wins
+        self.assertEqual(select_response([ statement('a', 0.5), statement('b', 0.9),
+                                           statement('a', 0.3) ]).confidence, 0.5)
@@ -0,0 +1,97 @@
+import sys
+import os
+import time
+import datetime
+import tempfile
+import unittest
+from botstory.botstory import BotStory
+from botstory.conversation import ConversationState
+from botstory.sessionstore import MemorySessionStore, SQLiteSessionStore, \
+        SessionReaper, create_session_store, encode_state, decode_state
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+class TestSessionStore(unittest.TestCase):
+    def build_story(self):
+        story = BotStory()
+        story.add_branch('init', [ 'quit' ], { })
+        story.add_branch('search', [ 'search' ], {
+            'date': { 'type': 'date', 'question': 'What date?' },
+            'quantity': { 'type': 'int:1:20', 'question': 'How many?' } })
+        story.add_branch('action', [ 'action' ], {
+            'name': { 'type': 'str', 'question': 'What is your name?' } })
+        return story
+
+    def test_state_roundtrip(self):
+        story = self.build_story()
+        conversation = ConversationState(story.new_session())
+        conversation.botstory.enter_branch('search')
+        conversation.botstory.entity_store_append({
+            'date': datetime.datetime(2021, 11, 12), 'quantity': 2 })
+        conversation.botstory.enter_branch('action')
+        conversation.botstory.entity_store_copy('search')
+        conversation.search_results = [ { 'id': 1, 'name': 'Beach bar' } ]
+        conversation.button_overwrite['name'] = [ 'Peter' ]
+
+        state = decode_state(encode_state(conversation.get_state()))
+        restored = ConversationState(story.new_session())
+        restored.set_state(state)
+
+        self.assertEqual(restored.branch, 'action')
+        self.assertEqual(restored.open_question, 'name')
+        self.assertEqual(restored.entity_values['action']['date'],
+                datetime.datetime(2021, 11, 12))
+        self.assertEqual(restored.search_results[0]['name'], 'Beach bar')
+        self.assertEqual(restored.button_overwrite, { 'name': [ 'Peter' ] })
+        self.assertEqual(list(restored.botstory.entities['action']),
+                [ 'name', 'date', 'quantity' ])
+
+        # The storyline definition is left untouched
+        self.assertEqual(list(story.entities['action']), [ 'name' ])
+
+    def check_store(self, store):
+        state = { 'chatlog': [ '*Hi.*' ], 'date': datetime.date(2021, 1, 1) }
+
+        self.assertIsNone(store.load('a'))
+        self.assertFalse(store.touch('a'))
+        store.save('a', state)
+        store.save('b', state)
+        self.assertEqual(store.load('a'), state)
+        self.assertTrue(store.touch('a'))
+
+        store.delete('b')
+        self.assertIsNone(store.load('b'))
+
+        self.assertEqual(store.expire(60), 0)
+        time.sleep(0.01)
+        self.assertEqual(store.expire(0), 1)
+        self.assertIsNone(store.load('a'))
+
+    def test_memory_store(self):
+        self.check_store(MemorySessionStore())
+
+        # Least recently used sessions are dropped
+        store = MemorySessionStore(maxsize = 2)
+        for uid in [ 'a', 'b', 'c' ]:
+            store.save(uid, {})
+        self.assertIsNone(store.load('a'))
+        self.assertEqual(len(store), 2)
+
+    def test_session_reaper(self):
+        store = MemorySessionStore()
+        store.save('a', {})
+
+        reaper = SessionReaper(store, timeout = 0, interval = 0.01)
+        reaper.start()
+        time.sleep(0.1)
+        reaper.stop()
+        reaper.join()
+
+        self.assertEqual(len(store), 0)
+
+    def test_sqlite_store(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'sessions.sqlite3')
+            self.check_store(SQLiteSessionStore(path))
+            self.assertIsInstance(create_session_store('sqlite:///' + path),
+                    SQLiteSessionStore)